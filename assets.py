@@ -0,0 +1,102 @@
+"""Background asset loading with a progress screen.
+
+    loader = AssetLoader()
+    loader.submit("sprites", load_sprite_atlas, 2)
+    loader.submit("level", load_level_cached, "level/level1-1.tmx", 2)
+    if loader.wait(screen, clock):
+        atlas = loader.result("sprites")
+
+Image decoding, TMX parsing and level compiling run on a thread pool (pygame
+releases the GIL while it decodes) while the main thread keeps the window
+responsive and draws the progress bar. Music is only loaded once the game is
+on screen, see LazyMusic.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pygame
+
+STARTED = time.perf_counter()  # process start, close enough for time-to-first-frame
+
+
+class AssetLoader:
+    def __init__(self, workers=None):
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="assets")
+        self.futures = {}
+
+    def submit(self, name, fn, *args, **kwargs):
+        future = self.futures[name] = self.pool.submit(fn, *args, **kwargs)
+        return future
+
+    def image(self, name, path):
+        return self.submit(name, pygame.image.load, path)
+
+    @property
+    def progress(self):
+        if not self.futures:
+            return 1.0
+        return sum(future.done() for future in self.futures.values()) / len(self.futures)
+
+    def done(self):
+        return all(future.done() for future in self.futures.values())
+
+    def result(self, name):
+        """The loaded asset; re-raises whatever the loading task raised."""
+        return self.futures[name].result()
+
+    def wait(self, surface, clock, fps=30, font=None):
+        """Draw the loading screen until every asset is in. False if the window was closed."""
+        font = font or pygame.font.Font(None, 24)
+        while not self.done():
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.shutdown()
+                    return False
+            draw_loading_screen(surface, font, self.progress)
+            pygame.display.flip()
+            clock.tick(fps)
+        return True
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def draw_loading_screen(surface, font, progress):
+    width, height = surface.get_size()
+    bar = pygame.Rect(0, 0, width // 2, 12)
+    bar.center = (width // 2, height // 2)
+    surface.fill((0, 0, 0))
+    label = font.render(f"Loading {progress:.0%}", True, (255, 255, 255))
+    surface.blit(label, label.get_rect(midbottom=(bar.centerx, bar.top - 8)))
+    pygame.draw.rect(surface, (255, 255, 255), bar, 1)
+    pygame.draw.rect(surface, (255, 255, 255), (bar.x, bar.y, round(bar.width * progress), bar.height))
+
+
+class LazyMusic:
+    """Looping background music that is only loaded the first time start() is called."""
+
+    def __init__(self, path, volume=0.5):
+        self.path = path
+        self.volume = volume
+        self.started = False
+        self.muted = False
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        if not pygame.mixer.get_init():
+            return
+        pygame.mixer.music.load(self.path)
+        pygame.mixer.music.set_volume(self.volume)
+        pygame.mixer.music.play(loops=-1, start=0.0)
+
+    def toggle_mute(self):
+        self.muted = not self.muted
+        if pygame.mixer.get_init():
+            pygame.mixer.music.set_volume(0.0 if self.muted else self.volume)
+
+
+def time_to_first_frame():
+    """Milliseconds since the process imported this module."""
+    return (time.perf_counter() - STARTED) * 1000
@@ -0,0 +1,306 @@
+"""Headless benchmarks for the render, collision and load hot paths.
+
+    python benchmark.py --save bench_baseline.json
+    python benchmark.py --compare bench_baseline.json --threshold 0.15
+
+Runs under the SDL dummy video driver against the shipped levels plus
+synthetic copies stretched to 10x and 100x their length and object count.
+Every benchmark reports ops/sec and per-call p50/p95/max in ms. --save writes
+the results as a JSON baseline, --compare flags anything that got slower than
+the baseline by more than --threshold and exits with status 1.
+"""
+import argparse
+import base64
+import copy
+import gzip
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import zlib
+import xml.etree.ElementTree as ElementTree
+from array import array
+
+import pygame
+import pytmx
+
+from collision import CollisionGrid, get_collision_rects, handle_collisions
+from compile_level import load_level_cached
+from entities import GOOMBA, EntityPool, entity_blits, update_entities
+from profiler import percentile
+from render import ScrollRenderer, draw_tile_layers, tmx_chunk_renderer
+from solidity import build_solidity_map
+from simulation import INPUT_JUMP, INPUT_RIGHT, TICK_RATE, GameState, Level, step
+from sprites import build_sprite_atlas, load_entity_frames, load_sprite_atlas
+from tile_cache import TileCache
+
+LEVELS = ("level/level1-1.tmx", "level/level1.tmx")
+SYNTHETIC_REPEATS = (10, 100)
+SCALE_FACTOR = 2
+VIEW_SIZE = (800, 400)
+ENEMY_COUNT = 500
+CAMERA_STEP = 6  # px per frame, MOVE_SPEED * SCALE_FACTOR / TICK_RATE
+LEVEL_BENCHMARKS = (
+    "load_tmx", "load_compiled", "get_collision_rects", "collision_grid",
+    "handle_collisions", "tile_collisions", "step", "entities", "draw_tiles", "draw_chunks", "draw_scroll",
+)
+
+
+def _decode_layer(data):
+    if data.get("encoding") == "csv":
+        return [int(gid) for gid in data.text.replace("\n", "").split(",") if gid.strip()]
+    raw = base64.b64decode(data.text.strip())
+    if data.get("compression") == "zlib":
+        raw = zlib.decompress(raw)
+    elif data.get("compression") == "gzip":
+        raw = gzip.decompress(raw)
+    gids = array("I", raw)
+    if sys.byteorder != "little":
+        gids.byteswap()
+    return gids.tolist()
+
+
+def synthesize_level(filename, repeat, folder):
+    """Write a copy of a .tmx with its tiles and objects repeated `repeat` times to the right."""
+    tree = ElementTree.parse(filename)
+    root = tree.getroot()
+    source_folder = os.path.dirname(os.path.abspath(filename))
+    width = int(root.get("width"))
+    pixel_width = width * int(root.get("tilewidth"))
+    root.set("width", str(width * repeat))
+    for element in root.iter():
+        if element.tag in ("tileset", "image") and element.get("source"):
+            element.set("source", os.path.join(source_folder, element.get("source")))
+
+    for layer in root.iter("layer"):
+        data = layer.find("data")
+        gids = _decode_layer(data)
+        rows = [gids[row * width:(row + 1) * width] * repeat for row in range(len(gids) // width)]
+        data.attrib = {"encoding": "csv"}
+        data.text = "\n" + ",\n".join(",".join(map(str, row)) for row in rows) + "\n"
+        layer.set("width", str(width * repeat))
+
+    next_id = int(root.get("nextobjectid", 1))
+    for group in root.iter("objectgroup"):
+        objects = list(group.iter("object"))
+        for copy_index in range(1, repeat):
+            for obj in objects:
+                clone = copy.deepcopy(obj)
+                clone.set("x", str(float(obj.get("x", 0)) + copy_index * pixel_width))
+                clone.set("id", str(next_id))
+                next_id += 1
+                group.append(clone)
+    root.set("nextobjectid", str(next_id))
+
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    path = os.path.join(folder, f"{stem}.x{repeat}.tmx")
+    tree.write(path, encoding="UTF-8", xml_declaration=True)
+    return path
+
+
+def measure(fn, min_time=0.5, min_runs=3, max_runs=100000):
+    """Call fn until min_time has passed (and at least min_runs times); return timing stats."""
+    times = []
+    start = time.perf_counter()
+    while len(times) < max_runs and (len(times) < min_runs or time.perf_counter() - start < min_time):
+        before = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - before) * 1000)
+    times.sort()
+    total = sum(times)
+    return {
+        "runs": len(times),
+        "ops_per_sec": len(times) / total * 1000 if total else 0.0,
+        "mean_ms": total / len(times),
+        "p50_ms": percentile(times, 0.50),
+        "p95_ms": percentile(times, 0.95),
+        "max_ms": times[-1],
+    }
+
+
+def _camera_path(pixel_width, view_width):
+    """Endless camera sweep across the level, one CAMERA_STEP per frame."""
+    last = max(1, pixel_width - view_width)
+    position = 0
+    while True:
+        yield position
+        position = (position + CAMERA_STEP) % last
+
+
+def level_benchmarks(filename):
+    """(name, fn, min_runs) for every benchmark on one level."""
+    screen = pygame.display.get_surface()
+    tmx_data = pytmx.load_pygame(filename, pixelalpha=True)
+    load_level_cached(filename, SCALE_FACTOR)
+    tile_cache = TileCache(tmx_data, SCALE_FACTOR)
+    level = Level(tmx_data, SCALE_FACTOR, *VIEW_SIZE)
+    rects = level.collision_rects
+    view_width = screen.get_width()
+
+    def draw_path(draw):
+        cameras = _camera_path(level.pixel_width, view_width)
+        return lambda: draw(next(cameras))
+
+    def draw_tiles(camera_x):
+        screen.fill((0, 0, 0))
+        draw_tile_layers(tmx_data, screen, tile_cache, SCALE_FACTOR, camera_x, 0)
+
+    chunks = tmx_chunk_renderer(tmx_data, tile_cache, SCALE_FACTOR)
+
+    def draw_chunks(camera_x):
+        chunks.update(camera_x, view_width)
+        screen.fill((0, 0, 0))
+        chunks.draw(screen, camera_x)
+
+    scroller = ScrollRenderer(lambda surface, x, y: draw_tile_layers(tmx_data, surface, tile_cache, SCALE_FACTOR, x, y), screen)
+
+    def draw_scroll(camera_x):
+        scroller.begin_frame(camera_x)
+        scroller.end_frame()
+
+    probe = pygame.Rect(0, 0, 16 * SCALE_FACTOR, 16 * SCALE_FACTOR)
+    probe_path = _camera_path(level.pixel_width, probe.width)
+
+    def collide():
+        probe.topleft = (next(probe_path), 0)
+        # falling to the ground from the top of the level, resolved in 8 px steps
+        for _ in range(level.view_height // 8):
+            handle_collisions(probe, CAMERA_STEP, 8, level.collision_grid)
+
+    solidity = build_solidity_map(tmx_data, SCALE_FACTOR)
+    tile_probe = probe.copy()
+    tile_probe_path = _camera_path(level.pixel_width, probe.width)
+
+    def collide_tiles():
+        tile_probe.topleft = (next(tile_probe_path), 0)
+        for _ in range(level.view_height // 8):
+            solidity.move(tile_probe, CAMERA_STEP, 8)
+
+    states = [GameState(level)]
+    dt = 1.0 / TICK_RATE
+
+    def simulate():
+        state = states[0]
+        step(state, INPUT_RIGHT | INPUT_JUMP if state.tick % 40 < 20 else INPUT_RIGHT, dt)
+        if state.player_rect.bottom >= level.view_height or state.player_rect.right >= level.pixel_width - level.tile_size:
+            states[0] = GameState(level)
+
+    pool = EntityPool()
+    enemy_frames = load_entity_frames(SCALE_FACTOR)["goomba"]
+    frames = {GOOMBA: enemy_frames}
+    entity_ticks = [0]
+
+    def update_enemies():
+        # a fresh crowd every 10 s of game time, spread evenly along the level
+        if entity_ticks[0] % (TICK_RATE * 10) == 0:
+            pool.clear()
+            for number in range(ENEMY_COUNT):
+                pool.spawn(GOOMBA, 64 + number * (level.pixel_width - 128) // ENEMY_COUNT, 0, 32, 32)
+        update_entities(pool, solidity, SCALE_FACTOR, level.pixel_width, view_width, entity_ticks[0], dt)
+        screen.blits(entity_blits(pool, frames, 0, 0, view_width, level.view_height), False)
+        entity_ticks[0] += 1
+
+    return [
+        ("load_tmx", lambda: pytmx.load_pygame(filename, pixelalpha=True), 1),
+        ("load_compiled", lambda: load_level_cached(filename, SCALE_FACTOR), 3),
+        ("get_collision_rects", lambda: get_collision_rects(tmx_data, SCALE_FACTOR), 3),
+        ("collision_grid", lambda: CollisionGrid(rects, level.tile_size), 3),
+        ("handle_collisions", collide, 3),
+        ("tile_collisions", collide_tiles, 3),
+        ("step", simulate, 3),
+        ("entities", update_enemies, 3),
+        ("draw_tiles", draw_path(draw_tiles), 3),
+        ("draw_chunks", draw_path(draw_chunks), 3),
+        ("draw_scroll", draw_path(draw_scroll), 3),
+    ]
+
+
+def sprite_benchmarks(folder):
+    load_sprite_atlas(SCALE_FACTOR, folder)
+    return [
+        ("build_sprite_atlas", lambda: build_sprite_atlas(SCALE_FACTOR), 3),
+        ("load_sprite_atlas", lambda: load_sprite_atlas(SCALE_FACTOR, folder), 3),
+    ]
+
+
+def run(levels=LEVELS, repeats=SYNTHETIC_REPEATS, pattern=None, min_time=0.5, report=print):
+    """Run every benchmark whose name contains `pattern`; return {name: stats}."""
+    pygame.display.init()
+    pygame.display.set_mode(VIEW_SIZE)
+    results = {}
+
+    def run_group(prefix, benchmarks):
+        for name, fn, min_runs in benchmarks:
+            name = f"{prefix}/{name}"
+            if pattern and pattern not in name:
+                continue
+            results[name] = stats = measure(fn, min_time, min_runs)
+            report(format_row(name, stats))
+
+    with tempfile.TemporaryDirectory() as folder:
+        run_group("sprites", sprite_benchmarks(folder))
+        for filename in levels:
+            stem = os.path.splitext(os.path.basename(filename))[0]
+            for repeat in (1,) + tuple(repeats):
+                label = stem if repeat == 1 else f"{stem}.x{repeat}"
+                if pattern and not any(pattern in f"{label}/{name}" for name in LEVEL_BENCHMARKS):
+                    continue
+                path = filename if repeat == 1 else synthesize_level(filename, repeat, folder)
+                run_group(label, level_benchmarks(path))
+    pygame.display.quit()
+    return results
+
+
+def format_row(name, stats):
+    return f"{name:<40}{stats['ops_per_sec']:>12.1f} ops/s{stats['p50_ms']:>10.3f} ms p50{stats['p95_ms']:>10.3f} ms p95{stats['max_ms']:>10.3f} ms max"
+
+
+def compare(results, baseline, threshold):
+    """Names whose ops/sec dropped more than `threshold` (a fraction) below the baseline."""
+    regressions = []
+    for name, stats in results.items():
+        before = baseline.get(name)
+        if before and stats["ops_per_sec"] < before["ops_per_sec"] * (1 - threshold):
+            regressions.append((name, before["ops_per_sec"], stats["ops_per_sec"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("levels", nargs="*", default=list(LEVELS))
+    parser.add_argument("--repeats", type=int, nargs="*", default=list(SYNTHETIC_REPEATS), help="synthetic level lengths")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds spent on each benchmark")
+    parser.add_argument("--save", help="write the results to this JSON baseline")
+    parser.add_argument("--compare", help="JSON baseline to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown, 0.10 = 10%%")
+    args = parser.parse_args()
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    results = run(args.levels, args.repeats, args.filter, args.min_time)
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump({
+                "python": platform.python_version(),
+                "pygame": pygame.version.ver,
+                "machine": platform.machine(),
+                "results": results,
+            }, file, indent=2)
+        print(f"saved {len(results)} results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before:.1f} -> {after:.1f} ops/s ({after / before - 1:+.1%})")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions beyond {args.threshold:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""Record frames to a PNG sequence or a video stream without slowing the loop down.
+
+Saving a PNG inline costs more than a whole frame. FrameCapture only copies
+the surface's pixels (one memcpy through a get_view buffer, no format
+conversion) into one of a fixed set of buffers and hands it to a writer
+thread, which converts and encodes it. When every buffer is still waiting
+to be written the frame is dropped instead of waiting, so a slow disk costs
+frames in the recording, never frames in the game. The formats go by the
+file name:
+
+    clip.y4m            YUV4MPEG2 4:2:0 video, plays in mpv and converts with ffmpeg -i clip.y4m clip.mp4
+    clip.rgb            raw rgb24, ffmpeg -f rawvideo -pix_fmt rgb24 -s 800x400 -r 60 -i clip.rgb clip.mp4
+    frames/%05d.png     one PNG per frame, numbered by frame so drops leave gaps
+
+A video stream keeps its timing by writing the previous frame again for a
+dropped one. drop=False waits for a free buffer instead, for offline
+capture (replay.py --capture) where every frame counts.
+
+    capture = FrameCapture("clip.y4m", screen.get_size(), 60)
+    # every frame, after drawing
+    capture.capture(screen)
+    # on exit
+    capture.close()
+    print(capture)
+
+    python capture.py   # game-thread cost per frame, inline save vs capture
+"""
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+import pygame
+
+
+class FrameCapture:
+    """Copies frames into `buffers` reusable buffers and writes them on a thread."""
+
+    def __init__(self, path, size, fps, buffers=8, drop=True):
+        self.path = path
+        self.size = size
+        self.fps = fps
+        self.drop = drop
+        self.format = "y4m" if path.endswith(".y4m") else "rgb" if path.endswith((".rgb", ".raw")) else "png"
+        if self.format == "png":
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self.file = None if self.format == "png" else open(path, "wb")
+        if self.format == "y4m":
+            self.file.write(f"YUV4MPEG2 W{size[0]} H{size[1]} F{fps}:1 Ip A1:1 C420jpeg\n".encode())
+
+        self.capacity = buffers
+        self.free = queue.SimpleQueue()
+        self.pending = queue.SimpleQueue()
+        self.layout = None  # (pitch, byte offsets of r, g, b) of the surface the buffers were sized for
+        self.frames = 0  # frames offered
+        self.captured = 0
+        self.dropped = 0
+        self.written = 0  # frames in the output, repeats included
+        self.capture_ms = 0.0
+        self.max_capture_ms = 0.0
+        self.encode_ms = 0.0
+        self.error = None
+        self._thread = threading.Thread(target=self._write_loop, name="frame-capture", daemon=True)
+        self._thread.start()
+
+    def _setup(self, surface):
+        if surface.get_size() != tuple(self.size):
+            raise ValueError(f"capturing {self.size[0]}x{self.size[1]}, got a {surface.get_width()}x{surface.get_height()} surface")
+        if surface.get_bytesize() != 4:
+            raise ValueError("only 32-bit surfaces can be captured, capture the display rather than an 8-bit back buffer")
+        shifts = surface.get_shifts()[:3]
+        offsets = [shift // 8 if sys.byteorder == "little" else 3 - shift // 8 for shift in shifts]
+        self.layout = (surface.get_pitch(), offsets)
+        for _ in range(self.capacity):
+            self.free.put(np.empty(surface.get_pitch() * surface.get_height(), dtype=np.uint8))
+
+    def capture(self, surface):
+        """Queue a copy of surface's pixels; returns False when the frame was dropped."""
+        start = time.perf_counter()
+        if self.layout is None:
+            self._setup(surface)
+        self.frames += 1
+        try:
+            buffer = self.free.get(block=not self.drop)
+        except queue.Empty:
+            self.dropped += 1
+            return False
+        np.copyto(buffer, np.frombuffer(surface.get_view("0"), dtype=np.uint8))
+        self.pending.put((self.frames, buffer))
+        self.captured += 1
+        elapsed = (time.perf_counter() - start) * 1000
+        self.capture_ms += elapsed
+        self.max_capture_ms = max(self.max_capture_ms, elapsed)
+        return True
+
+    def _rgb(self, buffer):
+        pitch, offsets = self.layout
+        width, height = self.size
+        pixels = buffer.reshape(height, pitch)[:, :width * 4].reshape(height, width, 4)
+        return pixels[:, :, offsets]
+
+    def _encode(self, rgb):
+        if self.format == "rgb":
+            return rgb.tobytes()
+        # BT.601 limited range in integer math, the default every player assumes for Y4M
+        height, width = rgb.shape[:2]
+        r, g, b = (rgb[:, :, channel].astype(np.uint16) for channel in range(3))
+        y = ((66 * r + 129 * g + 25 * b + 128) >> 8) + 16
+        # 4:2:0, chroma of the summed colour of each 2x2 block
+        blocks = rgb[:height // 2 * 2, :width // 2 * 2].reshape(height // 2, 2, width // 2, 2, 3).sum(axis=(1, 3), dtype=np.int32)
+        r, g, b = blocks[:, :, 0], blocks[:, :, 1], blocks[:, :, 2]
+        u = ((-38 * r - 74 * g + 112 * b + 512) >> 10) + 128
+        v = ((112 * r - 94 * g - 18 * b + 512) >> 10) + 128
+        return b"FRAME\n" + b"".join(plane.astype(np.uint8).tobytes() for plane in (y, u, v))
+
+    def _write_loop(self):
+        previous = None
+        last = 0
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            number, buffer = item
+            try:
+                start = time.perf_counter()
+                rgb = self._rgb(buffer)
+                if self.format == "png":
+                    image = pygame.image.frombuffer(np.ascontiguousarray(rgb), self.size, "RGB")
+                    pygame.image.save(image, self.path % number)
+                    self.written += 1
+                else:
+                    frame = self._encode(rgb)
+                    # repeat the last frame for the dropped ones so the stream keeps its timing
+                    for _ in range(number - last - 1 if previous else 0):
+                        self.file.write(previous)
+                        self.written += 1
+                    self.file.write(frame)
+                    self.written += 1
+                    previous = frame
+                last = number
+                self.encode_ms += (time.perf_counter() - start) * 1000
+            except Exception as error:  # keep draining so capture() never blocks on a dead writer
+                self.error = error
+            finally:
+                self.free.put(buffer)
+
+    def close(self):
+        """Write out the queued frames and close the output."""
+        self.pending.put(None)
+        self._thread.join()
+        if self.file:
+            self.file.close()
+            self.file = None
+        if self.error:
+            raise self.error
+
+    def stats(self):
+        captured = self.captured or 1
+        return {
+            "frames": self.frames,
+            "captured": self.captured,
+            "dropped": self.dropped,
+            "written": self.written,
+            "capture_ms_mean": self.capture_ms / captured,
+            "capture_ms_max": self.max_capture_ms,
+            "encode_ms_mean": self.encode_ms / captured,
+        }
+
+    def __str__(self):
+        stats = self.stats()
+        return (f"{self.path}: {stats['captured']}/{stats['frames']} frames captured, {stats['dropped']} dropped, "
+                f"{stats['capture_ms_mean']:.3f} ms per frame on the game thread (max {stats['capture_ms_max']:.2f}), "
+                f"{stats['encode_ms_mean']:.2f} ms encoding on the writer")
+
+
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+
+    from compile_level import load_level_cached
+    from render import draw_tile_layers
+    from tile_cache import TileCache
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    screen = pygame.display.set_mode((800, 400))
+    tmx_data = load_level_cached("level/level1-1.tmx", 2)
+    tile_cache = TileCache(tmx_data, 2)
+    frames = 240
+    directory = tempfile.mkdtemp()
+
+    def draw(frame):
+        screen.fill((92, 148, 252))
+        draw_tile_layers(tmx_data, screen, tile_cache, 2, frame * 6, 0)
+
+    try:
+        start = time.perf_counter()
+        for frame in range(frames):
+            draw(frame)
+        draw_ms = (time.perf_counter() - start) * 1000 / frames
+        print(f"drawing alone: {draw_ms:.2f} ms per frame")
+
+        start = time.perf_counter()
+        for frame in range(frames):
+            draw(frame)
+            pygame.image.save(screen, os.path.join(directory, f"inline{frame:05d}.png"))
+        print(f"inline pygame.image.save: {(time.perf_counter() - start) * 1000 / frames - draw_ms:.2f} ms per frame")
+
+        for name in ("clip.y4m", "clip.rgb", "png/%05d.png"):
+            capture = FrameCapture(os.path.join(directory, name), screen.get_size(), 60)
+            for frame in range(frames):
+                draw(frame)
+                capture.capture(screen)
+                # pace like a 60 fps loop so the writer gets the frame time a game would leave it
+                time.sleep(max(0.0, 1 / 60 - draw_ms / 1000))
+            capture.close()
+            print(capture)
+    finally:
+        shutil.rmtree(directory)
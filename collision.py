@@ -0,0 +1,139 @@
+import pygame
+
+COLLISION_OBJECTS = ("ground", "bricks", "pipes", "coins")
+
+
+def object_kind(obj, group):
+    """Object name, falling back to the object group name (level1.tmx leaves objects unnamed)."""
+    return (obj.name or group.name or "").lower()
+
+
+def get_collision_rects(tmx_data, scale_factor, kinds=COLLISION_OBJECTS):
+    if hasattr(tmx_data, "collision_rects"):
+        # compiled levels store their rects already scaled
+        return tmx_data.collision_rects(scale_factor, kinds)
+    collision_rects = []
+    for group in tmx_data.objectgroups:
+        for obj in group:
+            if object_kind(obj, group) in kinds:
+                rect = pygame.Rect(obj.x * scale_factor, obj.y * scale_factor, obj.width * scale_factor, obj.height * scale_factor)
+                collision_rects.append(rect)
+    return collision_rects
+
+
+def level_objects(tmx_data, scale_factor):
+    """(kind, scaled rect) for every object in the level."""
+    if hasattr(tmx_data, "level_objects"):
+        return tmx_data.level_objects(scale_factor)
+    return [
+        (object_kind(obj, group), pygame.Rect(obj.x * scale_factor, obj.y * scale_factor, obj.width * scale_factor, obj.height * scale_factor))
+        for group in tmx_data.objectgroups
+        for obj in group
+    ]
+
+
+class CollisionGrid:
+    """Broad-phase index of collision rects bucketed by column.
+
+    Every rect is stored in each cell_size wide column it overlaps, so a query
+    only looks at the rects in the columns the query rect touches. Results keep
+    the order the rects were added in, which keeps collision resolution
+    identical to scanning the full list.
+    """
+
+    def __init__(self, rects=(), cell_size=32):
+        self.cell_size = cell_size
+        self.rects = []
+        self.cells = {}
+        for rect in rects:
+            self.add(rect)
+
+    def __len__(self):
+        return len(self.rects) - self.rects.count(None)
+
+    def _columns(self, rect):
+        return range(rect.left // self.cell_size, (rect.right - 1) // self.cell_size + 1)
+
+    def add(self, rect):
+        index = len(self.rects)
+        self.rects.append(rect)
+        for column in self._columns(rect):
+            self.cells.setdefault(column, []).append(index)
+        return index
+
+    def remove(self, index):
+        rect = self.rects[index]
+        if rect is None:
+            return
+        for column in self._columns(rect):
+            cell = self.cells[column]
+            cell.remove(index)
+            if not cell:
+                del self.cells[column]
+        self.rects[index] = None
+
+    def query_indices(self, rect):
+        cells = self.cells
+        columns = self._columns(rect)
+        if len(columns) == 1:
+            return cells.get(columns[0], ())
+        indices = set()
+        for column in columns:
+            cell = cells.get(column)
+            if cell:
+                indices.update(cell)
+        return sorted(indices)
+
+    def query(self, rect):
+        """Return the rects in the columns `rect` touches (a superset of the hits)."""
+        rects = self.rects
+        return [rects[index] for index in self.query_indices(rect)]
+
+    def colliding(self, rect):
+        """Return the rects that actually overlap `rect`."""
+        return [other for other in self.query(rect) if rect.colliderect(other)]
+
+
+def _sweep(collision_grid, player_rect, area):
+    """Yield candidate rects in index order for a player moving through `area`.
+
+    If resolving against a rect pushes the player outside the area queried so
+    far, the query is widened so the result matches a scan of every rect.
+    """
+    rects = collision_grid.rects
+    indices = collision_grid.query_indices(area)
+    position = 0
+    while position < len(indices):
+        index = indices[position]
+        position += 1
+        yield rects[index]
+        if not area.contains(player_rect):
+            area = area.union(player_rect)
+            indices = [other for other in collision_grid.query_indices(area) if other > index]
+            position = 0
+
+
+def handle_collisions(player_rect, player_vx, player_vy, collision_grid):
+    start = player_rect.copy()
+    player_rect.x += player_vx
+    for rect in _sweep(collision_grid, player_rect, start.union(player_rect)):
+        if player_rect.colliderect(rect):
+            if player_vx > 0:
+                player_rect.right = rect.left
+            elif player_vx < 0:
+                player_rect.left = rect.right
+
+    start = player_rect.copy()
+    player_rect.y += player_vy
+    on_ground = False
+    for rect in _sweep(collision_grid, player_rect, start.union(player_rect)):
+        if player_rect.colliderect(rect):
+            if player_vy > 0:
+                player_rect.bottom = rect.top
+                player_vy = 0
+                on_ground = True
+            elif player_vy < 0:
+                player_rect.top = rect.bottom
+                player_vy = 0
+
+    return player_rect, player_vy, on_ground
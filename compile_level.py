@@ -0,0 +1,351 @@
+"""Compile .tmx levels into a binary file that loads with mmap.
+
+    python compile_level.py level/level1-1.tmx [--scale 2]
+
+Layout: an 8 byte magic/header-length prefix, a JSON header, then 8-byte
+aligned sections the header points at:
+
+- one uint16 gid grid (height x width) per tile layer
+- objects as int32 (kind, x, y, width, height) records, already scaled
+- the solidity bitmap, one uint8 per tile (see solidity.py)
+- the tile atlas, every used tile pre-sliced and pre-scaled, as raw RGBA
+
+The header also keeps the Tiled gid and flip flags behind every gid, so a
+level can be matched up with a fresh parse of its .tmx (see hot_reload.py),
+and the tile properties the game reads (TILE_PROPERTIES) per gid.
+
+load_compiled_level() maps the file and hands out memoryview/NumPy views and
+atlas subsurfaces straight over the mapping, nothing is copied. The header
+records the size and mtime of the .tmx and every tileset/image it uses, and
+load_level_cached() recompiles when any of them changed.
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+from array import array
+
+import numpy as np
+import pygame
+import pytmx
+
+from collision import COLLISION_OBJECTS, object_kind
+from level_edits import EDIT_PROPERTIES
+from solidity import SOLID_PROPERTIES, solidity_cells
+
+MAGIC = b"MLVL"
+VERSION = 4
+TILE_PROPERTIES = SOLID_PROPERTIES + EDIT_PROPERTIES
+ALIGN = 8
+ATLAS_COLUMNS = 16
+
+
+def compiled_path(filename, scale_factor):
+    return f"{os.path.splitext(filename)[0]}.{scale_factor}x.lvl"
+
+
+def source_files(filename):
+    """The .tmx plus every external tileset and image it depends on."""
+    files = [filename]
+    pending = [filename]
+    while pending:
+        current = pending.pop()
+        folder = os.path.dirname(current)
+        root = ElementTree.parse(current).getroot()
+        for tileset in root.iter("tileset"):
+            if tileset.get("source"):
+                path = os.path.normpath(os.path.join(folder, tileset.get("source")))
+                files.append(path)
+                pending.append(path)
+        for image in root.iter("image"):
+            files.append(os.path.normpath(os.path.join(folder, image.get("source"))))
+    return files
+
+
+def stamp(path):
+    """[path, mtime, size] of a file, with None for both when it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return [path, None, None]
+    return [path, stat.st_mtime_ns, stat.st_size]
+
+
+def raw_image_loader(filename, colorkey, **kwargs):
+    """pytmx image loader for tiles without a display: pytmx's pygame loader converts them, this one doesn't."""
+    image = pygame.image.load(filename)
+
+    def load_image(rect=None, flags=None):
+        tile = image.subsurface(rect).copy() if rect else image.copy()
+        if flags:
+            tile = pytmx.util_pygame.handle_transformation(tile, flags)
+        if colorkey:
+            tile.set_colorkey(pygame.Color(f"#{colorkey}"))
+        return tile
+
+    return load_image
+
+
+def _pad(blob):
+    blob.extend(b"\0" * (-len(blob) % ALIGN))
+
+
+def compile_level(filename, scale_factor, output=None):
+    tmx_data = pytmx.TiledMap(filename, image_loader=raw_image_loader)
+    tile_width = tmx_data.tilewidth * scale_factor
+    tile_height = tmx_data.tileheight * scale_factor
+    body = bytearray()
+
+    layers = []
+    for layer in tmx_data.layers:
+        if isinstance(layer, pytmx.TiledTileLayer):
+            gids = array("H", (gid for row in layer.data for gid in row))
+            layers.append({"name": layer.name, "visible": bool(layer.visible), "offset": len(body)})
+            body.extend(gids.tobytes())
+            _pad(body)
+
+    kinds = []
+    records = array("i")
+    for group in tmx_data.objectgroups:
+        for obj in group:
+            kind = object_kind(obj, group)
+            if kind not in kinds:
+                kinds.append(kind)
+            rect = pygame.Rect(obj.x * scale_factor, obj.y * scale_factor, obj.width * scale_factor, obj.height * scale_factor)
+            records.extend((kinds.index(kind), rect.x, rect.y, rect.width, rect.height))
+    objects = {"offset": len(body), "count": len(records) // 5}
+    body.extend(records.tobytes())
+    _pad(body)
+
+    solidity = {"offset": len(body)}
+    body.extend(solidity_cells(tmx_data))
+    _pad(body)
+
+    slots = array("h", [-1] * len(tmx_data.images))
+    tiles = []
+    for gid, image in enumerate(tmx_data.images):
+        if image:
+            slots[gid] = len(tiles)
+            tiles.append(pygame.transform.scale(image, (tile_width, tile_height)))
+    rows = max(1, -(-len(tiles) // ATLAS_COLUMNS))
+    atlas = pygame.Surface((ATLAS_COLUMNS * tile_width, rows * tile_height), pygame.SRCALPHA)
+    for slot, tile in enumerate(tiles):
+        # max against the cleared atlas copies pixels and alpha as-is instead of blending
+        atlas.blit(tile, ((slot % ATLAS_COLUMNS) * tile_width, (slot // ATLAS_COLUMNS) * tile_height), special_flags=pygame.BLEND_RGBA_MAX)
+    atlas_header = {"slots_offset": len(body), "slot_count": len(slots)}
+    body.extend(slots.tobytes())
+    _pad(body)
+    atlas_header.update(offset=len(body), width=atlas.get_width(), height=atlas.get_height(), columns=ATLAS_COLUMNS)
+    body.extend(pygame.image.tobytes(atlas, "RGBA"))
+
+    tile_keys = [None] * len(tmx_data.images)
+    for tiled_gid, entries in tmx_data.gidmap.items():
+        for gid, flags in entries:
+            if gid < len(tile_keys):
+                tile_keys[gid] = [tiled_gid, *(int(flag) for flag in flags)]
+
+    tile_properties = {}
+    for gid, props in tmx_data.tile_properties.items():
+        kept = {name: props[name] for name in TILE_PROPERTIES if name in props}
+        if kept:
+            tile_properties[gid] = kept
+
+    header = {
+        "version": VERSION,
+        "byteorder": sys.byteorder,
+        "scale_factor": scale_factor,
+        "width": tmx_data.width,
+        "height": tmx_data.height,
+        "tilewidth": tmx_data.tilewidth,
+        "tileheight": tmx_data.tileheight,
+        "layers": layers,
+        "kinds": kinds,
+        "objects": objects,
+        "solidity": solidity,
+        "atlas": atlas_header,
+        "tile_keys": tile_keys,
+        "tile_properties": tile_properties,
+        "sources": [stamp(path) for path in source_files(filename)],
+    }
+    header_bytes = bytearray(json.dumps(header).encode())
+    header_bytes.extend(b" " * (-(len(header_bytes) + 8) % ALIGN))
+
+    output = output or compiled_path(filename, scale_factor)
+    temp = f"{output}.{os.getpid()}.tmp"
+    with open(temp, "wb") as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<I", len(header_bytes)))
+        file.write(header_bytes)
+        file.write(body)
+    # workers may compile the same level at once, the rename keeps readers safe
+    os.replace(temp, output)
+    return output
+
+
+class CompiledTileLayer(pytmx.TiledTileLayer):
+    # skips TiledTileLayer.__init__, there is no XML node to parse
+    def __init__(self, id, name, visible, grid, width, height):
+        # TiledElement.__getattr__ looks attributes up in properties, so it has to exist
+        self.properties = {}
+        self.id = id
+        self.name = name
+        self.visible = visible
+        self.width = width
+        self.height = height
+        # rows are memoryview slices for fast per-gid indexing, array is the NumPy view
+        self.data = [grid[row * width:(row + 1) * width] for row in range(height)]
+        self.array = np.frombuffer(grid, dtype=np.uint16).reshape(height, width)
+
+
+class CompiledLevel:
+    """Read-only level backed by an mmap of a compiled .lvl file.
+
+    Offers the parts of the pytmx.TiledMap interface the game uses (width,
+    height, tile size, visible_layers, tile_properties, get_tile_image_by_gid) plus
+    collision_rects() and solidity_cells() for the collision code.
+    """
+
+    def __init__(self, path):
+        self.filename = path
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        buffer = memoryview(self._mmap)
+        if bytes(buffer[:4]) != MAGIC:
+            raise ValueError(f"{path} is not a compiled level")
+        (header_length,) = struct.unpack_from("<I", buffer, 4)
+        header = json.loads(bytes(buffer[8:8 + header_length]))
+        if header["version"] != VERSION or header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was compiled for a different format")
+        self.header = header
+        body = buffer[8 + header_length:]
+
+        self.scale_factor = header["scale_factor"]
+        self.width = header["width"]
+        self.height = header["height"]
+        self.tilewidth = header["tilewidth"]
+        self.tileheight = header["tileheight"]
+        cells = self.width * self.height
+        self.layers = []
+        for index, layer in enumerate(header["layers"]):
+            grid = body[layer["offset"]:layer["offset"] + cells * 2].cast("H")
+            self.layers.append(CompiledTileLayer(index + 1, layer["name"], layer["visible"], grid, self.width, self.height))
+
+        objects = header["objects"]
+        records = body[objects["offset"]:objects["offset"] + objects["count"] * 20].cast("i")
+        self.kinds = header["kinds"]
+        self.objects = np.frombuffer(records, dtype=np.int32).reshape(objects["count"], 5)
+        self.solidity = body[header["solidity"]["offset"]:header["solidity"]["offset"] + cells]
+
+        atlas = header["atlas"]
+        self.slots = body[atlas["slots_offset"]:atlas["slots_offset"] + atlas["slot_count"] * 2].cast("h")
+        pixels = body[atlas["offset"]:atlas["offset"] + atlas["width"] * atlas["height"] * 4]
+        self.atlas = pygame.image.frombuffer(pixels, (atlas["width"], atlas["height"]), "RGBA")
+        self._atlas_columns = atlas["columns"]
+        self._tiles = {}
+        self._keys = {gid: (key[0], tuple(key[1:])) for gid, key in enumerate(header["tile_keys"]) if key}
+        # JSON keys are strings
+        self.tile_properties = {int(gid): props for gid, props in header["tile_properties"].items()}
+
+    @property
+    def visible_layers(self):
+        return (layer for layer in self.layers if layer.visible)
+
+    def collision_rects(self, scale_factor, kinds=COLLISION_OBJECTS):
+        if scale_factor != self.scale_factor:
+            raise ValueError(f"level compiled at {self.scale_factor}x, asked for {scale_factor}x")
+        wanted = [index for index, kind in enumerate(self.kinds) if kind in kinds]
+        return [pygame.Rect(*record[1:].tolist()) for record in self.objects if record[0] in wanted]
+
+    def level_objects(self, scale_factor):
+        if scale_factor != self.scale_factor:
+            raise ValueError(f"level compiled at {self.scale_factor}x, asked for {scale_factor}x")
+        return [(self.kinds[record[0]], pygame.Rect(*record[1:])) for record in self.objects.tolist()]
+
+    def solidity_cells(self):
+        return self.solidity
+
+    def tile_keys(self):
+        """{gid: (Tiled gid, flip flags)}."""
+        return dict(self._keys)
+
+    def _scaled(self, image):
+        return pygame.transform.scale(image, (self.tilewidth * self.scale_factor, self.tileheight * self.scale_factor))
+
+    def add_tile(self, key, image):
+        """Give a tile the compiled file doesn't have a gid of its own; return the gid."""
+        gid = max(len(self.slots), max(self._keys, default=0) + 1)
+        self._keys[gid] = key
+        self._tiles[gid] = self._scaled(image)
+        return gid
+
+    def set_tile_image(self, gid, image):
+        self._tiles[gid] = self._scaled(image)
+
+    def get_tile_image_by_gid(self, gid):
+        """Pre-scaled tile for gid, a subsurface of the mapped atlas."""
+        tile = self._tiles.get(gid)
+        if tile is None:
+            if gid <= 0 or gid >= len(self.slots) or self.slots[gid] < 0:
+                return None
+            slot = self.slots[gid]
+            tile_width = self.tilewidth * self.scale_factor
+            tile_height = self.tileheight * self.scale_factor
+            tile = self.atlas.subsurface(
+                ((slot % self._atlas_columns) * tile_width, (slot // self._atlas_columns) * tile_height, tile_width, tile_height))
+            self._tiles[gid] = tile
+        return tile
+
+
+def is_stale(path):
+    """True when the compiled file is missing or any of its sources changed."""
+    try:
+        with open(path, "rb") as file:
+            if file.read(4) != MAGIC:
+                return True
+            (header_length,) = struct.unpack("<I", file.read(4))
+            header = json.loads(file.read(header_length))
+    except (OSError, ValueError):
+        return True
+    if header.get("version") != VERSION or header.get("byteorder") != sys.byteorder:
+        return True
+    return any(stamp(source[0]) != source for source in header["sources"])
+
+
+def load_compiled_level(path):
+    return CompiledLevel(path)
+
+
+def load_level_cached(filename, scale_factor):
+    """Load the compiled form of a .tmx, (re)compiling it first when it is stale."""
+    path = compiled_path(filename, scale_factor)
+    if is_stale(path):
+        compile_level(filename, scale_factor, path)
+    return CompiledLevel(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compile .tmx levels to .lvl")
+    parser.add_argument("levels", nargs="+")
+    parser.add_argument("--scale", type=int, default=2)
+    parser.add_argument("--force", action="store_true", help="rebuild even when up to date")
+    args = parser.parse_args()
+
+    for filename in args.levels:
+        path = compiled_path(filename, args.scale)
+        if args.force or is_stale(path):
+            start = time.perf_counter()
+            compile_level(filename, args.scale, path)
+            print(f"compiled {filename} -> {path} ({os.path.getsize(path)} bytes, {time.perf_counter() - start:.3f}s)")
+        else:
+            print(f"{path} is up to date")
+        start = time.perf_counter()
+        CompiledLevel(path)
+        print(f"  loads in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""Endless mode: a level generated column by column ahead of the camera.
+
+EndlessMap stands in for a loaded tmx_data (the renderers, TileCache,
+simulation.Level and LevelEdits read it like any level) but only ever holds
+WINDOW columns. A seeded Generator fills it from a base level: authored
+sections cut out of the base map between plain ground columns, and runs of
+ground, pits and floating brick rows built from the base level's own tiles.
+Every column carries its solidity and the entities standing in it.
+
+Once the camera is SHIFT columns in, World.tick calls advance(), which drops
+the SHIFT columns behind the camera together with their solidity and
+entities, generates SHIFT new ones at the end and moves the player, camera,
+entities and renderer caches back by the same distance. Coordinates stay
+small and nothing grows with the distance run.
+
+    python endless.py [minutes] [seed]   # soak test: memory and tick cost over a long bot run, fails if the bot stops rebasing
+"""
+import random
+from collections import Counter, deque
+
+import numpy as np
+import pygame
+import pytmx
+
+from collision import level_objects
+from entities import KINDS, OBJECT_KINDS, SIZES
+from render import visible_tile_layers
+from solidity import solidity_cells
+
+WINDOW = 128  # columns held at once
+SHIFT = 64  # columns dropped and generated per rebase, a multiple of the chunk width in tiles
+START_COLUMNS = 24  # plain ground under the player start
+MAX_SECTION = 32  # widest authored section, in columns
+SECTION_CHANCE = 0.4
+PIT_CHANCE = 0.3
+BRICK_CHANCE = 0.5
+GOOMBA_CHANCE = 0.5
+BRICK_HEIGHT = 4  # rows between the ground and a floating brick row
+
+
+class Generator:
+    """An endless, seed-reproducible stream of columns made from a base level.
+
+    A column is (gids, solid, objects): a tuple of rows per visible tile layer,
+    the solidity byte of every row and (kind, bottom) pairs of the objects
+    standing in it, bottom in unscaled pixels.
+    """
+
+    def __init__(self, base, scale_factor, seed=0):
+        self.random = random.Random(seed)
+        layers = visible_tile_layers(base)
+        width, height = base.width, base.height
+        cells = solidity_cells(base)
+        # compiled levels only hand out their objects at the scale they were compiled at
+        base_objects = [(kind, pygame.Rect([value // scale_factor for value in rect])) for kind, rect in level_objects(base, scale_factor)]
+        objects = {}
+        for kind, rect in base_objects:
+            if kind in OBJECT_KINDS:
+                # one name per entity kind, "coins" would count as a collision object
+                objects.setdefault(rect.x // base.tilewidth, []).append((KINDS[OBJECT_KINDS[kind]], rect.bottom))
+        self.columns = [
+            (
+                tuple(tuple(layer.data[y][x] for y in range(height)) for layer in layers),
+                bytes(cells[y * width + x] for y in range(height)),
+                tuple(objects.get(x, ())),
+            )
+            for x in range(width)
+        ]
+
+        # the most common column is plain ground, authored sections start and end on one
+        self.ground = Counter(self.columns).most_common(1)[0][0]
+        self.ground_row = self.ground[1].find(1) if 1 in self.ground[1] else height
+        pits = [column for column in self.columns if not any(column[1])]
+        self.pit = pits[0] if pits else None
+        self.tileheight = base.tileheight
+        self.brick, self.block = self._block_gids(base, layers, base_objects)
+        cuts = [x for x, column in enumerate(self.columns) if column == self.ground]
+        self.sections = []
+        for start, end in zip(cuts, cuts[1:]):
+            if 1 < end - start <= MAX_SECTION:
+                self.sections.append((start, end))
+        self.queue = deque(self.ground for _ in range(START_COLUMNS))
+        self.after_pit = False
+
+    def _block_gids(self, base, layers, objects):
+        """(brick gid, coin block gid) as (layer index, gid), from the tiles under the base level's objects."""
+        found = {}
+        for kind, rect in objects:
+            if kind in ("bricks", "coins") and kind not in found:
+                x, y = rect.x // base.tilewidth, rect.y // base.tileheight
+                for index, layer in enumerate(layers):
+                    if 0 <= x < base.width and 0 <= y < base.height and layer.data[y][x]:
+                        found[kind] = (index, layer.data[y][x])
+        return found.get("bricks"), found.get("coins")
+
+    def _with_block(self, column, block, objects=()):
+        layer, gid = block
+        row = self.ground_row - BRICK_HEIGHT
+        gids = list(column[0])
+        gids[layer] = gids[layer][:row] + (gid,) + gids[layer][row + 1:]
+        solid = column[1][:row] + b"\1" + column[1][row + 1:]
+        return tuple(gids), solid, column[2] + tuple(objects)
+
+    def _segment(self):
+        choose = self.random
+        if self.after_pit:
+            self.after_pit = False
+        elif self.sections and choose.random() < SECTION_CHANCE:
+            start, end = choose.choice(self.sections)
+            return self.columns[start:end + 1]
+        elif self.pit is not None and choose.random() < PIT_CHANCE:
+            self.after_pit = True
+            return [self.pit] * choose.randint(2, 3)
+
+        run = [self.ground] * choose.randint(4, 12)
+        bottom = self.ground_row * self.tileheight
+        if self.brick and len(run) >= 6 and choose.random() < BRICK_CHANCE:
+            start = choose.randint(1, len(run) - 5)
+            length = choose.randint(3, min(5, len(run) - start - 1))
+            coin = choose.randrange(length) if self.block else None
+            for offset in range(length):
+                if offset == coin:
+                    block_bottom = (self.ground_row - BRICK_HEIGHT + 1) * self.tileheight
+                    run[start + offset] = self._with_block(run[start + offset], self.block, [("coin", block_bottom)])
+                else:
+                    run[start + offset] = self._with_block(run[start + offset], self.brick)
+        if choose.random() < GOOMBA_CHANCE:
+            x = choose.randrange(2, len(run))
+            gids, solid, objects = run[x]
+            run[x] = (gids, solid, objects + (("goomba", bottom),))
+        return run
+
+    def next_columns(self, count):
+        while len(self.queue) < count:
+            self.queue.extend(self._segment())
+        return [self.queue.popleft() for _ in range(count)]
+
+
+class EndlessLayer(pytmx.TiledTileLayer):
+    # skips TiledTileLayer.__init__ like compile_level.CompiledTileLayer, rows are rewritten in place
+    def __init__(self, id, name, width, height):
+        self.properties = {}
+        self.id = id
+        self.name = name
+        self.visible = True
+        self.width = width
+        self.height = height
+        self.data = [[0] * width for _ in range(height)]
+
+
+class EndlessMap:
+    """A WINDOW-column level fed by a Generator, with the tmx_data interface the game uses.
+
+    renderers get rebase(dx) whenever the level moves dx pixels left
+    (ChunkRenderer, ScrollRenderer, quality.SpriteThrottle).
+    """
+
+    def __init__(self, base, scale_factor, seed=0, width=WINDOW, shift=SHIFT):
+        self.base = base
+        self.scale_factor = scale_factor
+        self.seed = seed
+        self.generator = Generator(base, scale_factor, seed)
+        self.width = width
+        self.height = base.height
+        self.tilewidth = base.tilewidth
+        self.tileheight = base.tileheight
+        self.shift_columns = shift
+        self.tile_properties = {}
+        self.objectgroups = []
+        self.layers = [EndlessLayer(layer.id, layer.name, width, self.height) for layer in visible_tile_layers(base)]
+        self.cells = bytearray(width * self.height)
+        self.objects = []  # (kind, absolute column, bottom) in the window
+        self.origin = 0  # absolute column of window column 0
+        self.renderers = []
+        self.rebases = 0
+        self._write(0, self.generator.next_columns(width))
+
+    @property
+    def visible_layers(self):
+        return iter(self.layers)
+
+    def get_tile_image_by_gid(self, gid):
+        return self.base.get_tile_image_by_gid(gid)
+
+    def collision_rects(self, scale_factor, kinds=None):
+        # everything solid is in the solidity bitmap, see solidity_cells()
+        return []
+
+    def level_objects(self, scale_factor):
+        """The entity objects standing in the window, in window coordinates."""
+        tile_width, tile_height = self.tilewidth * scale_factor, self.tileheight * scale_factor
+        return [
+            (kind, pygame.Rect((column - self.origin) * tile_width, bottom * scale_factor - tile_height, tile_width, tile_height))
+            for kind, column, bottom in self.objects
+        ]
+
+    def solidity_cells(self):
+        return bytearray(self.cells)
+
+    def _write(self, first, columns):
+        """Put columns into the window from column `first` on; returns their solidity, row-major."""
+        count = len(columns)
+        new_cells = bytearray(count * self.height)
+        for offset, (gids, solid, objects) in enumerate(columns):
+            x = first + offset
+            for layer, rows in zip(self.layers, gids):
+                for y, gid in enumerate(rows):
+                    layer.data[y][x] = gid
+            for y, value in enumerate(solid):
+                self.cells[y * self.width + x] = value
+                new_cells[y * count + offset] = value
+            self.objects.extend((kind, self.origin + x, bottom) for kind, bottom in objects)
+        return new_cells
+
+    def advance(self, world):
+        """Rebase once the camera is shift columns in; returns True when it did."""
+        dx = self.shift_columns * self.tilewidth * self.scale_factor
+        if world.state.camera_x < dx:
+            return False
+        shift, width = self.shift_columns, self.width
+        for layer in self.layers:
+            for row in layer.data:
+                row[:width - shift] = row[shift:]
+        for y in range(self.height):
+            self.cells[y * width:(y + 1) * width - shift] = self.cells[y * width + shift:(y + 1) * width]
+        self.origin += shift
+        self.objects = [entry for entry in self.objects if entry[1] >= self.origin]
+        known = len(self.objects)
+        new_cells = self._write(width - shift, self.generator.next_columns(shift))
+
+        maps = {id(world.solidity): world.solidity}
+        if world.level.solidity is not None:
+            maps[id(world.level.solidity)] = world.level.solidity
+        for solidity in maps.values():
+            solidity.shift(shift, new_cells)
+        for state in (world.state, world.previous):
+            state.player_rect.x -= dx
+            state.camera_x -= dx
+
+        pool = world.pool
+        alive = np.flatnonzero(pool.alive)
+        pool.x[alive] -= dx
+        pool.despawn(alive[pool.x[alive] + pool.width[alive] <= 0])
+        scale = self.scale_factor
+        for kind, rect in self.level_objects(scale)[known:]:
+            kind = OBJECT_KINDS[kind]
+            entity_width, entity_height = SIZES[kind]
+            pool.spawn(kind, rect.x, rect.bottom - entity_height * scale, entity_width * scale, entity_height * scale)
+
+        for renderer in self.renderers:
+            renderer.rebase(dx)
+        self.rebases += 1
+        return True
+
+
+def bot_inputs(world, tile_size):
+    """Run right, jumping at walls, pits and enemies ahead and backing off from enemies it would land next to."""
+    from simulation import INPUT_JUMP, INPUT_LEFT, INPUT_RIGHT
+
+    state = world.state
+    rect = state.player_rect
+    solidity = world.level.solidity
+    blocked = solidity.is_solid((rect.right + tile_size) // tile_size, (rect.bottom - 1) // tile_size)
+    pit = solidity.ground_top(rect.move(2 * tile_size, 0)) is None
+    pool = world.pool
+    enemies = pool.indices(active=True)
+    gap = pool.x[enemies] - rect.right
+    ahead = enemies[(gap > -tile_size) & (gap < 3 * tile_size)]
+    if not state.on_ground and (pool.y[ahead] < rect.bottom + tile_size // 2).any() and state.vy > 0:
+        return INPUT_LEFT
+    return INPUT_RIGHT | (INPUT_JUMP if blocked or pit or len(ahead) else 0)
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import time
+    import tracemalloc
+
+    from compile_level import load_level_cached
+    from game import World
+    from profiler import percentile
+    from render import tmx_chunk_renderer
+    from simulation import TICK_RATE, Level
+    from tile_cache import TileCache
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    scale = 2
+    endless = EndlessMap(load_level_cached("level/level1-1.tmx", scale), scale, seed)
+    level = Level(endless, scale, 800, 400, tile_collision=True)
+    world = World(level, level.solidity)
+    tile_cache = TileCache(endless, scale)
+    chunks = tmx_chunk_renderer(endless, tile_cache, scale)
+    endless.renderers.append(chunks)
+    view = pygame.Surface((800, 400))
+
+    tracemalloc.start()
+    dt = 1.0 / TICK_RATE
+    times = []
+    deaths = 0
+    reported = 0  # rebases at the last report
+    for tick in range(int(minutes * 60 * TICK_RATE)):
+        start = time.perf_counter()
+        _, hurt = world.tick(bot_inputs(world, level.tile_size), dt)
+        camera_x = world.state.camera_x
+        chunks.update(camera_x, 800)
+        first, last = chunks.visible_chunks(camera_x, 800)
+        for index in range(first, last):
+            chunk = chunks.chunks.get(index) or chunks._build(index)
+            view.blit(chunk, (index * chunks.chunk_width - camera_x, 0))
+        times.append((time.perf_counter() - start) * 1000)
+        deaths += hurt
+        if (tick + 1) % (60 * TICK_RATE) == 0:
+            times.sort()
+            columns = endless.origin + camera_x // level.tile_size
+            current, _ = tracemalloc.get_traced_memory()
+            print(f"{(tick + 1) // (60 * TICK_RATE):3d} min  {columns:6d} columns  {endless.rebases:4d} rebases  "
+                  f"{len(world.pool):3d} entities  {len(chunks.chunks)} chunks  {len(tile_cache)} tiles  "
+                  f"{current / 1024:7.0f} KB traced  p50 {percentile(times, 0.5):.3f} ms  p99 {percentile(times, 0.99):.3f} ms  "
+                  f"{deaths} deaths")
+            # without rebases the run never streamed a level and the numbers above measure nothing
+            if endless.rebases == reported:
+                print(f"STALLED: no rebase in the last minute, the bot is stuck at column {columns}")
+                sys.exit(1)
+            reported = endless.rebases
+            times = []
@@ -0,0 +1,274 @@
+"""Enemies, coins and other level entities as NumPy struct-of-arrays.
+
+Every entity is a slot in a set of parallel arrays (position, velocity, size,
+kind, animation frame) in an EntityPool. Systems update whole batches with
+array operations instead of looping over Python objects, and despawned slots
+go onto a free list for the next spawn, so hundreds of goombas cost about as
+much as one.
+
+Enemies sleep until the camera gets near them, then walk, fall and turn around
+at walls against the level's solidity bitmap. Coins wait inside their coin
+block until the player bumps it from below, then pop out and are counted.
+
+    python entities.py level/level1.tmx 500
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+from collision import level_objects
+from simulation import GRAVITY, JUMP_STRENGTH, TICK_RATE
+
+KINDS = ("coin", "goomba", "koopa")
+COIN, GOOMBA, KOOPA = range(len(KINDS))
+# object group (or object name) -> entity kind
+OBJECT_KINDS = {"coins": COIN, "coin": COIN, "goombas": GOOMBA, "goomba": GOOMBA, "turtles": KOOPA, "koopa": KOOPA}
+SIZES = {COIN: (16, 16), GOOMBA: (16, 16), KOOPA: (16, 24)}
+
+ENEMY_SPEED = 30  # px/s
+STOMP_BOUNCE = JUMP_STRENGTH // 2  # px/s
+COIN_POP = -360  # px/s
+COIN_LIFETIME = 0.5  # s
+ANIMATION_DELAY = 8  # ticks per walk frame
+ACTIVATION_MARGIN = 64  # px past the right edge of the view where enemies wake up
+
+
+class EntityPool:
+    def __init__(self, capacity=256):
+        self.capacity = 0
+        self.alive = np.zeros(0, dtype=bool)
+        self.active = np.zeros(0, dtype=bool)
+        self.kind = np.zeros(0, dtype=np.int8)
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.vx = np.zeros(0)
+        self.vy = np.zeros(0)
+        self.width = np.zeros(0, dtype=np.int32)
+        self.height = np.zeros(0, dtype=np.int32)
+        self.frame = np.zeros(0, dtype=np.int16)
+        self.timer = np.zeros(0)
+        self.free = []
+        self._grow(capacity)
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def _grow(self, capacity):
+        extra = capacity - self.capacity
+        for name in ("alive", "active", "kind", "x", "y", "vx", "vy", "width", "height", "frame", "timer"):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate((array, np.zeros(extra, dtype=array.dtype))))
+        # pop() hands out the lowest free slot first
+        self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def spawn(self, kind, x, y, width, height, vx=0.0, vy=0.0, active=False):
+        if not self.free:
+            self._grow(self.capacity * 2 or 16)
+        index = self.free.pop()
+        self.alive[index] = True
+        self.active[index] = active
+        self.kind[index] = kind
+        self.x[index] = x
+        self.y[index] = y
+        self.vx[index] = vx
+        self.vy[index] = vy
+        self.width[index] = width
+        self.height[index] = height
+        self.frame[index] = 0
+        self.timer[index] = 0.0
+        return index
+
+    def despawn(self, indices):
+        """Free one slot or an array of slots for reuse."""
+        indices = np.atleast_1d(indices)
+        indices = indices[self.alive[indices]]
+        self.alive[indices] = False
+        self.active[indices] = False
+        self.free.extend(indices.tolist())
+        # keep handing out the lowest slot first, so slot numbers only depend on what happened
+        self.free.sort(reverse=True)
+
+    def indices(self, kind=None, active=None):
+        mask = self.alive.copy()
+        if kind is not None:
+            mask &= self.kind == kind
+        if active is not None:
+            mask &= self.active == active
+        return np.flatnonzero(mask)
+
+    def clear(self):
+        self.despawn(np.flatnonzero(self.alive))
+
+
+def spawn_level_entities(pool, tmx_data, scale_factor, kinds=(COIN, GOOMBA, KOOPA)):
+    """Spawn an entity for every coin, goomba and koopa object in the level; return the count."""
+    count = 0
+    for kind, rect in level_objects(tmx_data, scale_factor):
+        kind = OBJECT_KINDS.get(kind)
+        if kind not in kinds:
+            continue
+        width, height = SIZES[kind]
+        # objects mark the tile the entity stands in, taller sprites grow upwards
+        pool.spawn(kind, rect.x, rect.bottom - height * scale_factor, width * scale_factor, height * scale_factor)
+        count += 1
+    return count
+
+
+def _solid(grid, columns, rows):
+    height, width = grid.shape
+    inside = (columns >= 0) & (columns < width) & (rows >= 0) & (rows < height)
+    solid = np.zeros(len(columns), dtype=bool)
+    solid[inside] = grid[rows[inside], columns[inside]] != 0
+    return solid
+
+
+def activate(pool, camera_x, view_width, scale_factor):
+    """Wake up the enemies the camera is about to reach; they walk left from then on."""
+    waking = pool.alive & ~pool.active & (pool.kind != COIN) & (pool.x < camera_x + view_width + ACTIVATION_MARGIN * scale_factor)
+    pool.active |= waking
+    pool.vx[waking] = -ENEMY_SPEED * scale_factor
+
+
+def move_enemies(pool, solidity, scale_factor, rate):
+    """Gravity, walking and tile collision for every active enemy at once."""
+    index = np.flatnonzero(pool.active & (pool.kind != COIN))
+    if not len(index):
+        return
+    size = solidity.tile_size
+    grid = np.frombuffer(solidity.cells, dtype=np.uint8).reshape(solidity.height, solidity.width)
+    x, y = pool.x[index], pool.y[index]
+    vx, vy = pool.vx[index], pool.vy[index] + GRAVITY * scale_factor / rate
+    width, height = pool.width[index], pool.height[index]
+
+    # walls: check the leading column at the top, middle and bottom rows, then turn around
+    new_x = x + vx / rate
+    column = np.floor_divide(np.where(vx > 0, new_x + width - 1, new_x), size).astype(np.int64)
+    blocked = np.zeros(len(index), dtype=bool)
+    for edge in (y, y + height // 2, y + height - 1):
+        blocked |= _solid(grid, column, np.floor_divide(edge, size).astype(np.int64))
+    blocked &= vx != 0
+    new_x = np.where(blocked, np.where(vx > 0, column * size - width, (column + 1) * size), new_x)
+    vx = np.where(blocked, -vx, vx)
+
+    # floor: land on the first solid row under either foot
+    new_y = y + vy / rate
+    row = np.floor_divide(new_y + height - 1, size).astype(np.int64)
+    left = np.floor_divide(new_x, size).astype(np.int64)
+    right = np.floor_divide(new_x + width - 1, size).astype(np.int64)
+    landed = (vy > 0) & (_solid(grid, left, row) | _solid(grid, right, row))
+    new_y = np.where(landed, row * size - height, new_y)
+    vy = np.where(landed, 0.0, vy)
+
+    pool.x[index], pool.y[index] = new_x, new_y
+    pool.vx[index], pool.vy[index] = vx, vy
+
+    fallen = index[new_y > solidity.height * size]
+    if len(fallen):
+        pool.despawn(fallen)
+
+
+def move_coins(pool, scale_factor, rate):
+    """Popped coins fly up, fall back and vanish after COIN_LIFETIME."""
+    index = np.flatnonzero(pool.active & (pool.kind == COIN))
+    if not len(index):
+        return
+    pool.vy[index] += GRAVITY * scale_factor / rate
+    pool.y[index] += pool.vy[index] / rate
+    pool.timer[index] -= 1.0 / rate
+    done = index[pool.timer[index] <= 0]
+    if len(done):
+        pool.despawn(done)
+
+
+def animate(pool, tick):
+    pool.frame[pool.active] = tick // ANIMATION_DELAY % 2
+
+
+def _overlapping(pool, index, rect):
+    return index[
+        (pool.x[index] < rect.right) & (pool.x[index] + pool.width[index] > rect.left)
+        & (pool.y[index] < rect.bottom) & (pool.y[index] + pool.height[index] > rect.top)
+    ]
+
+
+def interact(pool, state, previous_vy):
+    """Player contacts for this tick; return (coins collected, enemies stomped, hurt).
+
+    A stomp needs the player falling with its feet in the top half of the
+    enemy, any other touch hurts. Bumping a block from below (upward motion
+    stopped by a collision) pops the coin hidden inside it.
+    """
+    player_rect = state.player_rect
+    scale = state.level.scale_factor
+    coins = 0
+    if previous_vy < 0 and state.vy == 0:
+        head = player_rect.move(0, -1)
+        head.height = 1
+        hit = _overlapping(pool, pool.indices(COIN, active=False), head)
+        if len(hit):
+            pool.active[hit] = True
+            pool.vy[hit] = COIN_POP * scale
+            pool.timer[hit] = COIN_LIFETIME
+            coins = len(hit)
+
+    enemies = np.flatnonzero(pool.active & (pool.kind != COIN))
+    touching = _overlapping(pool, enemies, player_rect)
+    if not len(touching):
+        return coins, 0, False
+    stomped = touching[(state.vy > 0) & (player_rect.bottom <= pool.y[touching] + pool.height[touching] // 2)]
+    if len(stomped):
+        pool.despawn(stomped)
+        state.vy = STOMP_BOUNCE * scale
+        state.on_ground = False
+    return coins, len(stomped), len(stomped) < len(touching)
+
+
+def update_entities(pool, solidity, scale_factor, camera_x, view_width, tick, dt=1.0 / TICK_RATE):
+    """Run every entity system for one simulation tick."""
+    rate = 1.0 / dt
+    activate(pool, camera_x, view_width, scale_factor)
+    move_enemies(pool, solidity, scale_factor, rate)
+    move_coins(pool, scale_factor, rate)
+    animate(pool, tick)
+
+
+def entity_blits(pool, frames, camera_x, camera_y, view_width, view_height):
+    """(image, position) pairs for the active entities on screen, ready for Surface.blits.
+
+    frames[kind][direction][frame], direction 0 faces right and 1 faces left.
+    """
+    index = np.flatnonzero(
+        pool.active
+        & (pool.x + pool.width > camera_x) & (pool.x < camera_x + view_width)
+        & (pool.y + pool.height > camera_y) & (pool.y < camera_y + view_height)
+    )
+    blits = []
+    for kind, x, y, vx, frame in zip(
+            pool.kind[index].tolist(), pool.x[index].tolist(), pool.y[index].tolist(),
+            pool.vx[index].tolist(), pool.frame[index].tolist()):
+        images = frames[kind][1 if vx < 0 else 0]
+        blits.append((images[frame % len(images)], (int(x) - camera_x, int(y) - camera_y)))
+    return blits
+
+
+if __name__ == "__main__":
+    from solidity import build_solidity_map
+    from simulation import load_level
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    filename = sys.argv[1] if len(sys.argv) > 1 else "level/level1.tmx"
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    level = load_level(filename, 2, 800, 400)
+    solidity = build_solidity_map(level.tmx_data, 2)
+    pool = EntityPool()
+    for number in range(count):
+        pool.spawn(GOOMBA, 64 + number * (level.pixel_width - 128) // count, 0, 32, 32)
+    ticks = TICK_RATE * 10
+    start = time.perf_counter()
+    for tick in range(ticks):
+        update_entities(pool, solidity, 2, level.pixel_width, level.view_width, tick)
+    elapsed = time.perf_counter() - start
+    print(f"{count} goombas, {ticks} ticks in {elapsed:.3f}s ({elapsed / ticks * 1000:.3f} ms/tick), {len(pool)} left")
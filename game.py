@@ -0,0 +1,60 @@
+"""The full game's rules for one tick: player, entities, block bumps and respawns.
+
+main-test.py runs World.tick under its display loop and replay.py runs it
+headless, so a recorded session replays through exactly the same code.
+"""
+from entities import GOOMBA, KOOPA, EntityPool, interact, spawn_level_entities, update_entities
+from level_edits import LevelEdits
+from simulation import GameState, load_level, step
+from solidity import build_solidity_map
+
+
+class World:
+    """The player, the entity pool and the editable level, stepped together."""
+
+    def __init__(self, level, solidity, pool=None, edits=None):
+        self.level = level
+        self.solidity = solidity
+        if pool is None:
+            pool = EntityPool()
+            spawn_level_entities(pool, level.tmx_data, level.scale_factor)
+        self.pool = pool
+        self.edits = edits or LevelEdits(level, solidity)
+        self.state = GameState(level)
+        self.previous = self.state.copy()
+        self.coins = 0
+        self.contact_vy = 0  # player vy when entities were touched this tick, see rewind.pack_state
+
+    def tick(self, inputs, dt):
+        """Advance one simulation step; returns (coins collected, hurt)."""
+        level = self.level
+        self.previous = self.state.copy()
+        state = self.state
+        step(state, inputs, dt)
+        update_entities(self.pool, self.solidity, level.scale_factor, state.camera_x, level.view_width, state.tick, dt)
+        self.contact_vy = state.vy
+        collected, _, hurt = interact(self.pool, state, self.previous.vy)
+        if self.previous.vy < 0 and state.vy == 0:
+            self.edits.bump(state.player_rect)
+        self.coins += collected
+        if hurt:
+            self.respawn()
+        if hasattr(level.tmx_data, "advance"):
+            # endless levels stream in columns and rebase coordinates here, so replays see it too
+            level.tmx_data.advance(self)
+        return collected, hurt
+
+    def respawn(self):
+        """Start over with fresh enemies, smashed bricks and emptied blocks stay."""
+        pool = self.pool
+        self.state = GameState(self.level)
+        self.previous = self.state.copy()
+        pool.despawn(pool.indices(GOOMBA))
+        pool.despawn(pool.indices(KOOPA))
+        spawn_level_entities(pool, self.level.tmx_data, self.level.scale_factor, (GOOMBA, KOOPA))
+
+
+def load_world(filename, scale_factor, view_width, view_height, compiled=True):
+    """A headless World for a level, no tile images or renderers."""
+    level = load_level(filename, scale_factor, view_width, view_height, compiled)
+    return World(level, build_solidity_map(level.tmx_data, scale_factor))
@@ -0,0 +1,528 @@
+"""Race the ghosts of other players over UDP.
+
+    python ghost.py serve [--host 0.0.0.0] [--port 9999]
+    python ghost.py load-test [--clients 300] [--seconds 10]
+
+Every client sends its player (position, velocity, pose) SEND_RATE times a
+second in one CLIENT_STATE datagram, which also acks the last snapshot the
+client decoded. SNAPSHOT_RATE times a second the server sends every client a
+snapshot of the MAX_GHOSTS other players nearest to it on the same level.
+Positions are quantized to 1/POSITION_STEPS native pixels and velocities to
+native px/s, so players on different scale factors see each other. A snapshot
+only carries the fields that changed since the snapshot the client acked, as
+zigzag varint deltas, which keeps a client at a few KB/s. A lost datagram
+only costs freshness, the next snapshot is encoded against what did arrive.
+
+GhostClient runs its socket on an asyncio loop in a background thread, so the
+game loop never waits on the network: it calls send() after a tick and ghosts()
+when drawing, which interpolates each ghost INTERPOLATION_DELAY behind the
+newest snapshot.
+
+The load test runs a server and hundreds of headless clients stepping
+simulation.GameState on loopback, checks every decoded snapshot against what
+the server meant to send and reports bandwidth per client.
+"""
+import argparse
+import asyncio
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+
+import numpy as np
+
+from simulation import INPUT_JUMP, INPUT_RIGHT, TICK_RATE, GameState, load_level, step
+from sprites import SMALL, player_pose
+
+PORT = 9999
+SEND_RATE = 20  # client states per second
+SNAPSHOT_RATE = 20  # snapshots per second
+MAX_GHOSTS = 16  # nearest players in a snapshot
+HISTORY = 32  # snapshots a client can still ack
+TIMEOUT = 5.0  # seconds of silence before the server forgets a client
+INTERPOLATION_DELAY = 0.1  # seconds ghosts are drawn behind the newest snapshot
+EXTRAPOLATE = 0.25  # seconds a ghost keeps moving on its velocity when snapshots stop
+POSITION_STEPS = 4  # quantization steps per native pixel
+UDP_OVERHEAD = 28  # IPv4 + UDP header bytes per datagram, counted in the bandwidth figures
+
+STATE, SNAPSHOT = 1, 2
+NO_ACK = 0xFFFF
+# kind, level, ack, tick, x, y, vx, vy, pose, frame
+CLIENT_STATE = struct.Struct("<BIHIihhhBB")
+# kind, seq, base seq, server tick, ghosts, removed
+SNAPSHOT_HEADER = struct.Struct("<BHHIBB")
+FIELDS = 6  # x, y, vx, vy, pose, frame
+
+
+def level_id(filename):
+    return zlib.crc32(os.path.basename(filename).encode())
+
+
+def quantize(state, scale_factor):
+    """(x, y, vx, vy, pose, frame) of a simulation.GameState in network units."""
+    action, direction, frame = player_pose(state)
+    rect = state.player_rect
+    return (
+        round(rect.x * POSITION_STEPS / scale_factor),
+        round(rect.y * POSITION_STEPS / scale_factor),
+        max(-32768, min(32767, round(state.vx / scale_factor))),
+        max(-32768, min(32767, round(state.vy / scale_factor))),
+        action | direction << 2 | SMALL << 3,
+        frame % 256,
+    )
+
+
+def _put(buffer, value):
+    """Append value as a zigzag varint."""
+    value = value * 2 if value >= 0 else -value * 2 - 1
+    while value >= 0x80:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _get(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (value >> 1 if not value & 1 else -(value >> 1) - 1), offset
+
+
+def _encode_ghost(ghost, values, old):
+    buffer = bytearray()
+    old = old or (0,) * FIELDS
+    mask = 0
+    for field in range(FIELDS):
+        if values[field] != old[field]:
+            mask |= 1 << field
+    _put(buffer, ghost)
+    buffer.append(mask)
+    for field in range(FIELDS):
+        if mask & 1 << field:
+            _put(buffer, values[field] - old[field])
+    return bytes(buffer)
+
+
+def encode_snapshot(seq, tick, view, base_seq=NO_ACK, base=None, cache=None):
+    """Snapshot datagram of view ({ghost id: values}) as a delta against base.
+
+    cache ({(ghost, old values): bytes}) shares encoded ghosts between clients
+    that acked the same state of a ghost, which most clients did.
+    """
+    base = base or {}
+    buffer = bytearray(SNAPSHOT_HEADER.size)
+    count = 0
+    for ghost, values in view.items():
+        old = base.get(ghost)
+        if old == values:
+            continue
+        if cache is None:
+            buffer += _encode_ghost(ghost, values, old)
+        else:
+            key = (ghost, old)
+            entry = cache.get(key)
+            if entry is None:
+                entry = cache[key] = _encode_ghost(ghost, values, old)
+            buffer += entry
+        count += 1
+    removed = [ghost for ghost in base if ghost not in view]
+    for ghost in removed:
+        _put(buffer, ghost)
+    SNAPSHOT_HEADER.pack_into(buffer, 0, SNAPSHOT, seq, base_seq if base else NO_ACK, tick, count, len(removed))
+    return bytes(buffer)
+
+
+def decode_snapshot(data, history):
+    """(seq, tick, view) of a snapshot datagram; None if its base isn't in history ({seq: view})."""
+    _, seq, base_seq, tick, count, removed = SNAPSHOT_HEADER.unpack_from(data)
+    if base_seq == NO_ACK:
+        view = {}
+    elif base_seq in history:
+        view = dict(history[base_seq])
+    else:
+        return None
+    offset = SNAPSHOT_HEADER.size
+    for _ in range(count):
+        ghost, offset = _get(data, offset)
+        mask = data[offset]
+        offset += 1
+        values = list(view.get(ghost, (0,) * FIELDS))
+        for field in range(FIELDS):
+            if mask & 1 << field:
+                delta, offset = _get(data, offset)
+                values[field] += delta
+        view[ghost] = tuple(values)
+    for _ in range(removed):
+        ghost, offset = _get(data, offset)
+        view.pop(ghost, None)
+    return seq, tick, view
+
+
+class _Peer:
+    __slots__ = ("id", "level", "values", "ack", "sent", "seen", "bytes_in", "bytes_out")
+
+    def __init__(self, ghost_id):
+        self.id = ghost_id
+        self.level = None
+        self.values = None
+        self.ack = NO_ACK
+        self.sent = [None] * HISTORY  # (seq, view) by seq % HISTORY
+        self.seen = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+class GhostServer(asyncio.DatagramProtocol):
+    """Collects client states and sends each client the ghosts nearest to it."""
+
+    def __init__(self, snapshot_rate=SNAPSHOT_RATE, max_ghosts=MAX_GHOSTS):
+        self.snapshot_rate = snapshot_rate
+        self.max_ghosts = max_ghosts
+        self.transport = None
+        self.peers = {}  # address -> _Peer
+        self.next_id = 0
+        self.seq = 0
+        self.start = time.perf_counter()
+        self.broadcast_ms = deque(maxlen=1000)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        if len(data) != CLIENT_STATE.size or data[0] != STATE:
+            return
+        peer = self.peers.get(address)
+        if peer is None:
+            peer = self.peers[address] = _Peer(self.next_id)
+            self.next_id = (self.next_id + 1) % 0x10000
+        _, peer.level, peer.ack, _, *values = CLIENT_STATE.unpack(data)
+        peer.values = tuple(values)
+        peer.seen = time.perf_counter()
+        peer.bytes_in += len(data) + UDP_OVERHEAD
+
+    def tick(self):
+        return int((time.perf_counter() - self.start) * TICK_RATE)
+
+    def broadcast(self):
+        """Send one round of snapshots."""
+        start = time.perf_counter()
+        for address in [address for address, peer in self.peers.items() if start - peer.seen > TIMEOUT]:
+            del self.peers[address]
+        # 0xFFFF is NO_ACK, seq skips it
+        self.seq = (self.seq + 1) % NO_ACK
+        tick = self.tick()
+        cache = {}  # ghost ids are unique across levels
+        levels = {}
+        for address, peer in self.peers.items():
+            if peer.values is not None:
+                levels.setdefault(peer.level, []).append((address, peer))
+        for members in levels.values():
+            positions = np.array([peer.values[:2] for _, peer in members], dtype=np.int64)
+            for index, (address, peer) in enumerate(members):
+                if len(members) - 1 <= self.max_ghosts:
+                    nearest = range(len(members))
+                else:
+                    distance = np.abs(positions - positions[index]).sum(axis=1)
+                    nearest = np.argpartition(distance, self.max_ghosts)[:self.max_ghosts + 1].tolist()
+                view = {members[other][1].id: members[other][1].values for other in nearest if other != index}
+                base = peer.sent[peer.ack % HISTORY] if peer.ack != NO_ACK else None
+                if base is not None and base[0] == peer.ack:
+                    packet = encode_snapshot(self.seq, tick, view, peer.ack, base[1], cache)
+                else:
+                    packet = encode_snapshot(self.seq, tick, view, cache=cache)
+                peer.sent[self.seq % HISTORY] = (self.seq, view)
+                peer.bytes_out += len(packet) + UDP_OVERHEAD
+                self.transport.sendto(packet, address)
+        self.broadcast_ms.append((time.perf_counter() - start) * 1000)
+
+    async def run(self):
+        """Broadcast at snapshot_rate until cancelled, without drifting."""
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.snapshot_rate
+        deadline = loop.time()
+        while True:
+            self.broadcast()
+            deadline += interval
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+
+
+class GhostTracks:
+    """Decoded snapshots and the recent positions of every ghost in them."""
+
+    def __init__(self):
+        self.history = {}  # seq -> view
+        self.order = deque()
+        self.ack = NO_ACK
+        self.tracks = {}  # ghost id -> deque of (server time, values)
+        self.offset = None  # server time minus local time
+        self.received = 0
+        self.undecodable = 0
+        self.bytes_in = 0
+
+    def receive(self, data, now):
+        """Take a snapshot datagram; returns (seq, view) or None."""
+        self.bytes_in += len(data) + UDP_OVERHEAD
+        if len(data) < SNAPSHOT_HEADER.size or data[0] != SNAPSHOT:
+            return None
+        decoded = decode_snapshot(data, self.history)
+        if decoded is None:
+            self.undecodable += 1
+            return None
+        seq, tick, view = decoded
+        self.received += 1
+        self.history[seq] = view
+        self.order.append(seq)
+        while len(self.order) > HISTORY:
+            self.history.pop(self.order.popleft(), None)
+        self.ack = seq
+
+        server_time = tick / TICK_RATE
+        sample = server_time - now
+        if self.offset is None or abs(sample - self.offset) > 0.5:
+            self.offset = sample
+        else:
+            self.offset += (sample - self.offset) * 0.05
+        for ghost in [ghost for ghost in self.tracks if ghost not in view]:
+            del self.tracks[ghost]
+        for ghost, values in view.items():
+            track = self.tracks.get(ghost)
+            if track is None:
+                track = self.tracks[ghost] = deque(maxlen=8)
+            if not track or server_time > track[-1][0]:
+                track.append((server_time, values))
+        return seq, view
+
+    def sample(self, now):
+        """[(x, y, pose, frame)] of every ghost at local time now, in network units."""
+        if self.offset is None:
+            return []
+        render_time = now + self.offset - INTERPOLATION_DELAY
+        ghosts = []
+        for track in self.tracks.values():
+            time_b, b = track[-1]
+            if render_time >= time_b:
+                ahead = min(render_time - time_b, EXTRAPOLATE)
+                ghosts.append((b[0] + b[2] * POSITION_STEPS * ahead, b[1] + b[3] * POSITION_STEPS * ahead, b[4], b[5]))
+                continue
+            time_a, a = track[0]
+            for time_next, values in track:
+                if time_next > render_time:
+                    time_b, b = time_next, values
+                    break
+                time_a, a = time_next, values
+            t = 0.0 if time_b == time_a else max(0.0, min(1.0, (render_time - time_a) / (time_b - time_a)))
+            ghosts.append((a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t, a[4], a[5]))
+        return ghosts
+
+
+class _ClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, tracks, lock=None):
+        self.tracks = tracks
+        self.lock = lock
+
+    def datagram_received(self, data, address):
+        if self.lock is None:
+            self.tracks.receive(data, time.perf_counter())
+        else:
+            with self.lock:
+                self.tracks.receive(data, time.perf_counter())
+
+    def error_received(self, error):
+        # the server isn't up (yet), keep sending
+        pass
+
+
+class GhostClient:
+    """Connection to a GhostServer on a background thread; send() and ghosts() never block."""
+
+    def __init__(self, host, port, level, scale_factor):
+        self.level = level_id(level)
+        self.scale_factor = scale_factor
+        self.tracks = GhostTracks()
+        self.lock = threading.Lock()
+        self.bytes_out = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="ghost-client", daemon=True)
+        self.thread.start()
+        connect = self.loop.create_datagram_endpoint(
+            lambda: _ClientProtocol(self.tracks, self.lock), remote_addr=(host, port))
+        self.transport, _ = asyncio.run_coroutine_threadsafe(connect, self.loop).result(5)
+
+    def send(self, state):
+        """Send the player of a simulation.GameState; call every TICK_RATE // SEND_RATE ticks."""
+        with self.lock:
+            ack = self.tracks.ack
+        packet = CLIENT_STATE.pack(STATE, self.level, ack, state.tick, *quantize(state, self.scale_factor))
+        self.bytes_out += len(packet) + UDP_OVERHEAD
+        self.loop.call_soon_threadsafe(self.transport.sendto, packet)
+
+    def ghosts(self):
+        """[(x, y, size, action, direction, frame)] to draw, in level pixels at scale_factor."""
+        with self.lock:
+            ghosts = self.tracks.sample(time.perf_counter())
+        scale = self.scale_factor / POSITION_STEPS
+        return [
+            (round(x * scale), round(y * scale), pose >> 3 & 1, pose & 3, pose >> 2 & 1, frame)
+            for x, y, pose, frame in ghosts
+        ]
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.transport.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(1)
+
+
+async def serve(host, port, report=5.0):
+    loop = asyncio.get_running_loop()
+    transport, server = await loop.create_datagram_endpoint(GhostServer, local_addr=(host, port))
+    print(f"ghost server on {host}:{port}")
+    task = asyncio.create_task(server.run())
+    try:
+        while True:
+            await asyncio.sleep(report)
+            peers = list(server.peers.values())
+            out = sum(peer.bytes_out for peer in peers) / max(1, len(peers)) / (time.perf_counter() - server.start) / 1024
+            print(f"{len(peers)} clients, {out:.2f} KB/s out per client")
+    finally:
+        task.cancel()
+        transport.close()
+
+
+class _Bot:
+    """A headless client: steps its own GameState with scripted inputs."""
+
+    def __init__(self, level, number, rng):
+        self.state = GameState(level, x=64 + number * 7 % 1200, y=100)
+        self.jump_every = rng.randint(30, 120)
+        self.phase = rng.randrange(self.jump_every)
+        self.tracks = GhostTracks()
+        self.transport = None
+        self.bytes_out = 0
+
+    def inputs(self):
+        tick = self.state.tick + self.phase
+        return INPUT_RIGHT | (INPUT_JUMP if tick % self.jump_every < 12 else 0)
+
+
+async def load_test(clients, seconds, filename, loss=0.0):
+    """Server plus `clients` bots on loopback; returns a stats dict."""
+    loop = asyncio.get_running_loop()
+    transport, server = await loop.create_datagram_endpoint(GhostServer, local_addr=("127.0.0.1", 0))
+    port = transport.get_extra_info("sockname")[1]
+    level = load_level(filename, 1, 400, 200, compiled=True)
+    rng = random.Random(1)
+    bots = [_Bot(level, number, rng) for number in range(clients)]
+    level_key = level_id(filename)
+    mismatches = unchecked = 0
+
+    def receiver(bot):
+        class Protocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, address):
+                nonlocal mismatches, unchecked
+                if loss and rng.random() < loss:
+                    return
+                decoded = bot.tracks.receive(data, time.perf_counter())
+                if decoded is not None:
+                    seq, view = decoded
+                    peer = server.peers.get(bot.transport.get_extra_info("sockname"))
+                    sent = peer.sent[seq % HISTORY] if peer else None
+                    if sent is None or sent[0] != seq:
+                        # arrived after the server reused the slot
+                        unchecked += 1
+                    elif sent[1] != view:
+                        mismatches += 1
+        return Protocol()
+
+    for bot in bots:
+        bot.transport, _ = await loop.create_datagram_endpoint(lambda bot=bot: receiver(bot), remote_addr=("127.0.0.1", port))
+
+    broadcaster = asyncio.create_task(server.run())
+    dt = 1.0 / TICK_RATE
+    every = TICK_RATE // SEND_RATE
+    ticks = int(seconds * TICK_RATE)
+    start = loop.time()
+    step_seconds = 0.0
+    interpolated = 0
+    for tick in range(ticks):
+        begin = time.perf_counter()
+        send = tick % every == 0
+        for bot in bots:
+            step(bot.state, bot.inputs(), dt)
+            if send:
+                packet = CLIENT_STATE.pack(STATE, level_key, bot.tracks.ack, bot.state.tick, *quantize(bot.state, 1))
+                bot.bytes_out += len(packet) + UDP_OVERHEAD
+                bot.transport.sendto(packet)
+        if send:
+            # what a client's render loop would ask for
+            interpolated += len(bots[tick // every % clients].tracks.sample(time.perf_counter()))
+        step_seconds += time.perf_counter() - begin
+        await asyncio.sleep(max(0.0, start + (tick + 1) * dt - loop.time()))
+    elapsed = loop.time() - start
+    broadcaster.cancel()
+    for bot in bots:
+        bot.transport.close()
+    transport.close()
+
+    down = np.array([bot.tracks.bytes_in for bot in bots]) / elapsed / 1024
+    broadcast_ms = sorted(server.broadcast_ms)
+    return {
+        "clients": clients,
+        "seconds": elapsed,
+        "snapshots_per_client_s": sum(bot.tracks.received for bot in bots) / clients / elapsed,
+        "undecodable": sum(bot.tracks.undecodable for bot in bots),
+        "mismatches": mismatches,
+        "unchecked": unchecked,
+        "down_kb_s": float(down.mean()),
+        "down_kb_s_max": float(down.max()),
+        "up_kb_s": sum(bot.bytes_out for bot in bots) / clients / elapsed / 1024,
+        "broadcast_ms_p50": broadcast_ms[len(broadcast_ms) // 2],
+        "broadcast_ms_p99": broadcast_ms[int(len(broadcast_ms) * 0.99)],
+        "bot_step_ms": step_seconds / ticks * 1000,
+        "ghosts_drawn": interpolated / max(1, ticks // every),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ghost racing server and loopback load test")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=PORT)
+    test_parser = commands.add_parser("load-test")
+    test_parser.add_argument("--clients", type=int, default=300)
+    test_parser.add_argument("--seconds", type=float, default=10)
+    test_parser.add_argument("--level", default="level/level1-1.tmx")
+    test_parser.add_argument("--loss", type=float, default=0.0, help="fraction of snapshots the bots drop")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            asyncio.run(serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    stats = asyncio.run(load_test(args.clients, args.seconds, args.level, args.loss))
+    print(
+        f"{stats['clients']} clients for {stats['seconds']:.1f} s: "
+        f"{stats['snapshots_per_client_s']:.1f} snapshots/s each, {stats['ghosts_drawn']:.1f} ghosts in view\n"
+        f"  down {stats['down_kb_s']:.2f} KB/s per client (max {stats['down_kb_s_max']:.2f}), up {stats['up_kb_s']:.2f} KB/s\n"
+        f"  broadcast p50 {stats['broadcast_ms_p50']:.2f} ms, p99 {stats['broadcast_ms_p99']:.2f} ms, "
+        f"bots {stats['bot_step_ms']:.2f} ms/tick\n"
+        f"  {stats['undecodable']} snapshots without their base, {stats['mismatches']} decode mismatches "
+        f"({stats['unchecked']} arrived too late to check)"
+    )
+    sys.exit(1 if stats["mismatches"] else 0)
+
+
+if __name__ == "__main__":
+    main()
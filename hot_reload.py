@@ -0,0 +1,237 @@
+"""Reload a level while the game runs when its .tmx or tilesets change on disk.
+
+    watcher = LevelWatcher("level/level1-1.tmx", edits)
+    # once per frame
+    patch = watcher.poll()
+    if patch:
+        print(patch)
+
+poll() only stats the level's source files, every `interval` seconds. When one
+of them changed the level is parsed again on a worker thread, which also diffs
+the new gid grids, solidity bitmap and collision objects against the loaded
+level. The main thread then applies just the differences through LevelEdits:
+changed cells are rewritten and redrawn in the chunk/scroll renderers,
+collision objects that appeared or disappeared are added to or removed from
+the CollisionGrid and changed solidity cells are patched. The game state, and
+so the player's position, is left alone. Enemies and coins are not respawned.
+"""
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pygame
+import pytmx
+
+from collision import COLLISION_OBJECTS, level_objects
+from compile_level import raw_image_loader, source_files, stamp
+from solidity import solidity_cells
+
+
+def tile_layers(tmx_data):
+    return [layer for layer in tmx_data.layers if isinstance(layer, pytmx.TiledTileLayer)]
+
+
+def tile_keys(tmx_data):
+    """{gid: (Tiled gid, flip flags)}, what a gid means independent of how it was parsed."""
+    if hasattr(tmx_data, "tile_keys"):
+        return tmx_data.tile_keys()
+    return {
+        gid: (tiled_gid, tuple(int(flag) for flag in flags))
+        for tiled_gid, entries in tmx_data.gidmap.items()
+        for gid, flags in entries
+    }
+
+
+def add_tile(tmx_data, key, image):
+    """Register a tile the loaded level didn't use so far; return its gid."""
+    if hasattr(tmx_data, "add_tile"):
+        return tmx_data.add_tile(key, image)
+    gid = tmx_data.register_gid(key[0], pytmx.TileFlags(*key[1]))
+    tmx_data.images.extend([None] * (gid + 1 - len(tmx_data.images)))
+    tmx_data.images[gid] = image
+    return gid
+
+
+def set_tile_image(tmx_data, gid, image):
+    if hasattr(tmx_data, "set_tile_image"):
+        tmx_data.set_tile_image(gid, image)
+    else:
+        tmx_data.images[gid] = image
+
+
+def _grid(layer):
+    # compiled layers have a NumPy view, pytmx ones are lists of rows
+    grid = getattr(layer, "array", None)
+    return np.array(layer.data, dtype=np.int64) if grid is None else grid
+
+
+class LevelPatch:
+    """Difference between the loaded level and the files on disk."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.error = None
+        self.sources = None
+        self.cells = []  # (layer index, tile_x, tile_y, gid); gid < 0 is new_tiles[-gid]
+        self.new_tiles = {}  # gid in the new parse -> (key, image)
+        self.images = []  # (gid, image) when the tileset changed
+        self.solidity = []  # (cell index, solid)
+        self.objects = []  # collision (kind, rect) in the new file
+        self.added = 0
+        self.removed = 0
+        self.parse_ms = 0.0
+        self.apply_ms = 0.0
+
+    def __str__(self):
+        if self.error:
+            return f"reload failed: {self.error}"
+        return (
+            f"reloaded {self.filename}: {len(self.cells)} tiles, {len(self.images)} images, "
+            f"+{self.added}/-{self.removed} objects, {len(self.solidity)} solidity cells "
+            f"(parsed in {self.parse_ms:.1f} ms, applied in {self.apply_ms:.2f} ms)"
+        )
+
+
+def diff_level(filename, tmx_data, keys, cells, scale_factor, images=False):
+    """Parse filename and diff it against the loaded level; runs off the main thread.
+
+    keys and cells are snapshots of tile_keys(tmx_data) and the solidity bytes.
+    images=True also collects every tile image, for when a tileset changed.
+    """
+    patch = LevelPatch(filename)
+    start = time.perf_counter()
+    try:
+        patch.sources = source_files(filename)
+        new = pytmx.TiledMap(filename, image_loader=raw_image_loader)
+    except Exception as error:  # Tiled may not be done writing, the next save triggers another try
+        patch.error = f"{filename}: {error}"
+        return patch
+    old_layers, new_layers = tile_layers(tmx_data), tile_layers(new)
+    shape = (tmx_data.width, tmx_data.height, tmx_data.tilewidth, tmx_data.tileheight)
+    if (new.width, new.height, new.tilewidth, new.tileheight) != shape or \
+            [layer.name for layer in old_layers] != [layer.name for layer in new_layers]:
+        patch.error = f"{filename}: map size or tile layers changed, restart to load it"
+        return patch
+
+    # new gid -> loaded gid, or minus the new gid for tiles the loaded level lacks
+    gids = {key: gid for gid, key in keys.items()}
+    new_keys = tile_keys(new)
+    translate = np.zeros(max(len(new.images), max(new_keys, default=0) + 1), dtype=np.int64)
+    for gid, key in new_keys.items():
+        translate[gid] = gids.get(key, -gid)
+        if images and key in gids and new.images[gid]:
+            patch.images.append((gids[key], new.images[gid]))
+
+    for index, (old_layer, new_layer) in enumerate(zip(old_layers, new_layers)):
+        grid = translate[np.array(new_layer.data, dtype=np.int64)]
+        for tile_y, tile_x in np.argwhere(_grid(old_layer) != grid).tolist():
+            gid = int(grid[tile_y, tile_x])
+            if gid < 0:
+                patch.new_tiles[-gid] = (new_keys[-gid], new.images[-gid])
+            patch.cells.append((index, tile_x, tile_y, gid))
+
+    old_cells = np.frombuffer(cells, dtype=np.uint8)
+    new_cells = np.frombuffer(bytes(solidity_cells(new)), dtype=np.uint8)
+    patch.solidity = [(index, int(new_cells[index])) for index in np.flatnonzero(old_cells != new_cells).tolist()]
+    patch.objects = [(kind, rect) for kind, rect in level_objects(new, scale_factor) if kind in COLLISION_OBJECTS]
+    patch.parse_ms = (time.perf_counter() - start) * 1000
+    return patch
+
+
+class LevelWatcher:
+    """Watches a level's source files and patches the running level when they change."""
+
+    def __init__(self, filename, edits, interval=0.5):
+        self.filename = filename
+        self.edits = edits
+        self.interval = interval
+        self.sources = source_files(filename)
+        self.stamps = [stamp(path) for path in self.sources]
+        self.next_check = time.perf_counter() + interval
+        self.pool = ThreadPoolExecutor(1, thread_name_prefix="hot-reload")
+        self.pending = None
+
+    def changed(self):
+        """Source files whose size or mtime moved since the last call."""
+        stamps = [stamp(path) for path in self.sources]
+        changed = [new[0] for new, old in zip(stamps, self.stamps) if new != old]
+        self.stamps = stamps
+        return changed
+
+    def poll(self, now=None):
+        """Call once per frame. Returns the LevelPatch once a reload finished, else None."""
+        if self.pending is not None:
+            if not self.pending.done():
+                return None
+            patch = self.pending.result()
+            self.pending = None
+            if patch.error is None:
+                self.apply(patch)
+            return patch
+
+        now = time.perf_counter() if now is None else now
+        if now < self.next_check:
+            return None
+        self.next_check = now + self.interval
+        changed = self.changed()
+        if changed:
+            edits = self.edits
+            self.pending = self.pool.submit(
+                diff_level, self.filename, edits.tmx_data, tile_keys(edits.tmx_data), bytes(edits.solidity.cells),
+                edits.level.scale_factor, any(path != self.sources[0] for path in changed))
+        return None
+
+    def apply(self, patch):
+        """Patch the loaded level in place; main thread only."""
+        start = time.perf_counter()
+        edits = self.edits
+        tmx_data = edits.tmx_data
+        tile_cache = edits.tile_cache
+
+        added = {gid: add_tile(tmx_data, key, image) for gid, (key, image) in patch.new_tiles.items()}
+        for gid, image in patch.images:
+            set_tile_image(tmx_data, gid, image)
+            if tile_cache is not None:
+                tile_cache.invalidate(gid)
+
+        layers = tile_layers(tmx_data)
+        tiles = []
+        for index, tile_x, tile_y, gid in patch.cells:
+            edits.set_tile(layers[index], tile_x, tile_y, added[-gid] if gid < 0 else gid, redraw=False)
+            edits.emptied.discard((tile_x, tile_y))
+            tiles.append((tile_x, tile_y))
+        if patch.images:
+            size = edits.tile_size
+            everything = pygame.Rect(0, 0, tmx_data.width * size, tmx_data.height * size)
+            for renderer in edits.renderers:
+                renderer.redraw(everything)
+        else:
+            edits.redraw_tiles(tiles)
+
+        edits.solidity.update(patch.solidity)
+        self._apply_objects(patch)
+
+        if patch.sources != self.sources:
+            self.sources = patch.sources
+            self.stamps = [stamp(path) for path in self.sources]
+        patch.apply_ms = (time.perf_counter() - start) * 1000
+
+    def _apply_objects(self, patch):
+        edits = self.edits
+        live = {}
+        for index, (kind, rect) in enumerate(zip(edits.kinds, edits.level.collision_grid.rects)):
+            if rect is not None:
+                live.setdefault((kind, tuple(rect)), []).append(index)
+        wanted = Counter((kind, tuple(rect)) for kind, rect in patch.objects)
+        for key, indices in live.items():
+            for index in indices[wanted.get(key, 0):]:
+                edits.remove_object(index)
+                patch.removed += 1
+        for (kind, rect), count in wanted.items():
+            for _ in range(count - len(live.get((kind, rect), ()))):
+                edits.add_object(kind, pygame.Rect(rect))
+                patch.added += 1
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,191 @@
+"""Runtime changes to a loaded level: smashing bricks and emptying coin blocks.
+
+Every edit touches one tile. It rewrites that cell of the tile layer, drops
+the collision objects that sit on it from the CollisionGrid, clears its cell
+in the solidity bitmap and asks each renderer to redraw just that tile, so a
+chain of brick breaks never rebuilds the collision list or re-renders a whole
+chunk.
+
+Every edit is also written to a journal, so rollback() can take the level back
+to an earlier mark() (see rewind.py).
+"""
+import pygame
+
+from collision import COLLISION_OBJECTS, level_objects
+from render import visible_tile_layers
+from solidity import tiles_under
+
+BREAKABLE = ("bricks", "coins")
+# tile properties that make a tile breakable without a collision object on it
+EDIT_PROPERTIES = ("smashable", "coinblock")
+
+
+class LevelEdits:
+    """Edits for one level.
+
+    level is the simulation.Level whose collision grid gets updated, solidity
+    the SolidityMap used for tile collision. renderers are anything with a
+    redraw(world_rect) method (ChunkRenderer, ScrollRenderer). used_block_gid
+    is the tile an emptied coin block turns into; None leaves the tile as is.
+    """
+
+    def __init__(self, level, solidity, renderers=(), tile_cache=None, used_block_gid=None):
+        self.level = level
+        self.tmx_data = level.tmx_data
+        self.solidity = solidity
+        self.renderers = list(renderers)
+        self.tile_cache = tile_cache
+        self.used_block_gid = used_block_gid
+        self.tile_size = level.tile_size
+        self.layers = visible_tile_layers(self.tmx_data)
+        self.properties = self.tmx_data.tile_properties
+        self.emptied = set()
+        # (layer, tile_x, tile_y, old gid, was solid, removed (kind, rect) objects) per edit
+        self.journal = []
+
+        # (tile_x, tile_y) -> [(kind, collision grid index)] for the objects an edit can remove
+        self.objects = {}
+        objects = [(kind, rect) for kind, rect in level_objects(self.tmx_data, level.scale_factor) if kind in COLLISION_OBJECTS]
+        if len(objects) != len(level.collision_grid.rects):
+            raise ValueError("level objects don't line up with the collision grid")
+        # kind of every collision grid entry, by index
+        self.kinds = [kind for kind, _ in objects]
+        for index, (kind, rect) in enumerate(objects):
+            self._index_object(kind, rect, index)
+
+    def _tiles_of(self, rect):
+        first_x, last_x, first_y, last_y = tiles_under(rect, self.tile_size, self.tile_size, self.tmx_data.width, self.tmx_data.height)
+        return [(tile_x, tile_y) for tile_y in range(first_y, last_y) for tile_x in range(first_x, last_x)]
+
+    def _index_object(self, kind, rect, index):
+        if kind in BREAKABLE:
+            for tile in self._tiles_of(rect):
+                self.objects.setdefault(tile, []).append((kind, index))
+
+    def add_object(self, kind, rect):
+        """Add a collision object to the grid; return its index."""
+        index = self.level.collision_grid.add(rect)
+        self.kinds.append(kind)
+        self._index_object(kind, rect, index)
+        return index
+
+    def remove_object(self, index):
+        rect = self.level.collision_grid.rects[index]
+        if rect is None:
+            return
+        self.level.collision_grid.remove(index)
+        for tile in self._tiles_of(rect):
+            entries = [entry for entry in self.objects.get(tile, ()) if entry[1] != index]
+            if entries:
+                self.objects[tile] = entries
+            else:
+                self.objects.pop(tile, None)
+
+    def top_tile(self, tile_x, tile_y):
+        """(layer, gid) of the topmost non-empty tile in the cell, or (None, 0)."""
+        for layer in reversed(self.layers):
+            gid = layer.data[tile_y][tile_x]
+            if gid:
+                return layer, gid
+        return None, 0
+
+    def kinds_at(self, tile_x, tile_y):
+        kinds = {kind for kind, _ in self.objects.get((tile_x, tile_y), ())}
+        _, gid = self.top_tile(tile_x, tile_y)
+        props = self.properties.get(gid) or {}
+        if "smashable" in props:
+            kinds.add("bricks")
+        if "coinblock" in props:
+            kinds.add("coins")
+        return kinds
+
+    def set_tile(self, layer, tile_x, tile_y, gid, redraw=True):
+        layer.data[tile_y][tile_x] = gid
+        if gid and self.tile_cache is not None:
+            self.tile_cache.get(gid)
+        if redraw:
+            self._redraw(tile_x, tile_y)
+
+    def _redraw(self, tile_x, tile_y, columns=1):
+        size = self.tile_size
+        rect = pygame.Rect(tile_x * size, tile_y * size, columns * size, size)
+        for renderer in self.renderers:
+            renderer.redraw(rect)
+
+    def redraw_tiles(self, tiles):
+        """Redraw a batch of (tile_x, tile_y) cells, one rect per run of neighbours in a row."""
+        run = None
+        for tile_x, tile_y in sorted(set(tiles), key=lambda tile: (tile[1], tile[0])):
+            if run and run[1] == tile_y and run[0] + run[2] == tile_x:
+                run[2] += 1
+                continue
+            if run:
+                self._redraw(*run)
+            run = [tile_x, tile_y, 1]
+        if run:
+            self._redraw(*run)
+
+    def _remove_objects(self, tile_x, tile_y, kind):
+        removed = []
+        for other_kind, index in list(self.objects.get((tile_x, tile_y), ())):
+            if other_kind == kind:
+                removed.append((kind, self.level.collision_grid.rects[index]))
+                self.remove_object(index)
+        return removed
+
+    def mark(self):
+        return len(self.journal)
+
+    def rollback(self, mark):
+        """Undo the edits made since mark(), newest first."""
+        while len(self.journal) > mark:
+            layer, tile_x, tile_y, gid, solid, removed = self.journal.pop()
+            if layer is not None:
+                self.set_tile(layer, tile_x, tile_y, gid)
+            self.solidity.set_solid(tile_x, tile_y, solid)
+            for kind, rect in removed:
+                self.add_object(kind, rect)
+            self.emptied.discard((tile_x, tile_y))
+
+    def smash(self, tile_x, tile_y):
+        """Break a brick: clear its tile, collision object and solidity. False if it isn't one."""
+        if "bricks" not in self.kinds_at(tile_x, tile_y):
+            return False
+        layer, gid = self.top_tile(tile_x, tile_y)
+        removed = self._remove_objects(tile_x, tile_y, "bricks")
+        self.journal.append((layer, tile_x, tile_y, gid, self.solidity.is_solid(tile_x, tile_y), removed))
+        self.solidity.set_solid(tile_x, tile_y, False)
+        if layer is not None:
+            self.set_tile(layer, tile_x, tile_y, 0)
+        return True
+
+    def empty_coin_block(self, tile_x, tile_y):
+        """Turn a coin block into a used block; it stays solid. False if it isn't one or is already empty."""
+        if (tile_x, tile_y) in self.emptied or "coins" not in self.kinds_at(tile_x, tile_y):
+            return False
+        self.emptied.add((tile_x, tile_y))
+        layer, gid = self.top_tile(tile_x, tile_y)
+        self.journal.append((layer, tile_x, tile_y, gid, self.solidity.is_solid(tile_x, tile_y), []))
+        if layer is not None and self.used_block_gid is not None:
+            self.set_tile(layer, tile_x, tile_y, self.used_block_gid)
+        return True
+
+    def bump(self, player_rect):
+        """The player hit something with its head: act on the closest block above it.
+
+        Returns "bricks", "coins" or None.
+        """
+        size = self.tile_size
+        tile_y = (player_rect.top - 1) // size
+        if not 0 <= tile_y < self.tmx_data.height:
+            return None
+        columns = range(player_rect.left // size, (player_rect.right - 1) // size + 1)
+        for tile_x in sorted(columns, key=lambda column: abs(column * size + size // 2 - player_rect.centerx)):
+            if not 0 <= tile_x < self.tmx_data.width:
+                continue
+            if self.empty_coin_block(tile_x, tile_y):
+                return "coins"
+            if self.smash(tile_x, tile_y):
+                return "bricks"
+        return None
+
@@ -1,222 +1,353 @@
 import pygame
 import pytmx
 
+from assets import AssetLoader, LazyMusic, time_to_first_frame
+from capture import FrameCapture
+from compile_level import load_level_cached
+from endless import EndlessMap
+from entities import KINDS, EntityPool, entity_blits, spawn_level_entities
+from game import World
+from ghost import SEND_RATE, GhostClient
+from hot_reload import LevelWatcher
+from level_edits import LevelEdits
+from palette import FIRE_MARIO, UNDERGROUND, SharedPalette, present, swap_colors, swapped, tint
+from profiler import FrameProfiler, NullProfiler
+from quality import TIERS, QualityGovernor, SpriteThrottle, tiers
+from render import ScrollRenderer, draw_tile_layers, layer_color, tmx_chunk_renderer, upscale, visible_tile_layers
+from replay import InputRecorder
+from rewind import Rewinder
+from simulation import INPUT_MUTE, INPUT_QUIT, TICK_RATE, FixedTimestep, Level, inputs_from_keys, interpolate
+from solidity import build_solidity_map
+from sprites import SMALL, load_entity_frames, load_sprite_atlas, player_pose
+from tile_cache import TileCache
+
 # Constants
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 400
-FPS = 60
-PLAYER_WIDTH = 16
-PLAYER_HEIGHT = 16
-GRAVITY = 0.5
-JUMP_STRENGTH = -8 
-MOVE_SPEED = 3
+FPS = 60  # render cap, physics runs at simulation.TICK_RATE
 SCALE_FACTOR = 2  # scale factor for ghics
-MIDDLE_X = SCREEN_WIDTH // 2  # middle of the screen (400)
+NATIVE_BACK_BUFFER = False  # compose at 16 px tiles and upscale the whole frame once
+UPSCALE = "scale2x"  # back buffer upscale: "scale" or "scale2x" (needs SCALE_FACTOR 2)
+WORLD_SCALE = 1 if NATIVE_BACK_BUFFER else SCALE_FACTOR  # scale of tiles, sprites and collision rects
+TILE_CACHE_EAGER = True  # build every scaled tile right after load_map
+TILE_CACHE_SIZE = None  # max cached tiles (LRU), None keeps them all
+RENDER_BACKEND = "chunks"  # "tiles" draws tile by tile, "chunks" streams pre-rendered chunks,
+# "scroll" scrolls the last frame and draws only the exposed strip and the sprites
+CHUNK_WIDTH = 512
+PROFILE = False  # time each phase of the loop, F3 toggles the overlay
+PROFILE_EXPORT = ("frame_profile.json", "frame_profile.csv")  # written on exit when profiling
+COMPILED_LEVELS = True  # load levels through compile_level's mmap format, rebuilt when the .tmx changes
+LEVEL = "level/level1-1.tmx"
+HOT_RELOAD = True  # patch the running level when the .tmx or its tilesets are saved
+REWIND_SECONDS = 600  # hold BACKSPACE to rewind this far back, F5/F9 save and load; 0 turns it off
+RECORD_RUN = None  # path to record this session's inputs to for replay.py, e.g. "session.run"
+PALETTE_MODE = False  # 8-bit tiles, chunks and sprites in one shared palette, composed in an 8-bit back buffer
+PALETTE_EFFECT = None  # with PALETTE_MODE: "fire" recolors Mario, "underground" tints the frame
+QUALITY_GOVERNOR = True  # drop to cheaper render tiers when frames overrun 1000 / FPS, see quality.py
+REDUCED_SCALE = 1  # scale of the governor's reduced-scale tier, needs to divide WORLD_SCALE
+REDUCED = QUALITY_GOVERNOR and REDUCED_SCALE < WORLD_SCALE
+BACKGROUND_LAYERS = ("background",)  # tile layers the governor replaces with a fill of their color
+GHOST_SERVER = None  # ("host", port) of a `python ghost.py serve` to race the ghosts of other players
+GHOST_ALPHA = 110
+CAPTURE = None  # "clip.y4m", "clip.rgb" or "frames/%05d.png": record what's on screen from a writer thread, see capture.py
+ENDLESS = None  # seed: stream an endless level from LEVEL's sections and tiles (endless.py), without hot reload, rewind, recording and ghosts
 
 pygame.init()
 
-pygame.mixer.music.load("assets/sounds/overworld.mp3")
-pygame.mixer.music.set_volume(0.5)
-pygame.mixer.music.play(loops=-1, start=0.0)
-
 screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
 pygame.display.set_caption("Super Mary")
 clock = pygame.time.Clock()
+music = LazyMusic("assets/sounds/overworld.mp3", 0.5)  # starts once the first frame is up
 
-# mario sprites
-mario_sprites = {
-    "small": {
-        "idle_right": pygame.image.load("assets/mario-moves/small_idle_right.png"),
-        "idle_left": pygame.image.load("assets/mario-moves/small_idle_left.png"),
-        "walk_right": [
-            pygame.image.load("assets/mario-moves/small_walk1_right.png"),
-            pygame.image.load("assets/mario-moves/small_walk2_right.png"),
-            pygame.image.load("assets/mario-moves/small_walk3_right.png")
-        ],
-        "walk_left": [
-            pygame.image.load("assets/mario-moves/small_walk1_left.png"),
-            pygame.image.load("assets/mario-moves/small_walk2_left.png"),
-            pygame.image.load("assets/mario-moves/small_walk3_left.png")
-        ],
-        "turn_left_to_right": pygame.image.load("assets/mario-moves/small_turn_left_to_right.png"),
-        "turn_right_to_left": pygame.image.load("assets/mario-moves/small_turn_right_to_left.png"),
-        "jump_right": pygame.image.load("assets/mario-moves/small_jump_right.png"),
-        "jump_left": pygame.image.load("assets/mario-moves/small_jump_left.png")
-    },
-    "big": {
-        "idle_right": pygame.image.load("assets/mario-moves/big_idle_right.png"),
-        "idle_left": pygame.image.load("assets/mario-moves/big_idle_left.png"),
-        "walk_right": [
-            pygame.image.load("assets/mario-moves/big_walk1_right.png"),
-            pygame.image.load("assets/mario-moves/big_walk2_right.png"),
-            pygame.image.load("assets/mario-moves/big_walk3_right.png")
-        ],
-        "walk_left": [
-            pygame.image.load("assets/mario-moves/big_walk1_left.png"),
-            pygame.image.load("assets/mario-moves/big_walk2_left.png"),
-            pygame.image.load("assets/mario-moves/big_walk3_left.png")
-        ],
-        "turn_left_to_right": pygame.image.load("assets/mario-moves/big_turn_left_to_right.png"),
-        "turn_right_to_left": pygame.image.load("assets/mario-moves/big_turn_right_to_left.png"),
-        "jump_right": pygame.image.load("assets/mario-moves/big_jump_right.png"),
-        "jump_left": pygame.image.load("assets/mario-moves/big_jump_left.png")
-    }
-}
-
-def scale_mario_sprites(mario_size):
-    for key in mario_sprites[mario_size]:
-        if isinstance(mario_sprites[mario_size][key], list):
-            mario_sprites[mario_size][key] = [pygame.transform.scale(img, (img.get_width() * SCALE_FACTOR, img.get_height() * SCALE_FACTOR)) for img in mario_sprites[mario_size][key]]
-        else:
-            mario_sprites[mario_size][key] = pygame.transform.scale(mario_sprites[mario_size][key], (mario_sprites[mario_size][key].get_width() * SCALE_FACTOR, mario_sprites[mario_size][key].get_height() * SCALE_FACTOR))
-
-def load_map(filename):
+def load_map(filename, scale_factor=WORLD_SCALE):
+    if COMPILED_LEVELS:
+        return load_level_cached(filename, scale_factor)
     tmx_data = pytmx.load_pygame(filename, pixelalpha=True)
     return tmx_data
 
-def draw_map(tmx_data, surface, scale_factor, camera_x, camera_y):
-    camera_rect = pygame.Rect(camera_x, camera_y, SCREEN_WIDTH, SCREEN_HEIGHT)
-    for layer in tmx_data.visible_layers:
-        if isinstance(layer, pytmx.TiledTileLayer):
-            for x, y, gid in layer:
-                tile = tmx_data.get_tile_image_by_gid(gid)
-                if tile:
-                    tile_width = tmx_data.tilewidth * scale_factor
-                    tile_height = tmx_data.tileheight * scale_factor
-                    screen_x = x * tile_width
-                    screen_y = y * tile_height
-                    if camera_rect.colliderect(pygame.Rect(screen_x, screen_y, tile_width, tile_height)):
-                        scaled_tile = pygame.transform.scale(tile, (tile_width, tile_height))
-                        surface.blit(scaled_tile, (screen_x - camera_x, screen_y - camera_y))
-
-def get_collision_rects(tmx_data, scale_factor):
-    collision_rects = []
-    for obj in tmx_data.objects:
-        if obj.name in ["ground", "bricks", "pipes", "coins"]:
-            rect = pygame.Rect(obj.x * scale_factor, obj.y * scale_factor, obj.width * scale_factor, obj.height * scale_factor)
-            collision_rects.append(rect)
-    return collision_rects
-
-
-def handle_collisions(player_rect, player_vx, player_vy, collision_rects):
-    player_rect.x += player_vx
-    for rect in collision_rects:
-        if player_rect.colliderect(rect):
-            if player_vx > 0:
-                player_rect.right = rect.left
-            elif player_vx < 0:
-                player_rect.left = rect.right
-
-    player_rect.y += player_vy
-    on_ground = False
-    for rect in collision_rects:
-        if player_rect.colliderect(rect):
-            if player_vy > 0:
-                player_rect.bottom = rect.top
-                player_vy = 0
-                on_ground = True
-            elif player_vy < 0:
-                player_rect.top = rect.bottom
-                player_vy = 0
-
-    return player_rect, player_vy, on_ground
+def draw_map(tmx_data, surface, scale_factor, camera_x, camera_y, tile_cache, layers=None):
+    return draw_tile_layers(tmx_data, surface, tile_cache, scale_factor, camera_x, camera_y, layers)
+
+def load_world(filename, palette=None):
+    """Level, tile cache and chunk renderer; runs on an AssetLoader thread."""
+    tmx_data = load_map(filename)
+    if ENDLESS is not None:
+        tmx_data = EndlessMap(tmx_data, WORLD_SCALE, ENDLESS)
+    tile_cache = TileCache(tmx_data, WORLD_SCALE, eager=TILE_CACHE_EAGER, max_size=TILE_CACHE_SIZE, palette=palette)
+    level_chunks = None
+    if RENDER_BACKEND == "chunks":
+        level_chunks = tmx_chunk_renderer(
+            tmx_data, tile_cache, WORLD_SCALE, CHUNK_WIDTH // SCALE_FACTOR * WORLD_SCALE, palette=palette)
+    solidity = build_solidity_map(tmx_data, WORLD_SCALE)
+    reduced_tiles = None
+    if REDUCED:
+        reduced_tiles = TileCache(tmx_data, REDUCED_SCALE, eager=TILE_CACHE_EAGER, max_size=TILE_CACHE_SIZE, palette=palette)
+    return tmx_data, tile_cache, level_chunks, solidity, reduced_tiles
 
 def main():
-    tmx_data = load_map("level/level1-1.tmx")
-    collision_rects = get_collision_rects(tmx_data, SCALE_FACTOR)
-
-    player_rect = pygame.Rect(100, 100, PLAYER_WIDTH * SCALE_FACTOR, PLAYER_HEIGHT * SCALE_FACTOR)
-    player_vx = 0
-    player_vy = 0
-    on_ground = False
-    player_size = "small"  # Start as small Mario
-
-    facing_right = True
-
-    camera_x = 0
-    camera_y = 0
+    profiler = FrameProfiler() if PROFILE else NullProfiler()
+    profiler.count_scale_calls()
+    overlay_font = pygame.font.Font(None, 20) if PROFILE else None
+    show_overlay = PROFILE
+
+    palette = SharedPalette() if PALETTE_MODE else None
+    native_size = (SCREEN_WIDTH // SCALE_FACTOR, SCREEN_HEIGHT // SCALE_FACTOR)
+    if PALETTE_MODE:
+        view = palette.surface(native_size if NATIVE_BACK_BUFFER else screen.get_size(), transparent=False)
+    elif NATIVE_BACK_BUFFER:
+        view = pygame.Surface(native_size).convert()
+    else:
+        view = screen
+    view_width, view_height = view.get_size()
+    scratch = None
+    palette_version = None
+    reduced_view = None
+    if REDUCED:
+        reduced_size = (view_width * REDUCED_SCALE // WORLD_SCALE, view_height * REDUCED_SCALE // WORLD_SCALE)
+        reduced_view = palette.surface(reduced_size, transparent=False) if palette else pygame.Surface(reduced_size).convert()
+
+    loader = AssetLoader()
+    loader.submit("sprites", load_sprite_atlas, WORLD_SCALE, palette=palette)
+    loader.submit("entities", load_entity_frames, WORLD_SCALE, palette=palette)
+    loader.submit("world", load_world, LEVEL, palette)
+    if REDUCED:
+        loader.submit("reduced sprites", load_sprite_atlas, REDUCED_SCALE, palette=palette)
+        loader.submit("reduced entities", load_entity_frames, REDUCED_SCALE, palette=palette)
+    if not loader.wait(screen, clock):
+        pygame.quit()
+        return
+    mario_atlas = loader.result("sprites")
+    entity_frames = [loader.result("entities")[name] for name in KINDS]
+    tmx_data, tile_cache, level_chunks, solidity, reduced_tiles = loader.result("world")
+    if REDUCED:
+        reduced_atlas = loader.result("reduced sprites")
+        reduced_frames = [loader.result("reduced entities")[name] for name in KINDS]
+    loader.shutdown()
+    if palette:
+        palette.refresh(view)
+
+    background = [layer for layer in visible_tile_layers(tmx_data) if layer.name in BACKGROUND_LAYERS]
+    foreground = [layer for layer in visible_tile_layers(tmx_data) if layer.name not in BACKGROUND_LAYERS]
+    background_color = layer_color(background[0], tile_cache, WORLD_SCALE) if background else (0, 0, 0)
+    governor = None
+    if QUALITY_GOVERNOR:
+        # chunks have every layer baked in, only the tile and scroll backends draw a background layer
+        governor = QualityGovernor(FPS, tiers(bool(background) and RENDER_BACKEND != "chunks", reduced_scale=REDUCED))
+    tier = TIERS[0]
+    sprites = SpriteThrottle(lambda frames, x, y: entity_blits(pool, frames, x, y, view_width, view_height))
+
+    scroller = None
+    if RENDER_BACKEND == "scroll":
+        scroller = ScrollRenderer(
+            lambda surface, x, y: draw_map(
+                tmx_data, surface, WORLD_SCALE, x, y, tile_cache, None if tier.background else foreground), view)
+    endless = ENDLESS is not None
+    # endless levels have no collision objects, everything solid is in the solidity bitmap
+    level = Level(tmx_data, WORLD_SCALE, view_width, view_height, tile_collision=endless)
+    if endless:
+        tmx_data.renderers = [renderer for renderer in (level_chunks, scroller, sprites) if renderer]
+
+    pool = EntityPool()
+    spawn_level_entities(pool, tmx_data, WORLD_SCALE)
+    edits = LevelEdits(level, solidity, [renderer for renderer in (level_chunks, scroller) if renderer], tile_cache)
+    world = World(level, solidity, pool, edits)
+    watcher = LevelWatcher(LEVEL, edits) if HOT_RELOAD and not endless else None
+    rewinder = Rewinder(world.state, pool, edits, REWIND_SECONDS) if REWIND_SECONDS and not endless else None
+    recorder = InputRecorder(LEVEL, WORLD_SCALE, view_width, view_height, COMPILED_LEVELS) if RECORD_RUN and not endless else None
+    ghosts = GhostClient(*GHOST_SERVER, LEVEL, WORLD_SCALE) if GHOST_SERVER and not endless else None
+    if ghosts:
+        ghost_atlas = mario_atlas.translucent(GHOST_ALPHA)
+        reduced_ghost_atlas = reduced_atlas.translucent(GHOST_ALPHA) if REDUCED else None
+    capture = FrameCapture(CAPTURE, screen.get_size(), FPS) if CAPTURE else None
+    saved = None
+    last_inputs = 0
+    timestep = FixedTimestep(TICK_RATE)
+    player_size = SMALL  # Start as small Mario
 
     running = True
-    frame_counter = 0
-
-    scale_mario_sprites(player_size)
-
-    mario_at_middle = False  
 
     while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
+        with profiler.phase("events"):
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3 and PROFILE:
+                    show_overlay = not show_overlay
+                elif event.type == pygame.VIDEOEXPOSE and scroller:
+                    scroller.invalidate()
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F5 and rewinder:
+                    saved = rewinder.save(world.state, world.coins)
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F9 and saved:
+                    world.coins = rewinder.load(saved, world.state)
+                    world.previous = world.state.copy()
+                    pygame.display.set_caption(f"Super Mary - coins {world.coins}")
+                    # a load isn't an input, the rest of the session can't be replayed
+                    recorder = None
+
+            keys = pygame.key.get_pressed()
+            inputs = inputs_from_keys(keys)
+            rewinding = rewinder and keys[pygame.K_BACKSPACE]
+            if inputs & INPUT_MUTE and not last_inputs & INPUT_MUTE:
+                music.toggle_mute()
+            if inputs & INPUT_QUIT:
                 running = False
-
-        keys = pygame.key.get_pressed()
-        player_vx = 0
-
-        if keys[pygame.K_a]:
-            player_vx = -MOVE_SPEED * SCALE_FACTOR
-            facing_right = False
-            mario_at_middle = False  
-
-        if keys[pygame.K_d]:
-            player_vx = MOVE_SPEED * SCALE_FACTOR
-            facing_right = True
-
-        if keys[pygame.K_SPACE] and on_ground:
-            player_vy = JUMP_STRENGTH * SCALE_FACTOR
-            on_ground = False
-
-        player_vy += GRAVITY
-        player_rect, player_vy, on_ground = handle_collisions(player_rect, player_vx, player_vy, collision_rects)
-
-        # Prevent Mario from going off-screen
-        if player_rect.left < 0:
-            player_rect.left = 0
-        if player_rect.right > 4000:
-            player_rect.right = SCREEN_WIDTH
-        if player_rect.top < 0:
-            player_rect.top = 0
-        if player_rect.bottom > SCREEN_HEIGHT:
-            player_rect.bottom = SCREEN_HEIGHT
-            player_vy = 0
-            on_ground = True
-
-        if player_rect.left < 0:
-            player_rect.left = 0
-        if player_rect.bottom > SCREEN_HEIGHT:
-            player_rect.bottom = SCREEN_HEIGHT
-            player_vy = 0
-            on_ground = True
-
-        if player_rect.centerx >= MIDDLE_X and player_vx > 0:
-            camera_adjust = min(player_rect.centerx - MIDDLE_X, MOVE_SPEED * SCALE_FACTOR)
-            camera_x += camera_adjust
-
-        max_camera_x = (tmx_data.width * tmx_data.tilewidth * SCALE_FACTOR - SCREEN_WIDTH)
-        if camera_x < 0:
-            camera_x = 0
-        elif camera_x > max_camera_x:
-            camera_x = max_camera_x
-
-        screen.fill((0, 0, 0))
-
-        draw_map(tmx_data, screen, SCALE_FACTOR, camera_x, camera_y)
-
-        sprite_list = None
-        if player_vx != 0:
-            sprite_list = mario_sprites[player_size]["walk_right"] if facing_right else mario_sprites[player_size]["walk_left"]
-        elif player_vy != 0:
-            sprite_list = [mario_sprites[player_size]["jump_right"] if facing_right else mario_sprites[player_size]["jump_left"]]
-        else:
-            sprite_list = [mario_sprites[player_size]["idle_right"] if facing_right else mario_sprites[player_size]["idle_left"]]
-
-        sprite_index = (frame_counter // 10) % len(sprite_list)
-        player_surface = sprite_list[sprite_index]
-
-        screen.blit(player_surface, (player_rect.x - camera_x, player_rect.y - camera_y))
-
-        pygame.display.flip()
-        clock.tick(FPS)
-        frame_counter += 1
-
+            last_inputs = inputs
+
+            if watcher:
+                patch = watcher.poll()
+                if patch:
+                    pygame.display.set_caption(f"Super Mary - {patch}")
+
+        frame_ms = clock.tick(FPS)
+        if governor:
+            if governor.update(clock.get_rawtime()):
+                pygame.display.set_caption(f"Super Mary - {governor}")
+                tier = governor.tier
+                sprites.reset()
+                if scroller:
+                    scroller.background = (0, 0, 0) if tier.background else background_color
+                    scroller.invalidate()
+            profiler.count("quality", governor.index)
+        with profiler.phase("physics"):
+            for _ in range(timestep.advance(frame_ms / 1000)):
+                if rewinding:
+                    world.previous = world.state.copy()
+                    coins = rewinder.step_back(world.state)
+                    if coins is not None:
+                        if recorder:
+                            recorder.truncate(rewinder.count)
+                        if coins != world.coins:
+                            world.coins = coins
+                            pygame.display.set_caption(f"Super Mary - coins {coins}")
+                    continue
+                collected, hurt = world.tick(inputs, timestep.dt)
+                if collected:
+                    pygame.display.set_caption(f"Super Mary - coins {world.coins}")
+                if rewinder:
+                    rewinder.capture(world.state, world.coins, world.contact_vy)
+                if recorder:
+                    recorder.record(inputs, world)
+                if ghosts and world.state.tick % (TICK_RATE // SEND_RATE) == 0:
+                    ghosts.send(world.state)
+
+        if governor and not governor.render_frame():
+            profiler.end_frame(frame_ms)
+            continue
+
+        with profiler.phase("camera"):
+            state = world.state
+            player_x, player_y, camera_x, camera_y = interpolate(world.previous, state, timestep.alpha)
+            if level_chunks:
+                level_chunks.update(camera_x, view_width)
+
+        if palette and palette.version != palette_version:
+            # tiles built lazily can still add colors
+            palette_version = palette.version
+            for surface in (view, scroller and scroller.world, reduced_view):
+                if surface:
+                    palette.refresh(surface)
+            fire_colors = swap_colors(palette.padded(), FIRE_MARIO)
+            display_colors = tint(palette.padded(), *UNDERGROUND) if PALETTE_EFFECT == "underground" else None
+
+        ratio = WORLD_SCALE // REDUCED_SCALE if tier.reduced_scale else 1
+        layers = None if tier.background else foreground
+        with profiler.phase("draw_map"):
+            if tier.reduced_scale:
+                reduced_view.fill(background_color if layers else (0, 0, 0))
+                blits = draw_map(tmx_data, reduced_view, REDUCED_SCALE, camera_x / ratio, camera_y / ratio, reduced_tiles, layers)
+            elif scroller:
+                camera_x = int(camera_x)
+                camera_y = int(camera_y)
+                blits = scroller.begin_frame(camera_x, camera_y)
+            elif level_chunks:
+                view.fill((0, 0, 0))
+                blits = level_chunks.draw(view, camera_x, camera_y)
+            else:
+                view.fill(background_color if layers else (0, 0, 0))
+                blits = draw_map(tmx_data, view, WORLD_SCALE, camera_x, camera_y, tile_cache, layers)
+        profiler.count("blits", blits + 1)
+
+        with profiler.phase("sprites"):
+            if tier.reduced_scale:
+                blits = sprites.blits(tier.sprite_interval, reduced_frames, camera_x, camera_y)
+                reduced_view.blits([(image, (x / ratio, y / ratio)) for image, (x, y) in blits], False)
+            else:
+                blits = sprites.blits(tier.sprite_interval, entity_frames, camera_x, camera_y)
+                if scroller:
+                    scroller.blits(blits)
+                else:
+                    view.blits(blits, False)
+            profiler.count("entities", len(blits))
+
+            if tier.reduced_scale:
+                blit = reduced_view.blit
+            else:
+                blit = scroller.blit if scroller else view.blit
+            if ghosts:
+                atlas = reduced_ghost_atlas if tier.reduced_scale else ghost_atlas
+                for x, y, size, action, direction, frame in ghosts.ghosts():
+                    blit(atlas.frame(size, action, direction, frame), ((x - camera_x) / ratio, (y - camera_y) / ratio))
+
+            action, direction, frame = player_pose(state)
+            atlas = reduced_atlas if tier.reduced_scale else mario_atlas
+            player_surface = atlas.frame(player_size, action, direction, frame)
+            position = ((player_x - camera_x) / ratio, (player_y - camera_y) / ratio)
+            if palette and PALETTE_EFFECT == "fire":
+                with swapped(player_surface, fire_colors):
+                    blit(player_surface, position)
+            else:
+                blit(player_surface, position)
+
+        if tier.reduced_scale:
+            with profiler.phase("upscale"):
+                if palette:
+                    scratch = present(reduced_view, screen, scratch, "scale", display_colors)
+                else:
+                    upscale(reduced_view, screen)
+        elif PALETTE_MODE:
+            with profiler.phase("upscale"):
+                scratch = present(view, screen, scratch, UPSCALE, display_colors)
+        elif NATIVE_BACK_BUFFER:
+            with profiler.phase("upscale"):
+                upscale(view, screen, UPSCALE)
+
+        if capture:
+            # before the overlay, clips show the game only
+            with profiler.phase("capture"):
+                capture.capture(screen)
+
+        if show_overlay:
+            overlay_rect = profiler.draw_overlay(screen, overlay_font)
+            if scroller and view is screen:
+                scroller.mark(overlay_rect)
+
+        with profiler.phase("flip"):
+            dirty = scroller.end_frame() if scroller and not tier.reduced_scale else None
+            if dirty is not None and view is screen:
+                pygame.display.update(dirty)
+            else:
+                pygame.display.flip()
+        if not music.started:
+            first_frame_ms = time_to_first_frame()
+            profiler.record("time_to_first_frame_ms", first_frame_ms)
+            pygame.display.set_caption(f"Super Mary - first frame in {first_frame_ms:.0f} ms")
+            music.start()
+        profiler.end_frame(frame_ms)
+
+    if watcher:
+        watcher.close()
+    if ghosts:
+        ghosts.close()
+    if recorder:
+        recorder.save(RECORD_RUN, world)
+    if capture:
+        capture.close()
+        profiler.record("capture_dropped", capture.dropped)
+        print(capture)
+    if PROFILE:
+        for path in PROFILE_EXPORT:
+            profiler.export(path)
+    profiler.close()
     pygame.quit()
 
 if __name__ == "__main__":
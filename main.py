@@ -1,6 +1,10 @@
 import pygame
 import pytmx
 
+from render import visible_tile_range
+from solidity import build_solidity_map
+from sprites import IDLE, JUMP, RIGHT, SMALL, TURN, load_sprite_atlas
+
 pygame.init()
 
 pygame.mixer.init()
@@ -20,68 +24,17 @@ TILE_SIZE = tmx_data.tilewidth
 # Scale factor for tiles
 scale_factor = 2  # Increase scale to make tiles larger
 scaled_tile_size = TILE_SIZE * scale_factor  # Define scaled tile size
+solidity = build_solidity_map(tmx_data, scale_factor)  # one byte per tile, built once
 
 # Player settings
-mario_sprites = {
-    "small": {
-        "idle_right": pygame.image.load("assets/mario-moves/small_idle_right.png"),
-        "idle_left": pygame.image.load("assets/mario-moves/small_idle_left.png"),
-        "walk_right": [
-            pygame.image.load("assets/mario-moves/small_walk3_right.png"),
-            pygame.image.load("assets/mario-moves/small_walk2_right.png"),
-            pygame.image.load("assets/mario-moves/small_walk1_right.png")
-        ],
-        "walk_left": [
-            pygame.image.load("assets/mario-moves/small_walk1_left.png"),
-            pygame.image.load("assets/mario-moves/small_walk2_left.png"),
-            pygame.image.load("assets/mario-moves/small_walk3_left.png")
-        ],
-        "turn_left_to_right": pygame.image.load("assets/mario-moves/small_turn_left_to_right.png"),
-        "turn_right_to_left": pygame.image.load("assets/mario-moves/small_turn_right_to_left.png"),
-        "jump_right": pygame.image.load("assets/mario-moves/small_jump_right.png"),
-        "jump_left": pygame.image.load("assets/mario-moves/small_jump_left.png")
-    },
-    "big": {
-        "idle_right": pygame.image.load("assets/mario-moves/big_idle_right.png"),
-        "idle_left": pygame.image.load("assets/mario-moves/big_idle_left.png"),
-        "walk_right": [
-            pygame.image.load("assets/mario-moves/big_walk1_right.png"),
-            pygame.image.load("assets/mario-moves/big_walk2_right.png"),
-            pygame.image.load("assets/mario-moves/big_walk3_right.png")
-        ],
-        "walk_left": [
-            pygame.image.load("assets/mario-moves/big_walk1_left.png"),
-            pygame.image.load("assets/mario-moves/big_walk2_left.png"),
-            pygame.image.load("assets/mario-moves/big_walk3_left.png")
-        ],
-        "turn_left_to_right": pygame.image.load("assets/mario-moves/big_turn_left_to_right.png"),
-        "turn_right_to_left": pygame.image.load("assets/mario-moves/big_turn_right_to_left.png"),
-        "jump_right": pygame.image.load("assets/mario-moves/big_jump_right.png"),
-        "jump_left": pygame.image.load("assets/mario-moves/big_jump_left.png")
-    }
-}
-
-# Scaled player settings
-for size in mario_sprites:
-    for direction in mario_sprites[size]:
-        if isinstance(mario_sprites[size][direction], list):
-            mario_sprites[size][direction] = [
-                pygame.transform.scale(sprite, (sprite.get_width() * scale_factor, sprite.get_height() * scale_factor))
-                for sprite in mario_sprites[size][direction]
-            ]
-        else:
-            mario_sprites[size][direction] = pygame.transform.scale(
-                mario_sprites[size][direction],
-                (mario_sprites[size][direction].get_width() * scale_factor,
-                 mario_sprites[size][direction].get_height() * scale_factor)
-            )
+mario_atlas = load_sprite_atlas(scale_factor)
 
 # Player setup
 player = pygame.Rect(100, 495, 100, 100)
 player_speed = 3
-player_direction = "right"
+player_direction = RIGHT
 player_walking = False
-player_size = "small"
+player_size = SMALL
 camera_x = 0
 MIDDLE_X = 400  # middle
 key_state = {"right": False, "left": False, "jump": False}
@@ -91,40 +44,34 @@ gravity = 1
 jump_height = 15
 
 def draw_map():
+    first_col, last_col, first_row, last_row = visible_tile_range(tmx_data, scale_factor, camera_x, 0, WIDTH, HEIGHT)
     for layer in tmx_data.visible_layers:
         if isinstance(layer, pytmx.TiledTileLayer): 
-            for x, y, gid in layer: 
-                if gid:  
-                    tile_image = tmx_data.get_tile_image_by_gid(gid)  
-                    if tile_image:
-                       
-                        screen_x = (x * scaled_tile_size) - camera_x
-                        screen_y = y * scaled_tile_size
-
-                        # Use integer positions for perfect pixel alignment
-                        screen.blit(tile_image, (int(screen_x), int(screen_y)))
+            for y in range(first_row, last_row):
+                row = layer.data[y]
+                for x in range(first_col, last_col):
+                    gid = row[x]
+                    if gid:  
+                        tile_image = tmx_data.get_tile_image_by_gid(gid)  
+                        if tile_image:
+                           
+                            screen_x = (x * scaled_tile_size) - camera_x
+                            screen_y = y * scaled_tile_size
+
+                            # Use integer positions for perfect pixel alignment
+                            screen.blit(tile_image, (int(screen_x), int(screen_y)))
 
 def find_ground_start(player_rect):
     """Find the y-coordinate for Mario to stand on the ground."""
-    tile_x = player_rect.centerx // scaled_tile_size  
-
-    for y in range(player_rect.bottom // scaled_tile_size, tmx_data.height):
-        tile_y = y
-        tile = tmx_data.layerat(0).tile_at(tile_x, tile_y)  
-        if tile and tile.gid == 19:  # Check if the tile's GID is 19 (ground)
-            return tile_y * scaled_tile_size - player_rect.height  # Adjust Mario's Y position to the ground
+    ground = solidity.ground_top(player_rect)
+    if ground is not None:
+        return ground - player_rect.height  # Adjust Mario's Y position to the ground
     return player_rect.bottom  # If no ground found, return the default position
 
 # Function to check if Mario is standing on the ground based on the Tiled map
 def check_ground_collision(player_rect):
     """Check if Mario is standing on the ground."""
-    player_bottom = player_rect.bottom
-    tile_x = player_rect.centerx // scaled_tile_size
-    tile_y = player_bottom // scaled_tile_size
-    tile = tmx_data.layerat(0).tile_at(tile_x, tile_y)  # Get the tile at this position
-    if tile and tile.gid == 19:  # Check if the tile's GID is 19 (ground)
-        return True
-    return False
+    return solidity.is_solid(player_rect.centerx // scaled_tile_size, player_rect.bottom // scaled_tile_size)
 
 # Function to update the camera position to follow Mario
 def update_camera():
@@ -189,17 +136,11 @@ while running:
 
     # Determine current sprite based on movement and jumping
     if player_walking:
-        if player_direction == "left":
-            current_sprite = mario_sprites[player_size]["turn_right_to_left"]
-        else:
-            current_sprite = mario_sprites[player_size]["turn_left_to_right"]
+        current_sprite = mario_atlas.frame(player_size, TURN, player_direction)
     elif jumping:
-        if player_direction == "right":
-            current_sprite = mario_sprites[player_size]["jump_right"]
-        else:
-            current_sprite = mario_sprites[player_size]["jump_left"]
+        current_sprite = mario_atlas.frame(player_size, JUMP, player_direction)
     else:
-        current_sprite = mario_sprites[player_size][f"idle_{player_direction}"]
+        current_sprite = mario_atlas.frame(player_size, IDLE, player_direction)
 
     # Blit Mario on the screen with the updated coordinates
     screen.blit(current_sprite, (int(player.x - camera_x), int(player.y)))
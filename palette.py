@@ -0,0 +1,177 @@
+"""Optional 8-bit indexed-color surfaces for the NES-style art.
+
+The tileset, Mario's frames, the enemies and the level background use a few
+dozen colors between them, so they fit one shared 256-color palette at a
+quarter of the memory of 32-bit surfaces. Index 0 is the transparent colorkey.
+Surfaces built through the same SharedPalette use the same palette, so
+blitting them onto an 8-bit back buffer is a plain byte copy, and the back
+buffer is converted to the display format once per frame by present().
+
+Recolors don't need surface copies: swapped() blits an 8-bit surface with a
+recolored palette (fire Mario) and gives its own palette back afterwards, and
+present() can show the whole frame through a tinted palette (underground).
+
+    palette = SharedPalette()
+    tile = palette.indexed(pygame.image.load("tile.png"))
+    with swapped(frame, swap_colors(frame.get_palette(), FIRE_MARIO)):
+        back_buffer.blit(frame, position)
+"""
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pygame
+
+TRANSPARENT = (0, 0, 0)  # index 0: the colorkey in assets, the clear color of a back buffer
+TOLERANCE = 3  # colors this close (per channel) to a palette color reuse it, PNG art is rarely exact
+
+# fire Mario: red cap and shirt turn white, brown hair and shoes turn red
+FIRE_MARIO = {(255, 49, 24): (252, 252, 252), (198, 99, 0): (216, 40, 0)}
+UNDERGROUND = ((0, 24, 60), 0.45)  # tint color, strength
+
+
+class SharedPalette:
+    """A palette that grows as surfaces are converted, up to 256 colors.
+
+    Conversion runs on asset loader threads, so adding colors is locked.
+    version changes whenever a color is added; refresh() brings a back buffer
+    up to date.
+    """
+
+    def __init__(self):
+        self.colors = [TRANSPARENT]
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.colors)
+
+    def padded(self):
+        return self.colors + [TRANSPARENT] * (256 - len(self.colors))
+
+    def _index(self, wanted):
+        """Palette index for each row of wanted (n x 3), adding colors that aren't close to one."""
+        with self._lock:
+            indices = np.zeros(len(wanted), dtype=np.uint8)
+            for row, color in enumerate(wanted):
+                palette = np.array(self.colors[1:], dtype=np.int16).reshape(-1, 3)
+                distance = np.abs(palette - color).max(axis=1) if len(palette) else np.zeros(0)
+                if len(distance) and (distance.min() <= TOLERANCE or len(self.colors) == 256):
+                    indices[row] = distance.argmin() + 1
+                else:
+                    indices[row] = len(self.colors)
+                    self.colors.append(tuple(int(channel) for channel in color))
+                    self.version += 1
+            return indices
+
+    def indexed(self, surface, alpha_threshold=128):
+        """8-bit copy of surface in this palette, transparent pixels (alpha or colorkey) on index 0."""
+        width, height = surface.get_size()
+        rgba = np.frombuffer(pygame.image.tobytes(surface, "RGBA"), dtype=np.uint8).reshape(-1, 4)
+        opaque = rgba[:, 3] >= alpha_threshold
+        colors, inverse = np.unique(rgba[:, :3], axis=0, return_inverse=True)
+        pixels = self._index(colors.astype(np.int16))[inverse.reshape(-1)]
+        pixels[~opaque] = 0
+        result = pygame.image.frombytes(pixels.tobytes(), (width, height), "P")
+        result.set_palette(self.padded())
+        result.set_colorkey(0)
+        return result
+
+    def surface(self, size, transparent=True):
+        """Blank 8-bit surface in this palette, filled with index 0; back buffers pass transparent=False."""
+        result = pygame.Surface(size, 0, 8)
+        result.set_palette(self.padded())
+        if transparent:
+            result.set_colorkey(0)
+        result.fill(0)
+        return result
+
+    def refresh(self, surface):
+        surface.set_palette(self.padded())
+
+
+def swap_colors(palette, mapping):
+    """Copy of palette with every color close to a mapping key replaced by its value."""
+    colors = [tuple(color)[:3] for color in palette]
+    for old, new in mapping.items():
+        for index, color in enumerate(colors):
+            if index and max(abs(a - b) for a, b in zip(color, old)) <= TOLERANCE:
+                colors[index] = new
+    return colors
+
+
+def tint(palette, color, strength):
+    """Copy of palette blended towards color."""
+    return [
+        tuple(round(channel + (target - channel) * strength) for channel, target in zip(tuple(entry)[:3], color))
+        for entry in palette
+    ]
+
+
+@contextmanager
+def swapped(surface, palette):
+    """Temporarily give an 8-bit surface another palette, e.g. for one blit."""
+    original = surface.get_palette()
+    surface.set_palette(palette)
+    try:
+        yield surface
+    finally:
+        surface.set_palette(original)
+
+
+def present(back_buffer, display, scratch=None, method="scale", palette=None):
+    """Put an 8-bit back buffer on the display, through palette if given.
+
+    Scaling can't change the bit depth, so a smaller back buffer is scaled into
+    the 8-bit scratch surface (display sized, pass it back in every frame) and
+    only that is converted. Returns scratch.
+    """
+    source = back_buffer
+    if back_buffer.get_size() != display.get_size():
+        if scratch is None or scratch.get_size() != display.get_size():
+            scratch = pygame.Surface(display.get_size(), 0, 8)
+        scratch.set_palette(back_buffer.get_palette())
+        if method == "scale2x" and display.get_size() == tuple(2 * side for side in back_buffer.get_size()):
+            pygame.transform.scale2x(back_buffer, scratch)
+        else:
+            pygame.transform.scale(back_buffer, display.get_size(), scratch)
+        source = scratch
+    if palette is None:
+        display.blit(source, (0, 0))
+    else:
+        with swapped(source, palette):
+            display.blit(source, (0, 0))
+    return scratch
+
+
+def surface_bytes(surface):
+    """Pixel memory of a surface."""
+    return surface.get_pitch() * surface.get_height()
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    from compile_level import load_level_cached
+    from render import image_chunk_renderer
+    from sprites import load_entity_frames, load_sprite_atlas
+    from tile_cache import TileCache
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.display.set_mode((1, 1))
+    filename = sys.argv[1] if len(sys.argv) > 1 else "level/level1-1.tmx"
+    background = pygame.image.load("assets/mario-moves/level_background.png")
+    for palette in (None, SharedPalette()):
+        tmx_data = load_level_cached(filename, 2)
+        tiles = TileCache(tmx_data, 2, palette=palette)._tiles.values()
+        atlas = load_sprite_atlas(2, palette=palette)
+        frames = load_entity_frames(2, palette=palette)
+        total = sum(surface_bytes(tile) for tile in tiles if tile) + surface_bytes(atlas.surface)
+        total += sum(surface_bytes(frame) for right, left in frames.values() for frame in right + left)
+        # main2's background, stretched to 600 px high, every chunk built
+        width, height = background.get_size()
+        chunks = image_chunk_renderer(background, width * 600 // height, 600, palette=palette)
+        background_total = sum(surface_bytes(chunks._build(index)) for index in range(chunks.chunk_count))
+        label = f"8-bit, {len(palette)} colors" if palette else "32-bit"
+        print(f"{label}: {total / 1024:.0f} KB of tiles and sprites, {background_total / 1024:.0f} KB of stretched background")
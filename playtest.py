@@ -0,0 +1,153 @@
+"""Run scripted or recorded playthroughs of levels across every core.
+
+    python playtest.py level/level1-1.tmx level/level1.tmx --episodes 200 --script random
+
+Each worker process parses a level and builds its collision data the first time
+it sees it, then reuses that for every later episode on the same level.
+"""
+import argparse
+import os
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from collision import get_collision_rects
+from simulation import INPUT_JUMP, INPUT_LEFT, INPUT_RIGHT, TICK_RATE, GameState, load_level, step
+
+SCALE_FACTOR = 2
+VIEW_SIZE = (800, 400)
+MAX_TICKS = TICK_RATE * 300
+
+Episode = namedtuple("Episode", "level script seed inputs max_ticks goal_x", defaults=("run_right", 0, None, MAX_TICKS, None))
+EpisodeResult = namedtuple("EpisodeResult", "episode completed time_to_goal deaths coins ticks max_x")
+
+_levels = {}
+
+
+def script_inputs(script, seed, ticks):
+    """Per-tick input bitmasks for a named bot script."""
+    if script == "run_right":
+        return [INPUT_RIGHT] * ticks
+    if script == "run_jump":
+        return [INPUT_RIGHT | INPUT_JUMP if tick % 40 < 20 else INPUT_RIGHT for tick in range(ticks)]
+    if script == "random":
+        rng = random.Random(seed)
+        choices = (INPUT_RIGHT, INPUT_RIGHT, INPUT_RIGHT | INPUT_JUMP, INPUT_JUMP, INPUT_LEFT, 0)
+        inputs = []
+        while len(inputs) < ticks:
+            inputs.extend([rng.choice(choices)] * rng.randint(5, 30))
+        return inputs[:ticks]
+    raise ValueError(f"unknown script {script!r}")
+
+
+def _load(filename):
+    cached = _levels.get(filename)
+    if cached is None:
+        level = load_level(filename, SCALE_FACTOR, *VIEW_SIZE, compiled=True)
+        coins = get_collision_rects(level.tmx_data, SCALE_FACTOR, kinds=("coins",))
+        cached = _levels[filename] = (level, coins)
+    return cached
+
+
+def run_episode(episode):
+    level, coins = _load(episode.level)
+    inputs = episode.inputs
+    if inputs is None:
+        inputs = script_inputs(episode.script, episode.seed, episode.max_ticks)
+    goal_x = episode.goal_x if episode.goal_x is not None else level.pixel_width - level.tile_size
+    dt = 1.0 / TICK_RATE
+
+    state = GameState(level)
+    player_rect = state.player_rect
+    touched = set()
+    deaths = 0
+    max_x = player_rect.right
+    completed = False
+    tick = 0
+    for tick, tick_inputs in enumerate(inputs[:episode.max_ticks], 1):
+        rising = state.vy < 0
+        step(state, tick_inputs, dt)
+        max_x = max(max_x, player_rect.right)
+        if rising and state.vy == 0:
+            # coin blocks are solid, the player only ever touches one with its head (see LevelEdits.bump)
+            head = player_rect.move(0, -1)
+            head.height = 1
+            touched.update(head.collidelistall(coins))
+        if player_rect.right >= goal_x:
+            completed = True
+            break
+        # the floor of the view is only reachable by falling into a pit
+        if player_rect.bottom >= level.view_height:
+            deaths += 1
+            break
+
+    return EpisodeResult(
+        episode,
+        completed,
+        tick / TICK_RATE if completed else None,
+        deaths,
+        len(touched),
+        tick,
+        max_x,
+    )
+
+
+def run_episodes(episodes, workers=None):
+    """Yield an EpisodeResult for every episode as soon as it finishes."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_episode, episode) for episode in episodes]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def summarize(results):
+    summary = {}
+    for result in results:
+        level = summary.setdefault(result.episode.level, {
+            "episodes": 0, "completed": 0, "deaths": 0, "coins": 0, "ticks": 0, "time_to_goal": [],
+        })
+        level["episodes"] += 1
+        level["completed"] += result.completed
+        level["deaths"] += result.deaths
+        level["coins"] += result.coins
+        level["ticks"] += result.ticks
+        if result.time_to_goal is not None:
+            level["time_to_goal"].append(result.time_to_goal)
+    for level in summary.values():
+        times = level.pop("time_to_goal")
+        level["completion_rate"] = level["completed"] / level["episodes"]
+        level["mean_time_to_goal"] = sum(times) / len(times) if times else None
+        level["mean_coins"] = level["coins"] / level["episodes"]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("levels", nargs="+")
+    parser.add_argument("--episodes", type=int, default=100, help="episodes per level")
+    parser.add_argument("--script", default="random", choices=("run_right", "run_jump", "random"))
+    parser.add_argument("--max-ticks", type=int, default=MAX_TICKS)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    episodes = [
+        Episode(level, args.script, seed, None, args.max_ticks)
+        for level in args.levels
+        for seed in range(args.episodes)
+    ]
+    start = time.perf_counter()
+    results = []
+    for done, result in enumerate(run_episodes(episodes, args.workers), 1):
+        results.append(result)
+        if done % max(1, len(episodes) // 10) == 0:
+            print(f"{done}/{len(episodes)} episodes ({time.perf_counter() - start:.1f}s)")
+    for level, stats in summarize(results).items():
+        print(level)
+        for key, value in stats.items():
+            print(f"  {key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
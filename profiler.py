@@ -0,0 +1,180 @@
+"""Opt-in frame-time profiler for the game loop.
+
+    profiler = FrameProfiler()
+    with profiler.phase("physics"):
+        ...
+    profiler.count("blits", n)
+    profiler.end_frame(frame_ms)
+
+Per-phase times and per-frame counters go into fixed-size ring buffers, so the
+rolling p50/p95/p99 cover the last `size` frames. NullProfiler has the same API
+and does nothing, for when profiling is off.
+"""
+import csv
+import json
+import time
+from array import array
+
+import pygame
+
+
+class _Phase:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        current = self.profiler.current
+        current[self.name] = current.get(self.name, 0.0) + elapsed * 1000
+        return False
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted sequence."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class FrameProfiler:
+    def __init__(self, size=600):
+        self.size = size
+        self.index = 0
+        self.filled = 0
+        self.frames = 0
+        self.rings = {}
+        self.current = {}
+        self.metrics = {}
+        self._phases = {}
+        self._overlay = None
+        self._scale = None
+
+    def phase(self, name):
+        phase = self._phases.get(name)
+        if phase is None:
+            phase = self._phases[name] = _Phase(self, name)
+        return phase
+
+    def count(self, name, n=1):
+        self.current[name] = self.current.get(name, 0) + n
+
+    def record(self, name, value):
+        """Keep a one-off measurement, such as time to first frame, for export()."""
+        self.metrics[name] = value
+
+    def end_frame(self, frame_ms=None):
+        """Close the frame: push this frame's phase times and counters into the rings."""
+        if frame_ms is not None:
+            self.current["frame"] = frame_ms
+        for name in self.current:
+            if name not in self.rings:
+                self.rings[name] = array("d", bytes(8 * self.size))
+        for name, ring in self.rings.items():
+            ring[self.index] = self.current.get(name, 0.0)
+        self.current.clear()
+        self.index = (self.index + 1) % self.size
+        self.filled = min(self.filled + 1, self.size)
+        self.frames += 1
+
+    def stats(self):
+        stats = {}
+        for name, ring in self.rings.items():
+            values = sorted(ring[:self.filled]) if self.filled < self.size else sorted(ring)
+            stats[name] = {
+                "p50": percentile(values, 0.50),
+                "p95": percentile(values, 0.95),
+                "p99": percentile(values, 0.99),
+                "max": values[-1] if values else 0.0,
+                "mean": sum(values) / len(values) if values else 0.0,
+            }
+        return stats
+
+    def count_scale_calls(self):
+        """Wrap pygame.transform.scale so every call is counted as "scale"."""
+        if self._scale is not None:
+            return
+        self._scale = original = pygame.transform.scale
+
+        def scale(*args, **kwargs):
+            self.current["scale"] = self.current.get("scale", 0) + 1
+            return original(*args, **kwargs)
+
+        pygame.transform.scale = scale
+
+    def close(self):
+        if self._scale is not None:
+            pygame.transform.scale = self._scale
+            self._scale = None
+
+    def draw_overlay(self, surface, font, refresh=15):
+        """Blit a p50/p95/p99 table and return its rect; the text is re-rendered every `refresh` frames."""
+        if self._overlay is None or self.frames % refresh == 0:
+            lines = [f"{'phase':<10}{'p50':>7}{'p95':>7}{'p99':>7}"]
+            for name, row in self.stats().items():
+                lines.append(f"{name:<10}{row['p50']:>7.2f}{row['p95']:>7.2f}{row['p99']:>7.2f}")
+            height = font.get_linesize()
+            overlay = pygame.Surface((max(font.size(line)[0] for line in lines) + 8, height * len(lines) + 8), pygame.SRCALPHA)
+            overlay.fill((0, 0, 0, 160))
+            for row, line in enumerate(lines):
+                overlay.blit(font.render(line, False, (255, 255, 255)), (4, 4 + row * height))
+            self._overlay = overlay
+        return surface.blit(self._overlay, (4, 4))
+
+    def export(self, path):
+        """Write the rolling stats as .json, or the raw per-frame rings as .csv."""
+        if path.endswith(".csv"):
+            names = list(self.rings)
+            start = self.index if self.filled == self.size else 0
+            with open(path, "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(["index"] + names)
+                for offset in range(self.filled):
+                    slot = (start + offset) % self.size
+                    writer.writerow([offset] + [round(self.rings[name][slot], 4) for name in names])
+        else:
+            with open(path, "w") as file:
+                json.dump({"frames": self.frames, "window": self.filled, "metrics": self.metrics, "stats": self.stats()}, file, indent=2)
+
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullProfiler:
+    _phase = _NullPhase()
+
+    def phase(self, name):
+        return self._phase
+
+    def count(self, name, n=1):
+        pass
+
+    def record(self, name, value):
+        pass
+
+    def end_frame(self, frame_ms=None):
+        pass
+
+    def count_scale_calls(self):
+        pass
+
+    def close(self):
+        pass
+
+    def draw_overlay(self, surface, font, refresh=15):
+        pass
+
+    def export(self, path):
+        pass
@@ -0,0 +1,176 @@
+"""Adaptive render quality: step down through cheaper tiers when frames overrun their budget.
+
+clock.tick() only caps the frame rate, a slow machine just runs slower. The
+QualityGovernor watches how long each frame took to update and draw (the time
+clock.tick() did not spend sleeping) and when the 90th percentile of a window
+of frames gets close to 1000 / fps it moves to the next tier of TIERS. Tiers
+are cumulative:
+
+    no background    background tile layers (the sky) become one fill
+    30 Hz sprites    the entity sprite list is rebuilt every other frame
+    reduced scale    the frame is drawn at a lower scale and stretched
+    frame skip       every other frame is not drawn, the simulation keeps running
+
+It steps back up once the window has had plenty of headroom for
+`recover_frames` frames. A tier that had to be left again right after stepping
+up to it doubles that wait, so a machine on the edge settles instead of
+flickering between two tiers.
+
+    governor = QualityGovernor(60, tiers(reduced_scale=False))
+    # every frame
+    frame_ms = clock.tick(60)
+    if governor.update(clock.get_rawtime()):
+        pygame.display.set_caption(str(governor))
+    if governor.render_frame():
+        draw()
+
+    python quality.py
+"""
+from collections import deque, namedtuple
+
+from profiler import percentile
+
+Tier = namedtuple("Tier", "name background sprite_interval reduced_scale render_interval")
+
+TIERS = (
+    Tier("full", True, 1, False, 1),
+    Tier("no background", False, 1, False, 1),
+    Tier("30 Hz sprites", False, 2, False, 1),
+    Tier("reduced scale", False, 2, True, 1),
+    Tier("frame skip", False, 2, True, 2),
+)
+
+
+def tiers(background=True, sprites=True, reduced_scale=True):
+    """TIERS without the steps that change nothing where a feature doesn't apply."""
+    result = []
+    for tier in TIERS:
+        tier = tier._replace(
+            background=tier.background or not background,
+            sprite_interval=tier.sprite_interval if sprites else 1,
+            reduced_scale=tier.reduced_scale and reduced_scale,
+        )
+        if not result or tier[1:] != result[-1][1:]:
+            result.append(tier)
+    return result
+
+
+class QualityGovernor:
+    """Picks a tier from measured frame work times.
+
+    high and low are fractions of the frame budget: a window whose p90 is over
+    high steps down a tier, one that stays under low for recover_frames steps up.
+    """
+
+    def __init__(self, fps, tiers=TIERS, window=30, high=0.9, low=0.6, recover_frames=120, max_recover_frames=1920):
+        self.budget_ms = 1000 / fps
+        self.tiers = list(tiers)
+        self.index = 0
+        self.samples = deque(maxlen=window)
+        self.high = high
+        self.low = low
+        self.base_recover_frames = recover_frames
+        self.recover_frames = recover_frames
+        self.max_recover_frames = max_recover_frames
+        self.frames = 0
+        self.calm_since = None
+        self.raised_at = None  # frame of the last step up
+        self.pending_ms = 0.0
+        self.changes = 0
+
+    @property
+    def tier(self):
+        return self.tiers[self.index]
+
+    def __str__(self):
+        return f"quality tier {self.index}/{len(self.tiers) - 1}: {self.tier.name}"
+
+    def render_frame(self):
+        """Whether the current frame should be drawn."""
+        return self.frames % self.tier.render_interval == 0
+
+    def update(self, work_ms):
+        """Add the work time of the last frame; returns True when the tier changed."""
+        self.frames += 1
+        self.pending_ms += work_ms
+        interval = self.tier.render_interval
+        if self.frames % interval:
+            return False
+        # a skipped frame is cheap, judge the drawn and skipped frames together
+        self.samples.append(self.pending_ms / interval)
+        self.pending_ms = 0.0
+        if len(self.samples) < self.samples.maxlen:
+            return False
+
+        load = percentile(sorted(self.samples), 0.9)
+        if load > self.budget_ms * self.high:
+            if self.index == len(self.tiers) - 1:
+                return False
+            if self.raised_at is not None and self.frames - self.raised_at < 2 * self.recover_frames:
+                self.recover_frames = min(self.max_recover_frames, self.recover_frames * 2)
+            return self._set(self.index + 1)
+        if load < self.budget_ms * self.low and self.index > 0:
+            if self.calm_since is None:
+                self.calm_since = self.frames
+            elif self.frames - self.calm_since >= self.recover_frames:
+                self.raised_at = self.frames
+                return self._set(self.index - 1)
+        else:
+            self.calm_since = None
+        if self.raised_at is not None and self.frames - self.raised_at > self.max_recover_frames:
+            # the raised tier held, forget the back-off
+            self.recover_frames = self.base_recover_frames
+            self.raised_at = None
+        return False
+
+    def _set(self, index):
+        self.index = index
+        self.samples.clear()
+        self.calm_since = None
+        self.pending_ms = 0.0
+        self.changes += 1
+        return True
+
+
+class SpriteThrottle:
+    """Rebuilds a sprite blit list every `interval` frames and moves the last one with the camera in between.
+
+    build(frames, camera_x, camera_y) returns (image, position) pairs.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.frames = 0
+        self.cached = None
+        self.camera = None
+
+    def reset(self):
+        self.cached = None
+
+    def rebase(self, dx):
+        if self.camera is not None:
+            self.camera = (self.camera[0] - dx, self.camera[1])
+
+    def blits(self, interval, frames, camera_x, camera_y):
+        self.frames += 1
+        if interval == 1 or self.cached is None or self.frames % interval == 0:
+            self.cached = self.build(frames, camera_x, camera_y)
+            self.camera = (camera_x, camera_y)
+            return self.cached
+        dx = self.camera[0] - camera_x
+        dy = self.camera[1] - camera_y
+        return [(image, (x + dx, y + dy)) for image, (x, y) in self.cached]
+
+
+if __name__ == "__main__":
+    import random
+
+    # a box that needs 24 ms for a full frame, and another process hogging it from second 20 to 40
+    costs = {"full": 24.0, "no background": 15.0, "30 Hz sprites": 13.0, "reduced scale": 7.0, "frame skip": 4.0}
+    governor = QualityGovernor(60)
+    random.seed(1)
+    for frame in range(60 * 60):
+        load = 8.0 if 60 * 20 <= frame < 60 * 40 else 0.0
+        if governor.update(costs[governor.tier.name] + load + random.uniform(-1.0, 1.0)):
+            print(f"{frame / 60:6.2f} s  {governor}")
+    print(f"{governor.changes} changes in 60 s")
@@ -0,0 +1,310 @@
+import numpy as np
+import pygame
+import pytmx
+
+
+def visible_tile_layers(tmx_data):
+    return [layer for layer in tmx_data.visible_layers if isinstance(layer, pytmx.TiledTileLayer)]
+
+
+def visible_tile_range(tmx_data, scale_factor, camera_x, camera_y, view_width, view_height):
+    """Return (first_col, last_col, first_row, last_row) of the tiles under the camera.
+
+    The end values are exclusive and clamped to the map, so the result can be
+    fed straight into range().
+    """
+    tile_width = tmx_data.tilewidth * scale_factor
+    tile_height = tmx_data.tileheight * scale_factor
+    first_col = max(0, int(camera_x) // tile_width)
+    first_row = max(0, int(camera_y) // tile_height)
+    last_col = min(tmx_data.width, -(-(int(camera_x) + view_width) // tile_width))
+    last_row = min(tmx_data.height, -(-(int(camera_y) + view_height) // tile_height))
+    return first_col, last_col, first_row, last_row
+
+
+def draw_tile_layers(tmx_data, surface, tile_cache, scale_factor, camera_x, camera_y, layers=None):
+    """Blit the visible tile layers (or just `layers`), walking only the columns/rows on screen."""
+    tile_width = tmx_data.tilewidth * scale_factor
+    tile_height = tmx_data.tileheight * scale_factor
+    view_width, view_height = surface.get_size()
+    first_col, last_col, first_row, last_row = visible_tile_range(
+        tmx_data, scale_factor, camera_x, camera_y, view_width, view_height)
+    get_tile = tile_cache.get
+    blits = []
+    for layer in visible_tile_layers(tmx_data) if layers is None else layers:
+        data = layer.data
+        for y in range(first_row, last_row):
+            row = data[y]
+            screen_y = y * tile_height - camera_y
+            for x in range(first_col, last_col):
+                gid = row[x]
+                if gid:
+                    tile = get_tile(gid, scale_factor)
+                    if tile:
+                        blits.append((tile, (x * tile_width - camera_x, screen_y)))
+    surface.blits(blits, False)
+    return len(blits)
+
+
+def layer_color(layer, tile_cache, scale_factor):
+    """Average color of a layer's most common tile, to fill in for the layer when it is skipped."""
+    gids, counts = np.unique(np.asarray(layer.data), return_counts=True)
+    counts[gids == 0] = 0
+    tile = tile_cache.get(int(gids[counts.argmax()]), scale_factor) if counts.any() else None
+    if not tile:
+        return (0, 0, 0)
+    # average_color() ignores 8-bit palette surfaces, go through the RGB bytes
+    pixels = np.frombuffer(pygame.image.tobytes(tile, "RGB"), dtype=np.uint8).reshape(-1, 3)
+    return tuple(int(channel) for channel in pixels.mean(axis=0).round())
+
+
+def upscale(back_buffer, display, method="scale"):
+    """Stretch a native-resolution back buffer onto the display in one pass."""
+    width, height = back_buffer.get_size()
+    if method == "scale2x" and display.get_size() == (width * 2, height * 2):
+        pygame.transform.scale2x(back_buffer, display)
+    else:
+        pygame.transform.scale(back_buffer, display.get_size(), display)
+
+
+class ChunkRenderer:
+    """Level pre-rendered into fixed-width chunk surfaces, streamed with the camera.
+
+    render_chunk(chunk_surface, world_x, world_y) paints the part of the level
+    whose top left is at (world_x, world_y). Chunks under the camera and `ahead` chunks past it are
+    kept, anything more than `behind` chunks behind the camera is dropped, so
+    memory stays flat however long the level is. With a palette.SharedPalette
+    chunks are 8-bit surfaces in that palette, a quarter of the memory.
+    """
+
+    def __init__(self, render_chunk, level_width, height, chunk_width=512, ahead=1, behind=1, alpha=True, palette=None):
+        self.render_chunk = render_chunk
+        self.level_width = level_width
+        self.height = height
+        self.chunk_width = chunk_width
+        self.ahead = ahead
+        self.behind = behind
+        self.alpha = alpha
+        self.palette = palette
+        # index 0 is transparent in an 8-bit chunk
+        self.clear = 0 if palette is not None else (0, 0, 0, 0)
+        self.chunks = {}
+        self.chunk_count = -(-level_width // chunk_width)
+
+    def _build(self, index):
+        width = min(self.chunk_width, self.level_width - index * self.chunk_width)
+        if self.palette is not None:
+            chunk = self.palette.surface((width, self.height), self.alpha)
+            self.render_chunk(chunk, index * self.chunk_width, 0)
+            self.chunks[index] = chunk
+            return chunk
+        flags = pygame.SRCALPHA if self.alpha else 0
+        chunk = pygame.Surface((width, self.height), flags)
+        self.render_chunk(chunk, index * self.chunk_width, 0)
+        if pygame.display.get_surface() is not None:
+            chunk = chunk.convert_alpha() if self.alpha else chunk.convert()
+        self.chunks[index] = chunk
+        return chunk
+
+    def visible_chunks(self, camera_x, view_width):
+        first = max(0, int(camera_x) // self.chunk_width)
+        last = min(self.chunk_count, -(-(int(camera_x) + view_width) // self.chunk_width))
+        return first, last
+
+    def update(self, camera_x, view_width):
+        """Build the chunk ahead of the camera and evict the ones behind it."""
+        first, last = self.visible_chunks(camera_x, view_width)
+        keep_from = first - self.behind
+        keep_to = last + self.ahead
+        for index in [index for index in self.chunks if index < keep_from or index >= keep_to]:
+            del self.chunks[index]
+        # at most one look-ahead chunk per frame so scrolling never hitches
+        for index in range(last, min(keep_to, self.chunk_count)):
+            if index not in self.chunks:
+                self._build(index)
+                break
+
+    def rebase(self, dx):
+        """Move the built chunks dx pixels left, after an endless level rebased its coordinates."""
+        shift, rest = divmod(dx, self.chunk_width)
+        if rest:
+            self.chunks.clear()
+            return
+        self.chunks = {
+            index - shift: chunk for index, chunk in self.chunks.items()
+            if index >= shift and chunk.get_width() == self.chunk_width
+        }
+
+    def redraw(self, world_rect):
+        """Re-render only world_rect in the chunks that are built, after the level changed."""
+        for index, chunk in self.chunks.items():
+            local = world_rect.move(-index * self.chunk_width, 0).clip(chunk.get_rect())
+            if local:
+                region = chunk.subsurface(local)
+                region.fill(self.clear)
+                self.render_chunk(region, index * self.chunk_width + local.x, local.y)
+
+    def draw(self, surface, camera_x, camera_y=0):
+        view_width = surface.get_width()
+        first, last = self.visible_chunks(camera_x, view_width)
+        blits = []
+        for index in range(first, last):
+            chunk = self.chunks.get(index)
+            if chunk is None:
+                chunk = self._build(index)
+            blits.append((chunk, (index * self.chunk_width - camera_x, -camera_y)))
+        surface.blits(blits, False)
+        return len(blits)
+
+
+def tmx_chunk_renderer(tmx_data, tile_cache, scale_factor, chunk_width=512, **kwargs):
+    tile_width = tmx_data.tilewidth * scale_factor
+    # chunks have to start on a tile boundary
+    chunk_width = max(tile_width, chunk_width // tile_width * tile_width)
+
+    def render_chunk(chunk, world_x, world_y):
+        draw_tile_layers(tmx_data, chunk, tile_cache, scale_factor, world_x, world_y)
+
+    return ChunkRenderer(
+        render_chunk,
+        tmx_data.width * tile_width,
+        tmx_data.height * tmx_data.tileheight * scale_factor,
+        chunk_width,
+        **kwargs,
+    )
+
+
+def image_chunk_renderer(image, scaled_width, scaled_height, chunk_width=512, palette=None, **kwargs):
+    """Stream a background image stretched to scaled_width x scaled_height in chunks.
+
+    With a palette.SharedPalette the image is converted to it once, unscaled,
+    and the chunks are 8-bit copies of its strips.
+    """
+    alpha = bool(image.get_flags() & pygame.SRCALPHA or image.get_colorkey())
+    if palette is not None:
+        image = palette.indexed(image)
+    image_width, image_height = image.get_size()
+    x_scale = scaled_width / image_width
+
+    def render_chunk(chunk, world_x, world_y):
+        src_left = int(world_x / x_scale)
+        src_right = min(image_width, int((world_x + chunk.get_width()) / x_scale) + 2)
+        strip = image.subsurface((src_left, 0, src_right - src_left, image_height))
+        strip_width = round((src_right - src_left) * x_scale)
+        strip = pygame.transform.scale(strip, (strip_width, scaled_height))
+        chunk.blit(strip, (round(src_left * x_scale) - world_x, -world_y))
+
+    return ChunkRenderer(
+        render_chunk,
+        scaled_width,
+        scaled_height,
+        chunk_width,
+        alpha=alpha,
+        palette=palette,
+        **kwargs,
+    )
+
+
+class ScrollRenderer:
+    """Keeps last frame's world layer and scrolls it by the camera delta.
+
+    draw_world(surface, camera_x, camera_y) paints the world as seen from the
+    camera onto surface; it is only called for the strips the scroll exposes.
+    Sprites go straight onto the target with blit() and are erased next frame by
+    copying the world layer back under them. end_frame() returns the rects that
+    changed, ready for pygame.display.update().
+    """
+
+    def __init__(self, draw_world, target, background=(0, 0, 0)):
+        self.draw_world = draw_world
+        self.target = target
+        self.background = background
+        # same format as the target (display format, or an 8-bit palette back buffer)
+        self.world = target.copy()
+        self.camera = None
+        self.dirty = []
+        # rects drawn over (or changed in) the world layer, restored from it next frame
+        self._restore = []
+
+    def redraw(self, world_rect):
+        """Repaint world_rect of the world layer after the level changed."""
+        if self.camera is None:
+            return
+        camera_x, camera_y = self.camera
+        rect = world_rect.move(-camera_x, -camera_y).clip(self.world.get_rect())
+        if rect:
+            self._paint(rect, camera_x, camera_y)
+            self._restore.append(rect)
+
+    def invalidate(self):
+        """Repaint everything next frame, e.g. after the window was exposed."""
+        self.camera = None
+
+    def rebase(self, dx):
+        """The level moved dx pixels left under the camera, the world layer still matches."""
+        if self.camera is not None:
+            self.camera = (self.camera[0] - dx, self.camera[1])
+
+    def _paint(self, rect, camera_x, camera_y):
+        region = self.world.subsurface(rect)
+        region.fill(self.background)
+        return self.draw_world(region, camera_x + rect.x, camera_y + rect.y) or 0
+
+    def begin_frame(self, camera_x, camera_y=0):
+        """Scroll the world layer to the camera and put it on the target; return blit count."""
+        camera_x = int(camera_x)
+        camera_y = int(camera_y)
+        view = self.world.get_rect()
+        width, height = view.size
+        blits = 0
+        if self.camera is None:
+            blits += self._paint(view, camera_x, camera_y)
+            scrolled = True
+        else:
+            dx = camera_x - self.camera[0]
+            dy = camera_y - self.camera[1]
+            scrolled = bool(dx or dy)
+            if abs(dx) >= width or abs(dy) >= height:
+                blits += self._paint(view, camera_x, camera_y)
+            elif scrolled:
+                self.world.scroll(-dx, -dy)
+                if dx > 0:
+                    blits += self._paint(pygame.Rect(width - dx, 0, dx, height), camera_x, camera_y)
+                elif dx < 0:
+                    blits += self._paint(pygame.Rect(0, 0, -dx, height), camera_x, camera_y)
+                if dy > 0:
+                    blits += self._paint(pygame.Rect(0, height - dy, width, dy), camera_x, camera_y)
+                elif dy < 0:
+                    blits += self._paint(pygame.Rect(0, 0, width, -dy), camera_x, camera_y)
+        self.camera = (camera_x, camera_y)
+
+        if scrolled:
+            # every pixel on screen moved, one copy of the world layer is the cheapest redraw
+            self.target.blit(self.world, (0, 0))
+            self.dirty = [view]
+        else:
+            for rect in self._restore:
+                self.target.blit(self.world, rect, rect)
+            self.dirty = self._restore
+        self._restore = []
+        return blits + 1
+
+    def blit(self, image, position):
+        return self.mark(self.target.blit(image, position))
+
+    def blits(self, blit_sequence):
+        for image, position in blit_sequence:
+            self.mark(self.target.blit(image, position))
+
+    def mark(self, rect):
+        """Record a rect drawn over the world so it is updated now and erased next frame."""
+        rect = rect.clip(self.world.get_rect())
+        if rect:
+            self._restore.append(rect)
+            self.dirty.append(rect)
+        return rect
+
+    def end_frame(self):
+        dirty = self.dirty
+        self.dirty = []
+        return dirty
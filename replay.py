@@ -0,0 +1,213 @@
+"""Record the per-tick input bitmask of a session and replay it as fast as possible.
+
+    python replay.py runs/session.run [more.run ...] [--render] [--jobs 8]
+    python replay.py runs/session.run --capture clip.y4m
+
+A run file is the MRUN magic, a JSON header and the inputs run-length
+encoded as (count uint16, mask uint8) records, so a held key costs three
+bytes however long it is held. The header names the level and view size and
+holds CRC32 checksums of the whole game state (player, entities, solidity,
+level edits) every CHECKPOINT_INTERVAL ticks and at the end. Replaying feeds
+the inputs through game.World without a clock, and reports the first
+checkpoint that no longer matches, so a physics or collision change that
+alters recorded play shows up right away.
+
+The simulation is deterministic given its inputs, but a session is only
+reproducible if nothing else touched the world: hot reloads and F9 save-state
+loads are not recorded (main-test.py stops recording on a load).
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import pygame
+import pytmx
+
+from capture import FrameCapture
+from compile_level import raw_image_loader
+from game import load_world
+from render import draw_tile_layers
+from rewind import RECORD, pack_state
+from simulation import TICK_RATE
+from tile_cache import TileCache
+
+MAGIC = b"MRUN"
+VERSION = 1
+RUN = struct.Struct("<HB")
+CHECKPOINT_INTERVAL = TICK_RATE * 10
+
+ReplayResult = namedtuple("ReplayResult", "path ticks checksum expected diverged_at seconds")
+
+
+def checksum(world):
+    """CRC32 over everything a tick can change."""
+    record = bytearray(RECORD.size)
+    pack_state(world.state, record, 0, world.coins, world.edits.mark(), 0)
+    crc = zlib.crc32(record)
+    pool = world.pool
+    for values in (pool.alive, pool.active, pool.kind, pool.x, pool.y, pool.vx, pool.vy, pool.timer):
+        crc = zlib.crc32(values.tobytes(), crc)
+    return zlib.crc32(bytes(world.solidity.cells), crc)
+
+
+class InputRecorder:
+    """Collects one input bitmask per tick as runs, with checkpoints of the world."""
+
+    def __init__(self, level, scale_factor, view_width, view_height, compiled=True):
+        self.header = {
+            "version": VERSION,
+            "level": level,
+            "scale_factor": scale_factor,
+            "view": [view_width, view_height],
+            "compiled": compiled,
+            "tick_rate": TICK_RATE,
+        }
+        self.masks = array("B")
+        self.counts = array("H")
+        self.ticks = 0
+        self.checkpoints = []  # [tick, crc]
+
+    def record(self, inputs, world):
+        """Add the inputs of the tick world just ran."""
+        if self.masks and self.masks[-1] == inputs and self.counts[-1] < 0xFFFF:
+            self.counts[-1] += 1
+        else:
+            self.masks.append(inputs)
+            self.counts.append(1)
+        self.ticks += 1
+        if self.ticks % CHECKPOINT_INTERVAL == 0:
+            self.checkpoints.append([self.ticks, checksum(world)])
+
+    def truncate(self, ticks):
+        """Forget everything after `ticks`, for when the game rewound."""
+        extra = self.ticks - ticks
+        while extra > 0:
+            if self.counts[-1] > extra:
+                self.counts[-1] -= extra
+                break
+            extra -= self.counts.pop()
+            self.masks.pop()
+        self.ticks = min(self.ticks, ticks)
+        while self.checkpoints and self.checkpoints[-1][0] > ticks:
+            self.checkpoints.pop()
+
+    def save(self, path, world):
+        header = dict(self.header, ticks=self.ticks, checkpoints=self.checkpoints, checksum=checksum(world))
+        header_bytes = json.dumps(header).encode()
+        with open(path, "wb") as file:
+            file.write(MAGIC)
+            file.write(struct.pack("<I", len(header_bytes)))
+            file.write(header_bytes)
+            for count, mask in zip(self.counts, self.masks):
+                file.write(RUN.pack(count, mask))
+        return path
+
+
+def load_run(path):
+    """(header, [(count, mask)]) of a run file."""
+    with open(path, "rb") as file:
+        data = file.read()
+    if data[:4] != MAGIC:
+        raise ValueError(f"{path} is not a recorded run")
+    (header_length,) = struct.unpack_from("<I", data, 4)
+    header = json.loads(data[8:8 + header_length])
+    if header["version"] != VERSION:
+        raise ValueError(f"{path} was recorded by a different version")
+    return header, list(RUN.iter_unpack(data[8 + header_length:]))
+
+
+def replay(path, render=False, capture=None):
+    """Run a recording through a fresh World, unthrottled.
+
+    render=True draws every tick in a window, capture writes every tick to a
+    capture.FrameCapture path (.y4m, .rgb or a %05d.png pattern), window or not.
+    """
+    header, runs = load_run(path)
+    world = load_world(header["level"], header["scale_factor"], *header["view"], header["compiled"])
+    if render or capture:
+        screen = pygame.display.set_mode(header["view"]) if render else pygame.Surface(header["view"])
+        images = world.level.tmx_data
+        if not header["compiled"]:
+            # the simulation parsed the .tmx without images, draw the tiles from a second parse that has them
+            images = pytmx.TiledMap(header["level"], image_loader=raw_image_loader)
+        tile_cache = TileCache(images, header["scale_factor"])
+    # offline, so wait for the writer rather than drop frames
+    frames = FrameCapture(capture, header["view"], header["tick_rate"], drop=False) if capture else None
+    checkpoints = dict(header["checkpoints"])
+    dt = 1.0 / header["tick_rate"]
+    diverged_at = None
+    ticks = 0
+    start = time.perf_counter()
+    for count, inputs in runs:
+        for _ in range(count):
+            world.tick(inputs, dt)
+            ticks += 1
+            if render or frames:
+                draw_world(screen, world, tile_cache)
+            if frames:
+                frames.capture(screen)
+            if render:
+                pygame.event.pump()
+                pygame.display.flip()
+            if ticks in checkpoints and diverged_at is None and checksum(world) != checkpoints[ticks]:
+                diverged_at = ticks
+    if frames:
+        frames.close()
+        print(frames)
+    final = checksum(world)
+    if diverged_at is None and final != header["checksum"]:
+        diverged_at = ticks
+    return ReplayResult(path, ticks, final, header["checksum"], diverged_at, time.perf_counter() - start)
+
+
+def draw_world(surface, world, tile_cache):
+    """Tiles, plus entities and the player as plain rects."""
+    state = world.state
+    level = world.level
+    surface.fill((92, 148, 252))
+    draw_tile_layers(level.tmx_data, surface, tile_cache, level.scale_factor, state.camera_x, state.camera_y)
+    pool = world.pool
+    for index in pool.indices(active=True).tolist():
+        rect = (int(pool.x[index]) - state.camera_x, int(pool.y[index]) - state.camera_y, pool.width[index], pool.height[index])
+        pygame.draw.rect(surface, (160, 80, 0), rect)
+    pygame.draw.rect(surface, (220, 0, 0), state.player_rect.move(-state.camera_x, -state.camera_y))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replay recorded runs and check them for divergence")
+    parser.add_argument("runs", nargs="+")
+    parser.add_argument("--render", action="store_true", help="draw every tick in a window (one run at a time)")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes for headless replays")
+    parser.add_argument("--capture", help="write every tick to a .y4m, .rgb or %%05d.png path, see capture.py (one run)")
+    args = parser.parse_args()
+    if args.capture and len(args.runs) > 1:
+        parser.error("--capture records one run at a time")
+
+    if args.render or args.capture:
+        if not args.render:
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        pygame.init()
+        results = [replay(path, args.render, args.capture) for path in args.runs]
+    else:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        with ProcessPoolExecutor(args.jobs) as pool:
+            results = list(pool.map(replay, args.runs))
+
+    failed = 0
+    for result in results:
+        status = "ok" if result.diverged_at is None else f"DIVERGED by tick {result.diverged_at}"
+        speed = result.ticks / TICK_RATE / result.seconds if result.seconds else float("inf")
+        print(f"{result.path}: {result.ticks} ticks in {result.seconds:.2f}s ({speed:.0f}x real time), {status}")
+        failed += result.diverged_at is not None
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""Packed game state snapshots and a rewind ring buffer.
+
+Every tick the player, camera, coin count and level edit mark are packed into
+a fixed 59 byte struct record in a preallocated ring, so ten minutes at 60 Hz
+is about 2 MB and capturing a tick allocates nothing new. The entity pool is
+copied into a ring of NumPy keyframes every `keyframe_interval` ticks, and
+whenever the world jumps (the player respawned, a block got bumped). Restoring
+a tick between keyframes loads the keyframe before it and re-runs just the
+entity systems up to the tick, which the per-tick records hold enough input
+for, so a restore is exact. Level edits are undone through the LevelEdits
+journal.
+
+    rewinder = Rewinder(state, pool, edits)
+    # after every simulation tick
+    rewinder.capture(state, coins, contact_vy)
+    # while the rewind key is held, once per tick
+    coins = rewinder.step_back(state)
+
+pack_state()/unpack_state() work on a bare simulation.GameState too, so a
+headless run can be branched from any tick without replaying it.
+
+    python rewind.py level/level1.tmx
+"""
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from entities import interact, update_entities
+from simulation import INPUT_RIGHT, TICK_RATE, GameState, step
+
+# tick, x, y, width, height, vx, vy, flags, turn_delay, camera_x, camera_y, coins, edit mark, contact vy
+RECORD = struct.Struct("<IiiHHddBhiiiid")
+ON_GROUND, FACING_RIGHT, WALKING, MOMENTUM = 1, 2, 4, 8
+ENTITY = np.dtype([
+    ("alive", "?"), ("active", "?"), ("kind", "i1"), ("frame", "i2"),
+    ("x", "f8"), ("y", "f8"), ("vx", "f8"), ("vy", "f8"),
+    ("width", "i4"), ("height", "i4"), ("timer", "f8"),
+])
+
+
+def pack_state(state, buffer, offset=0, coins=0, edits=0, contact_vy=None):
+    """Write state into buffer at offset as one RECORD.
+
+    contact_vy is the vertical speed the player had when entities.interact ran
+    for the tick (it differs from state.vy after a stomp), default state.vy.
+    """
+    rect = state.player_rect
+    flags = (
+        (ON_GROUND if state.on_ground else 0) | (FACING_RIGHT if state.facing_right else 0)
+        | (WALKING if state.walking else 0) | (MOMENTUM if state.momentum else 0)
+    )
+    RECORD.pack_into(
+        buffer, offset, state.tick, rect.x, rect.y, rect.width, rect.height, state.vx, state.vy, flags,
+        state.turn_delay, state.camera_x, state.camera_y, coins, edits, state.vy if contact_vy is None else contact_vy)
+
+
+def unpack_state(state, buffer, offset=0):
+    """Load a RECORD into state; return (coins, edit mark, contact vy)."""
+    (state.tick, x, y, width, height, state.vx, state.vy, flags, state.turn_delay,
+     state.camera_x, state.camera_y, coins, edits, contact_vy) = RECORD.unpack_from(buffer, offset)
+    state.player_rect.update(x, y, width, height)
+    state.on_ground = bool(flags & ON_GROUND)
+    state.facing_right = bool(flags & FACING_RIGHT)
+    state.walking = bool(flags & WALKING)
+    state.momentum = bool(flags & MOMENTUM)
+    return coins, edits, contact_vy
+
+
+class Rewinder:
+    """The last `seconds` of play, restorable tick by tick.
+
+    pool (an entities.EntityPool) and edits (a level_edits.LevelEdits) are
+    optional; without them only the player and camera are rewound.
+    entity_slots caps how many pool slots a keyframe holds.
+    """
+
+    def __init__(self, state, pool=None, edits=None, seconds=600, rate=TICK_RATE, keyframe_interval=30, entity_slots=64):
+        self.pool = pool
+        self.edits = edits
+        self.rate = rate
+        self.capacity = seconds * rate
+        self.records = bytearray(self.capacity * RECORD.size)
+        self.count = 0  # ticks captured so far, the ring holds the last `capacity`
+        self.keyframe_interval = keyframe_interval
+        self.keyframes = np.zeros((self.capacity // keyframe_interval + 1 if pool else 0, entity_slots), dtype=ENTITY)
+        self.keyframe_ticks = np.full(len(self.keyframes), -1, dtype=np.int64)  # which capture each keyframe belongs to
+        self.next_keyframe = 0
+        self.last_keyframe = 0
+        self.force_keyframe = True
+        self.last_tick = 0
+        self.last_mark = 0
+        # stands in for the player while entities are re-simulated
+        self.scratch = GameState(state.level)
+
+    @property
+    def nbytes(self):
+        return len(self.records) + self.keyframes.nbytes + self.keyframe_ticks.nbytes
+
+    def _offset(self, index):
+        return index % self.capacity * RECORD.size
+
+    def capture(self, state, coins=0, contact_vy=None):
+        """Record the tick that just ran."""
+        index = self.count
+        mark = self.edits.mark() if self.edits else 0
+        pack_state(state, self.records, self._offset(index), coins, mark, contact_vy)
+        if self.pool is not None and (
+                self.force_keyframe or index - self.last_keyframe >= self.keyframe_interval
+                or state.tick != self.last_tick + 1 or mark != self.last_mark):
+            self._keyframe(index)
+        self.last_tick = state.tick
+        self.last_mark = mark
+        self.count += 1
+
+    def _keyframe(self, index):
+        pool = self.pool
+        keyframe = self.keyframes[self.next_keyframe % len(self.keyframes)]
+        slots = len(keyframe)
+        if pool.capacity > slots and pool.alive[slots:].any():
+            raise ValueError(f"more than {slots} entities, raise entity_slots")
+        used = min(slots, pool.capacity)
+        for name in ENTITY.names:
+            keyframe[name][:used] = getattr(pool, name)[:used]
+        keyframe["alive"][used:] = False
+        self.keyframe_ticks[self.next_keyframe % len(self.keyframes)] = index
+        self.next_keyframe += 1
+        self.last_keyframe = index
+        self.force_keyframe = False
+
+    def oldest(self):
+        """Index of the oldest tick that can still be restored."""
+        oldest = max(0, self.count - self.capacity)
+        if self.pool is not None:
+            kept = self.keyframe_ticks[self.keyframe_ticks >= 0]
+            oldest = max(oldest, int(kept.min())) if len(kept) else self.count
+        return oldest
+
+    def restore(self, index, state):
+        """Put state (and the pool and level) back to capture `index`; later captures are dropped.
+
+        Returns the coin count of that tick.
+        """
+        if not self.oldest() <= index < self.count:
+            raise IndexError(f"tick {index} is not in the rewind buffer")
+        coins, mark, _ = unpack_state(state, self.records, self._offset(index))
+        if self.edits:
+            self.edits.rollback(mark)
+        if self.pool is not None:
+            self._restore_entities(index, state)
+        self.count = index + 1
+        self.last_tick = state.tick
+        self.last_mark = mark
+        return coins
+
+    def _restore_entities(self, index, state):
+        ticks = self.keyframe_ticks
+        position = int(np.where(ticks <= index, ticks, -1).argmax())
+        start = int(ticks[position])
+        # keyframes after the restored tick belong to the dropped future
+        ticks[ticks > index] = -1
+        self.next_keyframe = position + 1
+        self.last_keyframe = start
+
+        pool = self.pool
+        keyframe = self.keyframes[position]
+        used = min(len(keyframe), pool.capacity)
+        for name in ENTITY.names:
+            getattr(pool, name)[:used] = keyframe[name][:used]
+        pool.alive[used:] = False
+        pool.active[used:] = False
+        pool.free = np.flatnonzero(~pool.alive)[::-1].tolist()
+
+        # replay the entity systems from the keyframe with the recorded player ticks
+        level = state.level
+        scratch = self.scratch
+        previous_vy = None
+        for replay in range(start, index + 1):
+            _, _, contact_vy = unpack_state(scratch, self.records, self._offset(replay))
+            if replay > start:
+                update_entities(pool, self._solidity(level), level.scale_factor, scratch.camera_x, level.view_width, scratch.tick, 1.0 / self.rate)
+                final_vy = scratch.vy
+                scratch.vy = contact_vy
+                interact(pool, scratch, previous_vy)
+                scratch.vy = final_vy
+            previous_vy = scratch.vy
+
+    def _solidity(self, level):
+        return self.edits.solidity if self.edits else level.solidity
+
+    def step_back(self, state, ticks=1):
+        """Rewind `ticks` ticks; returns the restored coin count, None when there is no history left."""
+        index = max(self.oldest(), self.count - 1 - ticks)
+        if index >= self.count - 1:
+            return None
+        return self.restore(index, state)
+
+    def save(self, state, coins=0):
+        """Instant save: the current state as bytes, for load().
+
+        Level edits come back only as far as undoing the ones made after the save.
+        """
+        record = bytearray(RECORD.size)
+        pack_state(state, record, 0, coins, self.edits.mark() if self.edits else 0)
+        if self.pool is None:
+            return bytes(record)
+        entities = np.zeros(self.pool.capacity, dtype=ENTITY)
+        for name in ENTITY.names:
+            entities[name] = getattr(self.pool, name)
+        return bytes(record) + entities.tobytes()
+
+    def load(self, data, state):
+        """Restore a save(); returns its coin count."""
+        coins, mark, _ = unpack_state(state, data)
+        if self.edits:
+            self.edits.rollback(mark)
+        if self.pool is not None:
+            entities = np.frombuffer(data, dtype=ENTITY, offset=RECORD.size)
+            pool = self.pool
+            if len(entities) > pool.capacity:
+                pool._grow(len(entities))
+            for name in ENTITY.names:
+                getattr(pool, name)[:len(entities)] = entities[name]
+            pool.alive[len(entities):] = False
+            pool.active[len(entities):] = False
+            pool.free = np.flatnonzero(~pool.alive)[::-1].tolist()
+        # the next capture starts a new keyframe, history before the load stays rewindable
+        self.force_keyframe = True
+        return coins
+
+
+if __name__ == "__main__":
+    from entities import EntityPool, spawn_level_entities
+    from simulation import load_level
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    filename = sys.argv[1] if len(sys.argv) > 1 else "level/level1.tmx"
+    level = load_level(filename, 2, 800, 400, tile_collision=True)
+    state = GameState(level)
+    pool = EntityPool()
+    spawn_level_entities(pool, level.tmx_data, 2)
+    rewinder = Rewinder(state, pool)
+    ticks = TICK_RATE * 60
+    target = ticks - 1 - TICK_RATE * 10
+    elapsed = 0.0
+    for index in range(ticks):
+        step(state, INPUT_RIGHT, 1.0 / TICK_RATE)
+        update_entities(pool, level.solidity, 2, state.camera_x, level.view_width, state.tick)
+        start = time.perf_counter()
+        rewinder.capture(state)
+        elapsed += time.perf_counter() - start
+        if index == target:
+            expected = state.player_rect.copy(), pool.x.copy(), pool.y.copy()
+    print(f"{rewinder.nbytes / 2 ** 20:.1f} MB for {rewinder.capacity // TICK_RATE} s, capture {elapsed / ticks * 1e6:.1f} us/tick")
+    start = time.perf_counter()
+    rewinder.restore(target, state)
+    print(f"restore 10 s back in {(time.perf_counter() - start) * 1000:.2f} ms, player at {state.player_rect.topleft}")
+    assert state.player_rect == expected[0], f"player restored to {state.player_rect}, recorded {expected[0]}"
+    assert np.array_equal(pool.x, expected[1]) and np.array_equal(pool.y, expected[2]), "entities differ from the recorded tick"
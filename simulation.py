@@ -0,0 +1,268 @@
+"""Headless, fixed-timestep game simulation.
+
+Nothing in here opens a window, loads sprites or touches the mixer, so it runs
+under SDL_VIDEODRIVER=dummy and as fast as the CPU allows. Rates are per second
+in native (unscaled) pixels and get multiplied by the level's scale factor, so
+the game plays the same at any frame rate.
+
+    python simulation.py level/level1-1.tmx 100000
+"""
+import os
+import sys
+import time
+
+import pygame
+import pytmx
+
+from collision import CollisionGrid, get_collision_rects, handle_collisions
+from compile_level import load_level_cached
+from solidity import build_solidity_map
+
+TICK_RATE = 60  # simulation steps per second
+PLAYER_WIDTH = 16
+PLAYER_HEIGHT = 16
+GRAVITY = 900  # px/s^2
+JUMP_STRENGTH = -480  # px/s
+MOVE_SPEED = 180  # px/s
+# momentum movement (main2.py): speed builds up and bleeds off instead of snapping
+ACCELERATION = 360  # px/s^2
+DECELERATION = 1080  # px/s^2
+MAX_SPEED = 120  # px/s
+TURN_DELAY = 10  # ticks showing the turn sprite after reversing
+PLAYER_START = (50, 50)  # native px, scaled like the player size
+
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_JUMP = 4
+# not used by step(): the game loop acts on them, they are here so recordings carry them
+INPUT_MUTE = 8
+INPUT_QUIT = 16
+
+
+class Level:
+    """Static level data the simulation needs: size and collision grid.
+
+    With tile_collision=True the player collides with the level's solidity
+    bitmap instead of the collision objects.
+    """
+
+    def __init__(self, tmx_data, scale_factor, view_width, view_height, tile_collision=False):
+        self.tmx_data = tmx_data
+        self.scale_factor = scale_factor
+        self.view_width = view_width
+        self.view_height = view_height
+        self.tile_size = tmx_data.tilewidth * scale_factor
+        self.pixel_width = tmx_data.width * tmx_data.tilewidth * scale_factor
+        self.collision_rects = get_collision_rects(tmx_data, scale_factor)
+        self.collision_grid = CollisionGrid(self.collision_rects, self.tile_size)
+        self.solidity = build_solidity_map(tmx_data, scale_factor) if tile_collision else None
+
+
+def load_level(filename, scale_factor, view_width, view_height, compiled=False, tile_collision=False):
+    """Parse a level without loading any tile images.
+
+    With compiled=True the level comes from its compile_level .lvl file instead,
+    which is rebuilt first if the .tmx changed.
+    """
+    if compiled:
+        return Level(load_level_cached(filename, scale_factor), scale_factor, view_width, view_height, tile_collision)
+    return Level(pytmx.TiledMap(filename), scale_factor, view_width, view_height, tile_collision)
+
+
+class GameState:
+    def __init__(self, level, x=None, y=None, momentum=False):
+        """x and y are world pixels, default PLAYER_START at the level's scale."""
+        scale = level.scale_factor
+        x = PLAYER_START[0] * scale if x is None else x
+        y = PLAYER_START[1] * scale if y is None else y
+        self.level = level
+        self.momentum = momentum
+        self.player_rect = pygame.Rect(x, y, PLAYER_WIDTH * scale, PLAYER_HEIGHT * scale)
+        self.vx = 0
+        self.vy = 0
+        self.on_ground = False
+        self.facing_right = True
+        self.walking = False
+        self.turn_delay = 0
+        self.camera_x = 0
+        self.camera_y = 0
+        self.tick = 0
+
+    def copy(self):
+        state = GameState.__new__(GameState)
+        state.__dict__.update(self.__dict__)
+        state.player_rect = self.player_rect.copy()
+        return state
+
+
+def inputs_from_keys(keys):
+    inputs = 0
+    if keys[pygame.K_a]:
+        inputs |= INPUT_LEFT
+    if keys[pygame.K_d]:
+        inputs |= INPUT_RIGHT
+    if keys[pygame.K_SPACE]:
+        inputs |= INPUT_JUMP
+    if keys[pygame.K_m]:
+        inputs |= INPUT_MUTE
+    if keys[pygame.K_q]:
+        inputs |= INPUT_QUIT
+    return inputs
+
+
+def step(state, inputs, dt):
+    """Advance `state` by dt seconds with the given input bitmask."""
+    level = state.level
+    scale = level.scale_factor
+    # divide by the rate instead of multiplying by dt, 1/60 is not exact in binary
+    rate = 1.0 / dt
+    player_rect = state.player_rect
+
+    if state.momentum:
+        _step_momentum(state, inputs, scale, rate)
+    else:
+        state.vx = 0
+        if inputs & INPUT_LEFT:
+            state.vx = -MOVE_SPEED * scale
+            state.facing_right = False
+        if inputs & INPUT_RIGHT:
+            state.vx = MOVE_SPEED * scale
+            state.facing_right = True
+        state.walking = state.vx != 0
+
+    if inputs & INPUT_JUMP and state.on_ground:
+        state.vy = JUMP_STRENGTH * scale
+        state.on_ground = False
+
+    state.vy += GRAVITY * scale / rate
+    dx = state.vx / rate
+    dy = state.vy / rate
+    if level.solidity is not None:
+        player_rect, dy, state.on_ground = level.solidity.move(player_rect, dx, dy)
+    else:
+        player_rect, dy, state.on_ground = handle_collisions(player_rect, dx, dy, level.collision_grid)
+    if dy == 0:
+        state.vy = 0
+
+    # Prevent Mario from going off-screen
+    if player_rect.left < 0:
+        player_rect.left = 0
+    if player_rect.right > level.pixel_width:
+        player_rect.right = level.pixel_width
+    if player_rect.top < 0:
+        player_rect.top = 0
+    if player_rect.bottom > level.view_height:
+        player_rect.bottom = level.view_height
+        state.vy = 0
+        state.on_ground = True
+
+    middle_x = level.view_width // 2
+    if player_rect.centerx >= middle_x and state.vx > 0:
+        state.camera_x += int(min(player_rect.centerx - middle_x, dx))
+
+    max_camera_x = level.pixel_width - level.view_width
+    if state.camera_x < 0:
+        state.camera_x = 0
+    elif state.camera_x > max_camera_x:
+        state.camera_x = max_camera_x
+
+    state.tick += 1
+    return state
+
+
+def _step_momentum(state, inputs, scale, rate):
+    if state.turn_delay > 0:
+        state.turn_delay -= 1
+    max_speed = MAX_SPEED * scale
+    if inputs & INPUT_RIGHT:
+        if not state.facing_right and state.walking:
+            state.turn_delay = TURN_DELAY
+            state.facing_right = True
+            state.walking = False
+        else:
+            if state.vx < max_speed:
+                state.vx += ACCELERATION * scale / rate
+            state.walking = True
+    elif inputs & INPUT_LEFT:
+        if state.facing_right and state.walking:
+            state.turn_delay = TURN_DELAY
+            state.facing_right = False
+            state.walking = False
+        else:
+            if state.vx > -max_speed:
+                state.vx -= ACCELERATION * scale / rate
+            state.walking = True
+    else:
+        state.walking = False
+
+    if not state.walking:
+        deceleration = DECELERATION * scale / rate
+        if state.vx > 0:
+            state.vx = max(0, state.vx - deceleration)
+        elif state.vx < 0:
+            state.vx = min(0, state.vx + deceleration)
+
+
+class FixedTimestep:
+    """Accumulator that turns variable frame times into whole simulation steps.
+
+    advance() returns how many steps to run for the frame that just took
+    frame_time seconds; alpha is how far the frame sits between the last two
+    steps, for the renderer to interpolate with. A frame never runs more than
+    max_steps so a long stall can't snowball.
+    """
+
+    def __init__(self, rate=TICK_RATE, max_steps=5):
+        self.dt = 1.0 / rate
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+
+    def advance(self, frame_time):
+        self.accumulator += frame_time
+        steps = int(self.accumulator / self.dt)
+        if steps > self.max_steps:
+            steps = self.max_steps
+            self.accumulator = 0.0
+        else:
+            self.accumulator -= steps * self.dt
+        return steps
+
+    @property
+    def alpha(self):
+        return self.accumulator / self.dt
+
+
+def interpolate(previous, current, alpha):
+    """Return (player_x, player_y, camera_x, camera_y) blended between two steps."""
+    prev_rect = previous.player_rect
+    rect = current.player_rect
+    return (
+        round(prev_rect.x + (rect.x - prev_rect.x) * alpha),
+        round(prev_rect.y + (rect.y - prev_rect.y) * alpha),
+        round(previous.camera_x + (current.camera_x - previous.camera_x) * alpha),
+        round(previous.camera_y + (current.camera_y - previous.camera_y) * alpha),
+    )
+
+
+def run(state, inputs, ticks, dt=1.0 / TICK_RATE):
+    """Step `ticks` times as fast as possible. inputs is a bitmask or a per-tick sequence."""
+    if isinstance(inputs, int):
+        for _ in range(ticks):
+            step(state, inputs, dt)
+    else:
+        for tick_inputs in inputs[:ticks]:
+            step(state, tick_inputs, dt)
+    return state
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    filename = sys.argv[1] if len(sys.argv) > 1 else "level/level1-1.tmx"
+    ticks = int(sys.argv[2]) if len(sys.argv) > 2 else 60 * 60
+    level = load_level(filename, 2, 800, 400)
+    state = GameState(level)
+    start = time.perf_counter()
+    run(state, INPUT_RIGHT, ticks)
+    elapsed = time.perf_counter() - start
+    print(f"{ticks} ticks in {elapsed:.3f}s ({ticks / elapsed:.0f} ticks/s, {ticks / elapsed / TICK_RATE:.0f}x real time)")
+    print(f"player at {state.player_rect.topleft}, camera_x {state.camera_x}")
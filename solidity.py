@@ -0,0 +1,192 @@
+"""Per-tile solidity bitmap for O(1) ground and wall queries.
+
+The bitmap has one byte per tile, row-major, 1 where the tile is solid. It is
+built once from the tileset's `blocked` tile property (level1.tmx); maps
+without tile properties (level1-1.tmx) fall back to rasterizing their
+collision objects. A per-column "first solid row at or below" table turns
+ground lookups into a single index.
+"""
+from array import array
+
+from collision import get_collision_rects
+from render import visible_tile_layers
+
+SOLID_PROPERTIES = ("blocked",)
+
+
+def solid_gids(tmx_data, properties=SOLID_PROPERTIES):
+    return {gid for gid, props in tmx_data.tile_properties.items() if any(name in props for name in properties)}
+
+
+def tiles_under(rect, tile_width, tile_height, width, height):
+    """(first_x, last_x, first_y, last_y) of the tiles whose centre rect covers, ends exclusive."""
+    first_x = max(0, -(-(2 * rect.left - tile_width) // (2 * tile_width)))
+    last_x = min(width, -(-(2 * rect.right - tile_width) // (2 * tile_width)))
+    first_y = max(0, -(-(2 * rect.top - tile_height) // (2 * tile_height)))
+    last_y = min(height, -(-(2 * rect.bottom - tile_height) // (2 * tile_height)))
+    return first_x, last_x, first_y, last_y
+
+
+def solidity_cells(tmx_data, properties=SOLID_PROPERTIES):
+    """The bitmap as a bytearray of width * height cells."""
+    if hasattr(tmx_data, "solidity_cells"):
+        # compiled levels store the bitmap
+        return tmx_data.solidity_cells()
+    width, height = tmx_data.width, tmx_data.height
+    cells = bytearray(width * height)
+    gids = solid_gids(tmx_data, properties)
+    if gids:
+        for layer in visible_tile_layers(tmx_data):
+            for y, row in enumerate(layer.data):
+                base = y * width
+                for x, gid in enumerate(row):
+                    if gid in gids:
+                        cells[base + x] = 1
+        return cells
+
+    # a tile counts as solid when a collision object covers its centre
+    tile_width, tile_height = tmx_data.tilewidth, tmx_data.tileheight
+    for rect in get_collision_rects(tmx_data, 1):
+        first_x, last_x, first_y, last_y = tiles_under(rect, tile_width, tile_height, width, height)
+        for y in range(first_y, last_y):
+            cells[y * width + first_x:y * width + last_x] = b"\1" * max(0, last_x - first_x)
+    return cells
+
+
+class SolidityMap:
+    def __init__(self, cells, width, height, tile_size):
+        self.cells = cells
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.below = array("H", bytes(2 * width * height))
+        for x in range(width):
+            self._index_column(x)
+
+    def _index_column(self, x):
+        cells, below, width = self.cells, self.below, self.width
+        first = self.height
+        for y in range(self.height - 1, -1, -1):
+            index = y * width + x
+            if cells[index]:
+                first = y
+            below[index] = first
+
+    def set_solid(self, tile_x, tile_y, solid=True):
+        """Change one tile; only its column of the below table is rebuilt."""
+        self.cells[tile_y * self.width + tile_x] = 1 if solid else 0
+        self._index_column(tile_x)
+
+    def update(self, changes):
+        """Change many tiles from (cell index, solid) pairs; each touched column is rebuilt once."""
+        columns = set()
+        for index, solid in changes:
+            self.cells[index] = 1 if solid else 0
+            columns.add(index % self.width)
+        for x in columns:
+            self._index_column(x)
+
+    def shift(self, columns, new_cells):
+        """Drop the first `columns` columns and append new ones, for levels streamed in (endless.EndlessMap).
+
+        new_cells is row-major, `columns` cells per row; only the new columns are indexed.
+        """
+        cells, below, width = self.cells, self.below, self.width
+        keep = width - columns
+        for y in range(self.height):
+            base = y * width
+            cells[base:base + keep] = cells[base + columns:base + width]
+            cells[base + keep:base + width] = new_cells[y * columns:(y + 1) * columns]
+            below[base:base + keep] = below[base + columns:base + width]
+        for x in range(keep, width):
+            self._index_column(x)
+
+    def is_solid(self, tile_x, tile_y):
+        """Outside the map nothing is solid, so pits stay pits."""
+        if 0 <= tile_x < self.width and 0 <= tile_y < self.height:
+            return self.cells[tile_y * self.width + tile_x] != 0
+        return False
+
+    def first_solid_below(self, tile_x, tile_y):
+        """Row of the first solid tile at or below tile_y in the column, or None."""
+        if not 0 <= tile_x < self.width or tile_y >= self.height:
+            return None
+        row = self.below[max(0, tile_y) * self.width + tile_x]
+        return row if row < self.height else None
+
+    def ground_top(self, rect):
+        """Pixel y of the first ground under the centre of rect, or None over a pit."""
+        row = self.first_solid_below(rect.centerx // self.tile_size, rect.bottom // self.tile_size)
+        return None if row is None else row * self.tile_size
+
+    def on_ground(self, rect):
+        tile_y = rect.bottom // self.tile_size
+        return self._span_solid(range(rect.left // self.tile_size, (rect.right - 1) // self.tile_size + 1), tile_y)
+
+    def _span_solid(self, columns, tile_y):
+        if not 0 <= tile_y < self.height:
+            return False
+        base = tile_y * self.width
+        cells = self.cells
+        return any(cells[base + x] for x in columns if 0 <= x < self.width)
+
+    def _column_solid(self, tile_x, rows):
+        if not 0 <= tile_x < self.width:
+            return False
+        cells, width = self.cells, self.width
+        return any(cells[y * width + tile_x] for y in rows if 0 <= y < self.height)
+
+    def move(self, rect, vx, vy):
+        """Swept AABB move against the grid, same contract as collision.handle_collisions.
+
+        Each axis walks the tile columns (rows) between the old and new edge and
+        stops at the first solid one, so fast movers can't tunnel through tiles.
+        """
+        size = self.tile_size
+        target = rect.copy()
+        target.x += vx
+        dx = target.x - rect.x
+        rows = range(rect.top // size, (rect.bottom - 1) // size + 1)
+        if dx > 0:
+            for tile_x in range((rect.right - 1) // size + 1, (rect.right + dx - 1) // size + 1):
+                if self._column_solid(tile_x, rows):
+                    rect.right = tile_x * size
+                    break
+            else:
+                rect.x += dx
+        elif dx < 0:
+            for tile_x in range(rect.left // size - 1, (rect.left + dx) // size - 1, -1):
+                if self._column_solid(tile_x, rows):
+                    rect.left = (tile_x + 1) * size
+                    break
+            else:
+                rect.x += dx
+
+        target = rect.copy()
+        target.y += vy
+        dy = target.y - rect.y
+        columns = range(rect.left // size, (rect.right - 1) // size + 1)
+        on_ground = False
+        if dy > 0:
+            for tile_y in range((rect.bottom - 1) // size + 1, (rect.bottom + dy - 1) // size + 1):
+                if self._span_solid(columns, tile_y):
+                    rect.bottom = tile_y * size
+                    vy = 0
+                    on_ground = True
+                    break
+            else:
+                rect.y += dy
+        elif dy < 0:
+            for tile_y in range(rect.top // size - 1, (rect.top + dy) // size - 1, -1):
+                if self._span_solid(columns, tile_y):
+                    rect.top = (tile_y + 1) * size
+                    vy = 0
+                    break
+            else:
+                rect.y += dy
+        return rect, vy, on_ground
+
+
+def build_solidity_map(tmx_data, scale_factor, properties=SOLID_PROPERTIES):
+    cells = solidity_cells(tmx_data, properties)
+    return SolidityMap(cells, tmx_data.width, tmx_data.height, tmx_data.tilewidth * scale_factor)
@@ -0,0 +1,204 @@
+"""Mario sprite atlas and animator.
+
+All frames are packed into one texture with a frame table, built once per scale
+factor and cached in assets/.cache. Only right-facing frames are read from
+assets/mario-moves, left-facing ones are made with pygame.transform.flip when
+the atlas is built. Frames are looked up by integer (size, action, direction,
+frame) indices instead of nested dicts and f-string keys.
+"""
+import json
+import os
+
+import pygame
+
+SPRITE_DIR = "assets/mario-moves"
+CACHE_DIR = "assets/.cache"
+CHARACTER_SHEET = "assets/characters.gif"
+CHARACTER_SHEET_KEY = (107, 49, 156)
+# left-facing walk cycles in the character sheet, (x, y, width, height)
+ENEMY_FRAMES = {
+    "goomba": ((296, 187, 16, 16), (315, 187, 16, 16)),
+    "koopa": ((182, 206, 16, 24), (201, 206, 16, 24)),
+}
+
+SIZES = ("small", "big")
+SMALL, BIG = range(len(SIZES))
+ACTIONS = ("idle", "walk", "jump", "turn")
+IDLE, WALK, JUMP, TURN = range(len(ACTIONS))
+DIRECTIONS = ("right", "left")
+RIGHT, LEFT = range(len(DIRECTIONS))
+
+# right-facing source frames per action, {size} is filled in from SIZES
+SOURCE_FRAMES = {
+    IDLE: ("{size}_idle_right",),
+    WALK: ("{size}_walk1_right", "{size}_walk2_right", "{size}_walk3_right"),
+    JUMP: ("{size}_jump_right",),
+    # turning to face right; flipped it is the right-to-left turn
+    TURN: ("{size}_turn_left_to_right",),
+}
+
+
+def _key(size, action, direction):
+    return (size * len(ACTIONS) + action) * len(DIRECTIONS) + direction
+
+
+def _source_paths():
+    return [
+        os.path.join(SPRITE_DIR, name.format(size=size) + ".png")
+        for size in SIZES
+        for action in range(len(ACTIONS))
+        for name in SOURCE_FRAMES[action]
+    ]
+
+
+def build_sprite_atlas(scale_factor):
+    """Pack every frame, both directions, into one surface; return (surface, table)."""
+    frames = []
+    ranges = [None] * (len(SIZES) * len(ACTIONS) * len(DIRECTIONS))
+    for size, size_name in enumerate(SIZES):
+        for action in range(len(ACTIONS)):
+            images = []
+            for name in SOURCE_FRAMES[action]:
+                image = pygame.image.load(os.path.join(SPRITE_DIR, name.format(size=size_name) + ".png"))
+                images.append(pygame.transform.scale(image, (image.get_width() * scale_factor, image.get_height() * scale_factor)))
+            for direction in range(len(DIRECTIONS)):
+                ranges[_key(size, action, direction)] = (len(frames), len(images))
+                for image in images:
+                    frames.append(pygame.transform.flip(image, True, False) if direction == LEFT else image)
+
+    width = sum(frame.get_width() for frame in frames)
+    height = max(frame.get_height() for frame in frames)
+    surface = pygame.Surface((width, height), pygame.SRCALPHA)
+    rects = []
+    x = 0
+    for frame in frames:
+        surface.blit(frame, (x, 0), special_flags=pygame.BLEND_RGBA_MAX)
+        rects.append((x, 0, frame.get_width(), frame.get_height()))
+        x += frame.get_width()
+    return surface, {"rects": rects, "ranges": ranges}
+
+
+def player_pose(state):
+    """(action, direction, frame) to draw a simulation.GameState with."""
+    direction = RIGHT if state.facing_right else LEFT
+    if state.vx != 0:
+        action = WALK
+    elif state.vy != 0:
+        action = JUMP
+    else:
+        action = IDLE
+    return action, direction, state.tick // 10
+
+
+class SpriteAtlas:
+    def __init__(self, surface, table):
+        self.surface = surface
+        self.frames = [surface.subsurface(rect) for rect in table["rects"]]
+        self.ranges = [tuple(entry) for entry in table["ranges"]]
+
+    def frame(self, size, action, direction, frame=0):
+        start, count = self.ranges[_key(size, action, direction)]
+        return self.frames[start + frame % count]
+
+    def frame_count(self, size, action, direction):
+        return self.ranges[_key(size, action, direction)][1]
+
+    def translucent(self, alpha):
+        """Another atlas over the same pixels whose frames blit with surface alpha, e.g. for ghosts."""
+        atlas = SpriteAtlas.__new__(SpriteAtlas)
+        atlas.surface = self.surface
+        atlas.frames = [self.surface.subsurface((frame.get_offset(), frame.get_size())) for frame in self.frames]
+        for frame in atlas.frames:
+            frame.set_alpha(alpha)
+        atlas.ranges = self.ranges
+        return atlas
+
+
+def load_sprite_atlas(scale_factor, cache_dir=CACHE_DIR, palette=None):
+    """Load the cached atlas for scale_factor, rebuilding it if any source frame is newer.
+
+    With a palette.SharedPalette the atlas is turned into an 8-bit surface in it.
+    """
+    image_path = os.path.join(cache_dir, f"mario_atlas_{scale_factor}x.png")
+    table_path = os.path.join(cache_dir, f"mario_atlas_{scale_factor}x.json")
+    newest_source = max(os.path.getmtime(path) for path in _source_paths())
+    try:
+        fresh = min(os.path.getmtime(image_path), os.path.getmtime(table_path)) >= newest_source
+    except OSError:
+        fresh = False
+
+    if fresh:
+        surface = pygame.image.load(image_path)
+        with open(table_path) as file:
+            table = json.load(file)
+    else:
+        surface, table = build_sprite_atlas(scale_factor)
+        os.makedirs(cache_dir, exist_ok=True)
+        pygame.image.save(surface, image_path)
+        with open(table_path, "w") as file:
+            json.dump(table, file)
+    if palette is not None:
+        surface = palette.indexed(surface)
+    elif pygame.display.get_surface() is not None:
+        surface = surface.convert_alpha()
+    return SpriteAtlas(surface, table)
+
+
+class Animator:
+    """Current frame of one animated sprite.
+
+    set() picks the action and direction, update() advances the walk cycle
+    every frame_delay ticks, image is the subsurface to blit.
+    """
+
+    def __init__(self, atlas, size=SMALL, frame_delay=10):
+        self.atlas = atlas
+        self.size = size
+        self.action = IDLE
+        self.direction = RIGHT
+        self.frame = 0
+        self.frame_delay = frame_delay
+        self.counter = 0
+
+    def set(self, action, direction):
+        self.action = action
+        self.direction = direction
+
+    def update(self):
+        self.counter += 1
+        if self.counter >= self.frame_delay:
+            self.counter = 0
+            self.frame += 1
+
+    @property
+    def image(self):
+        return self.atlas.frame(self.size, self.action, self.direction, self.frame)
+
+
+def load_entity_frames(scale_factor, palette=None):
+    """{name: (right frames, left frames)} for the enemies in ENEMY_FRAMES plus a coin.
+
+    With a palette.SharedPalette the frames are 8-bit surfaces in it.
+    """
+    sheet = pygame.image.load(CHARACTER_SHEET)
+    sheet.set_colorkey(CHARACTER_SHEET_KEY)
+    convert = pygame.display.get_surface() is not None
+    frames = {}
+    for name, rects in ENEMY_FRAMES.items():
+        left = []
+        for rect in rects:
+            image = pygame.transform.scale_by(sheet.subsurface(rect), scale_factor)
+            if palette is not None:
+                image = palette.indexed(image)
+            elif convert:
+                image = image.convert_alpha()
+            left.append(image)
+        frames[name] = ([pygame.transform.flip(image, True, False) for image in left], left)
+
+    coin = pygame.Surface((16 * scale_factor, 16 * scale_factor), pygame.SRCALPHA)
+    pygame.draw.ellipse(coin, (252, 188, 60), (3 * scale_factor, scale_factor, 10 * scale_factor, 14 * scale_factor))
+    pygame.draw.ellipse(coin, (200, 76, 12), (3 * scale_factor, scale_factor, 10 * scale_factor, 14 * scale_factor), scale_factor)
+    if palette is not None:
+        coin = palette.indexed(coin)
+    frames["coin"] = ((coin,), (coin,))
+    return frames
@@ -0,0 +1,92 @@
+from collections import OrderedDict
+
+import pygame
+
+from render import visible_tile_layers
+
+_MISSING = object()
+
+
+class TileCache:
+    """Scaled, display-converted tile images keyed by (gid, scale_factor).
+
+    Tiles are built once instead of going through pygame.transform.scale on
+    every draw. With eager=True every gid used by the visible tile layers is
+    built up front, otherwise tiles are built the first time they are drawn.
+    max_size turns the cache into an LRU that keeps at most that many tiles.
+    With a palette.SharedPalette tiles are 8-bit surfaces in that palette.
+    """
+
+    def __init__(self, tmx_data, scale_factor, eager=True, max_size=None, palette=None):
+        self.tmx_data = tmx_data
+        self.scale_factor = scale_factor
+        self.max_size = max_size
+        self.palette = palette
+        self._tiles = OrderedDict()
+        if eager:
+            self.warm()
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def used_gids(self):
+        gids = set()
+        for layer in visible_tile_layers(self.tmx_data):
+            for row in layer.data:
+                gids.update(row)
+        gids.discard(0)
+        return gids
+
+    def warm(self, scale_factor=None):
+        """Build every tile used by the map so drawing never has to."""
+        gids = self.used_gids()
+        if self.max_size is not None:
+            gids = sorted(gids)[:self.max_size]
+        for gid in gids:
+            self.get(gid, scale_factor)
+
+    def get(self, gid, scale_factor=None):
+        if scale_factor is None:
+            scale_factor = self.scale_factor
+        key = (gid, scale_factor)
+        tile = self._tiles.get(key, _MISSING)
+        if tile is _MISSING:
+            tile = self._build(gid, scale_factor)
+            self._tiles[key] = tile
+            if self.max_size is not None and len(self._tiles) > self.max_size:
+                self._tiles.popitem(last=False)
+        elif self.max_size is not None:
+            self._tiles.move_to_end(key)
+        return tile
+
+    def invalidate(self, gid=None):
+        if gid is None:
+            self._tiles.clear()
+            return
+        for key in [key for key in self._tiles if key[0] == gid]:
+            del self._tiles[key]
+
+    def _build(self, gid, scale_factor):
+        if not gid:
+            return None
+        tile = self.tmx_data.get_tile_image_by_gid(gid)
+        if not tile:
+            return None
+        size = (self.tmx_data.tilewidth * scale_factor, self.tmx_data.tileheight * scale_factor)
+        if tile.get_size() != size:
+            tile = pygame.transform.scale(tile, size)
+        if self.palette is not None:
+            return self.palette.indexed(tile)
+        # convert() needs a display mode, headless callers get the raw scaled tile
+        if pygame.display.get_surface() is None:
+            return tile
+        if is_opaque(tile):
+            return tile.convert()
+        return tile.convert_alpha()
+
+
+def is_opaque(surface):
+    if not surface.get_flags() & pygame.SRCALPHA:
+        return surface.get_colorkey() is None
+    width, height = surface.get_size()
+    return pygame.mask.from_surface(surface, 254).count() == width * height